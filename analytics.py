@@ -0,0 +1,224 @@
+# ----------------------------------------------------------------------------#
+# Show rollups for /analytics.
+#
+# Shows per venue, per artist and per city are counted by month in the
+# *MonthlyShows tables. Inserting, deleting or moving a Show through the ORM
+# adjusts the counts in the same transaction (mapper events below), and so
+# does moving a Venue to another city, so the reports never group over Show
+# itself. They are not left to a job (jobs.py): a count is a delta, and a job
+# may run twice. Keeping them in the transaction costs one Venue lookup and
+# three upserts by key per show. Rows removed with bulk Query.delete() or
+# plain SQL bypass the events: correct the counts with
+# `flask analytics backfill` afterwards.
+# ----------------------------------------------------------------------------#
+
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import event, func, inspect, select, text
+
+from models import (db, Venue, Artist, Show, VenueMonthlyShows, ArtistMonthlyShows,
+                    CityMonthlyShows)
+
+ROLLUPS = {
+    # table: key columns
+    'VenueMonthlyShows': ('venue_id', 'month'),
+    'ArtistMonthlyShows': ('artist_id', 'month'),
+    'CityMonthlyShows': ('city', 'state', 'month'),
+}
+
+# ON CONFLICT works the same on Postgres (9.5+) and SQLite (3.24+)
+UPSERT = '''
+    INSERT INTO "{table}" ({columns}, shows) VALUES ({values}, :shows)
+    ON CONFLICT ({columns}) DO UPDATE SET shows = "{table}".shows + excluded.shows
+'''
+
+
+def month_of(value):
+    if isinstance(value, str):
+        # the show form hands the date over as a string
+        from dateutil.parser import parse
+        value = parse(value)
+    return date(value.year, value.month, 1)
+
+
+def show_keys(connection, venue_id, artist_id, when):
+    """{table: key} of the rollup rows one show counts towards."""
+    month = month_of(when)
+    city, state = connection.execute(
+        text('SELECT city, state FROM "Venue" WHERE id = :id'), {'id': venue_id}).first() or (None, None)
+    return {
+        'VenueMonthlyShows': (venue_id, month),
+        'ArtistMonthlyShows': (artist_id, month),
+        'CityMonthlyShows': (city or '', state or '', month),
+    }
+
+
+def apply(connection, deltas):
+    """Add Counter {(table, key): change} to the rollups."""
+    by_table = {}
+    for (table, key), change in deltas.items():
+        if change:
+            by_table.setdefault(table, []).append(dict(zip(ROLLUPS[table], key), shows=change))
+    for table, rows in by_table.items():
+        columns = ROLLUPS[table]
+        connection.execute(text(UPSERT.format(
+            table=table, columns=', '.join(columns),
+            values=', '.join(':' + column for column in columns))), rows)
+
+
+# ----------------------------------------------------------------------------#
+# Keeping the rollups current.
+# ----------------------------------------------------------------------------#
+
+def count(connection, venue_id, artist_id, when, change):
+    if venue_id is None or artist_id is None or when is None:
+        return
+    apply(connection, Counter({(table, key): change for table, key
+                               in show_keys(connection, venue_id, artist_id, when).items()}))
+
+
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, show):
+    count(connection, show.venue_id, show.artist_id, show.date, 1)
+
+
+# before the DELETE, the row is still there to load expired attributes from
+@event.listens_for(Show, 'before_delete')
+def show_deleted(mapper, connection, show):
+    count(connection, show.venue_id, show.artist_id, show.date, -1)
+
+
+@event.listens_for(Show, 'after_update')
+def show_updated(mapper, connection, show):
+    state = inspect(show)
+    old = {}
+    for name in ('venue_id', 'artist_id', 'date'):
+        history = state.attrs[name].history
+        if history.deleted:
+            old[name] = history.deleted[0]
+    if old:
+        count(connection, old.get('venue_id', show.venue_id), old.get('artist_id', show.artist_id),
+              old.get('date', show.date), -1)
+        count(connection, show.venue_id, show.artist_id, show.date, 1)
+
+
+# a venue's shows count towards the city it is in now, the one show_keys reads
+@event.listens_for(Venue, 'after_update')
+def venue_moved(mapper, connection, venue):
+    state = inspect(venue)
+    old = {}
+    for name in ('city', 'state'):
+        history = state.attrs[name].history
+        if history.deleted:
+            old[name] = history.deleted[0]
+    was = (old.get('city', venue.city) or '', old.get('state', venue.state) or '')
+    now = (venue.city or '', venue.state or '')
+    if was == now:
+        return
+    deltas = Counter()
+    rows = connection.execute(select([VenueMonthlyShows.month, VenueMonthlyShows.shows])
+                              .where(VenueMonthlyShows.venue_id == venue.id))
+    for month, shows in rows:
+        deltas['CityMonthlyShows', was + (month,)] -= shows
+        deltas['CityMonthlyShows', now + (month,)] += shows
+    apply(connection, deltas)
+
+
+def backfill(batch_size=5000, progress=None):
+    """Correct the rollups from Show. The shows and the rollups are read in
+    one snapshot, without locking anything, and the differences are then
+    added in one short transaction. The events' own additions since the
+    snapshot commute with them, so nothing changed meanwhile is lost, and
+    the rollups are never published empty or half written."""
+    options = {'read_only': True, 'stream_results': True}
+    if db.engine.dialect.name == 'postgresql':
+        options['isolation_level'] = 'REPEATABLE READ'
+    shows = db.session.query(Show.venue_id, Show.artist_id, Show.date, Venue.city, Venue.state) \
+        .join(Venue, Show.venue_id == Venue.id) \
+        .filter(Show.artist_id.isnot(None), Show.date.isnot(None)).statement
+    deltas = Counter()
+    done = 0
+    # the snapshot needs a transaction of its own
+    db.session.commit()
+    connection = db.session.connection(execution_options=options)
+    result = connection.execute(shows)
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        for venue_id, artist_id, when, city, state in rows:
+            month = month_of(when)
+            deltas['VenueMonthlyShows', (venue_id, month)] += 1
+            deltas['ArtistMonthlyShows', (artist_id, month)] += 1
+            deltas['CityMonthlyShows', (city or '', state or '', month)] += 1
+        done += len(rows)
+        if progress:
+            progress(done)
+    for model in (VenueMonthlyShows, ArtistMonthlyShows, CityMonthlyShows):
+        columns = [getattr(model, column) for column in ROLLUPS[model.__tablename__]]
+        for row in connection.execute(db.session.query(*columns + [model.shows]).statement):
+            deltas[model.__tablename__, tuple(row[:-1])] -= row[-1]
+    db.session.rollback()
+
+    corrections = {key: change for key, change in deltas.items() if change}
+    apply(db.session.connection(), corrections)
+    db.session.commit()
+    return done, len(corrections)
+
+
+# ----------------------------------------------------------------------------#
+# Reports, read from the rollups only.
+# ----------------------------------------------------------------------------#
+
+def month_range(months):
+    today = date.today()
+    first = date(today.year, today.month, 1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+    return first, today
+
+
+def report(months=12, limit=10):
+    since, _ = month_range(months)
+    shows = func.sum(VenueMonthlyShows.shows).label('shows')
+    venues = db.session.query(VenueMonthlyShows.venue_id, Venue.name, shows) \
+        .join(Venue, Venue.id == VenueMonthlyShows.venue_id) \
+        .filter(VenueMonthlyShows.month >= since) \
+        .group_by(VenueMonthlyShows.venue_id, Venue.name) \
+        .having(shows > 0).order_by(shows.desc(), VenueMonthlyShows.venue_id).limit(limit).all()
+    per_month = {}
+    if venues:
+        rows = db.session.query(VenueMonthlyShows.venue_id, VenueMonthlyShows.month,
+                                VenueMonthlyShows.shows) \
+            .filter(VenueMonthlyShows.month >= since,
+                    VenueMonthlyShows.venue_id.in_([venue.venue_id for venue in venues]))
+        for venue_id, month, count_ in rows:
+            per_month.setdefault(venue_id, {})[month.strftime('%Y-%m')] = count_
+
+    shows = func.sum(ArtistMonthlyShows.shows).label('shows')
+    artists = db.session.query(ArtistMonthlyShows.artist_id, Artist.name, shows) \
+        .join(Artist, Artist.id == ArtistMonthlyShows.artist_id) \
+        .filter(ArtistMonthlyShows.month >= since) \
+        .group_by(ArtistMonthlyShows.artist_id, Artist.name) \
+        .having(shows > 0).order_by(shows.desc(), ArtistMonthlyShows.artist_id).limit(limit).all()
+
+    shows = func.sum(CityMonthlyShows.shows).label('shows')
+    cities = db.session.query(CityMonthlyShows.city, CityMonthlyShows.state, shows) \
+        .filter(CityMonthlyShows.month >= since) \
+        .group_by(CityMonthlyShows.city, CityMonthlyShows.state) \
+        .having(shows > 0).order_by(shows.desc(), CityMonthlyShows.city).limit(limit).all()
+    # every show is counted once per city, so the city rollup gives the totals
+    totals = db.session.query(CityMonthlyShows.month, shows) \
+        .filter(CityMonthlyShows.month >= since) \
+        .group_by(CityMonthlyShows.month).order_by(CityMonthlyShows.month).all()
+
+    return {
+        'since': since.strftime('%Y-%m'),
+        'months': [{'month': month.strftime('%Y-%m'), 'shows': total} for month, total in totals],
+        'venues': [{'id': venue.venue_id, 'name': venue.name, 'shows': venue.shows,
+                    'by_month': per_month.get(venue.venue_id, {})} for venue in venues],
+        'artists': [{'id': artist.artist_id, 'name': artist.name, 'shows': artist.shows}
+                    for artist in artists],
+        'cities': [{'city': city.city, 'state': city.state, 'shows': city.shows} for city in cities],
+    }
@@ -2,81 +2,126 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
+# Heavy modules (babel, dateutil, wtforms via forms.py, flask_migrate/alembic)
+# are imported where they are first used so that workers start fast; check
+# with `flask startup-report` after adding imports here.
+
 import json
 import itertools
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import os
+from datetime import datetime
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, current_app
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
 from sqlalchemy import func
 from sqlalchemy.orm import defer, undefer
 from sqlalchemy.sql.functions import now
 
-from forms import *
-from flask_migrate import Migrate
+import analytics
+import dedupe
+from assets import asset_url, init_assets
+from autocomplete import get_index, init_autocomplete, record_deleted, record_saved
+import changes
+from commands import register_commands
+from compression import Compress
+from config import configs, get_config
+from fragment_cache import FragmentCache, FragmentCacheExtension, fragment_key
+import fulltext
+import geo
+import ical
+from images import Images, srcset
+from profiler import Profiler
+import querylog
+import snapshot
+import sqlite
+import warmup
+from ratelimit import Limiter
+import jobs
+import live
+from similarity import schedule_refresh, similar_to
+from models import db, Venue, Artist, Show
 
 # ----------------------------------------------------------------------------#
 # App Config.
 # ----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-
-migrate = Migrate(app, db)
-
-
-# ----------------------------------------------------------------------------#
-# Models.
-# ----------------------------------------------------------------------------#
-
-class Venue(db.Model):
-    __tablename__ = 'Venue'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    address = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    genres = db.Column(db.String(200))
-    website = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-    seeking_talent = db.Column(db.Boolean(), nullable=True, default=False)
-    seeking_description = db.Column(db.String(250))
-    shows = db.relationship('Show', backref='venue', lazy=True)
-
-
-class Artist(db.Model):
-    __tablename__ = 'Artist'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    genres = db.Column(db.String(200))
-    image_link = db.Column(db.String(500))
-    website = db.Column(db.String(120))
-    facebook_link = db.Column(db.String(120))
-    seeking_venue = db.Column(db.Boolean(), nullable=True, default=False)
-    seeking_description = db.Column(db.String(250))
-    shows = db.relationship('Show', backref='artist', lazy=True)
-
-
-class Show(db.Model):
-    __tablename__ = 'Show'
-
-    id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.DateTime)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
+moment = Moment()
+compress = Compress()
+images = Images()
+limiter = Limiter()
+profiler = Profiler()
+
+# Views are collected here by @route and bound to each app in create_app(),
+# so endpoint names stay the same as with @app.route.
+routes = []
+
+
+def route(rule, **options):
+    def decorator(f):
+        routes.append((rule, options, f))
+        return f
+
+    return decorator
+
+
+def create_app(config=None, with_migrations=True):
+    """Build an app for `config`: a config class, an import string or a
+    name from config.configs. Falls back to $FYYUR_CONFIG.
+
+    Servers pass with_migrations=False, the `flask db` commands are only
+    needed from the CLI and Flask-Migrate pulls in all of alembic."""
+    app = Flask(__name__)
+    if config is None or config in configs:
+        config = get_config(config)
+    app.config.from_object(config)
+
+    moment.init_app(app)
+    db.init_app(app)
+    sqlite.init_sqlite(app, db)
+    querylog.init_querylog(app)
+    profiler.init_app(app)
+    limiter.init_app(app)
+    if with_migrations:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    configure_jinja(app)
+    init_assets(app)
+    compress.init_app(app)
+    images.init_app(app)
+    init_autocomplete(app)
+    ical.init_ical(app)
+    snapshot.init_snapshot(app)
+    jobs.init_jobs(app)
+    changes.init_changes(app)
+    live.init_live(app)
+    warmup.init_warmup(app)
+    register_commands(app)
+
+    for rule, options, view_func in routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, server_error)
+
+    hops = app.config.get('TRUSTED_PROXIES')
+    if hops:
+        # client address and scheme from the proxies' X-Forwarded headers
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    if not app.debug and not app.testing:
+        file_handler = FileHandler('error.log')
+        file_handler.setFormatter(
+            Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        app.logger.setLevel(logging.INFO)
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.info('errors')
+
+    return app
 
 
 # ----------------------------------------------------------------------------#
@@ -84,6 +129,8 @@ class Show(db.Model):
 # ----------------------------------------------------------------------------#
 
 def format_datetime(value, format='medium'):
+    import babel.dates
+    import dateutil.parser
     date = dateutil.parser.parse(value)
     if format == 'full':
         format = "EEEE MMMM, d, y 'at' h:mma"
@@ -92,7 +139,25 @@ def format_datetime(value, format='medium'):
     return babel.dates.format_datetime(date, format)
 
 
-app.jinja_env.filters['datetime'] = format_datetime
+# shared by the Flask and Quart apps, must run before app.jinja_env is first used
+def configure_jinja(app):
+    cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if cache_dir:
+        # Quart compiles templates for async rendering, keep its bytecode apart
+        cache_dir = os.path.join(cache_dir, type(app).__name__.lower())
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    app.jinja_options = dict(app.jinja_options, extensions=list(
+        app.jinja_options.get('extensions', [])) + [FragmentCacheExtension])
+    app.jinja_env.filters['datetime'] = format_datetime
+    app.jinja_env.globals['fragment_key'] = fragment_key
+    app.jinja_env.globals['asset_url'] = lambda filename: asset_url(app, filename)
+    app.jinja_env.globals['srcset'] = lambda url: srcset(
+        url, app.config.get('IMAGE_WIDTHS', [160, 320, 640, 1280]))
+    if app.config.get('FRAGMENT_CACHE_SIZE'):
+        app.jinja_env.fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+        app.jinja_env.fragment_cache_timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
 
 
 # ----------------------------------------------------------------------------#
@@ -130,8 +195,23 @@ def past_shows_counter(id, param):
     return counter
 
 
+# a file picked in the form replaces the image_link, ValueError when it is not an image
+def save_image_upload(row):
+    upload = request.files.get('image_file')
+    if upload and upload.filename:
+        row.image_link = images.save(upload)
+
+
+def flash_duplicates(duplicates):
+    # the listing is saved anyway, the user (or an admin) decides what to merge
+    if duplicates:
+        flash('It may be a duplicate of: ' + ', '.join(
+            '%s (#%d)' % (row.name, row.id) for score, row in duplicates))
+
+
 # implement a basic name search function takes a query and a search term as arguments
-def basic_name_search(query, search_term, param):
+# counter defaults to the per-row DB count, the async app passes a pre-fetched lookup
+def basic_name_search(query, search_term, param, counter=upcoming_shows_counter):
     search_hits = []
     search_term = search_term.strip().lower()
     for row in query:
@@ -141,16 +221,37 @@ def basic_name_search(query, search_term, param):
             search_hits.append({
                 'id': row.id,
                 'name': row.name,
-                'num_upcoming_shows': upcoming_shows_counter(row.id, param)
+                'num_upcoming_shows': counter(row.id, param)
             })
     return search_hits
 
 
+# typo tolerant fallback for the name search ("Muscial Hop" finds "Musical Hop"),
+# candidates come from the trigram index so the tables are not scanned again
+# the async app passes its own index, config and counter
+def fuzzy_name_search(search_term, param, index=None, config=None, counter=upcoming_shows_counter):
+    search_hits = []
+    if index is None:
+        index = get_index()
+    if config is None:
+        config = current_app.config
+    matches = index.fuzzy_search(search_term, param,
+                                 config['FUZZY_MAX_DISTANCE'],
+                                 config['FUZZY_LIMIT'])
+    for kind, id, name in matches:
+        search_hits.append({
+            'id': id,
+            'name': name,
+            'num_upcoming_shows': counter(id, param)
+        })
+    return search_hits
+
+
 # search function that looks for city and state matches
 # allows for city and state search (works with or without the coma)
 # aswell only city search
 
-def location_search(query, search_term, param):
+def location_search(query, search_term, param, counter=upcoming_shows_counter):
     search_hits = []
     search_term = search_term.lower().split()
     search_city = search_term[0].strip(',')
@@ -163,7 +264,7 @@ def location_search(query, search_term, param):
                 search_hits.append({
                     'id': row.id,
                     'name': row.name,
-                    'num_upcoming_shows': upcoming_shows_counter(row.id, param)
+                    'num_upcoming_shows': counter(row.id, param)
                 })
     else:
         for row in query:
@@ -172,7 +273,7 @@ def location_search(query, search_term, param):
                 search_hits.append({
                     'id': row.id,
                     'name': row.name,
-                    'num_upcoming_shows': upcoming_shows_counter(row.id, param)
+                    'num_upcoming_shows': counter(row.id, param)
                 })
     return search_hits
 
@@ -181,17 +282,70 @@ def location_search(query, search_term, param):
 # Controllers.
 # ----------------------------------------------------------------------------#
 
-@app.route('/')
+# model columns the edit forms don't submit, maintained by the app instead
+NON_FORM_COLUMNS = ('id', 'updated_at', 'latitude', 'longitude', 'geohash')
+
+
+@route('/')
 def index():
     latest_artists = Artist.query.order_by(Artist.id.desc()).limit(10)
     latest_venues = Venue.query.order_by(Venue.id.desc()).limit(10)
     return render_template('pages/home.html', latest_artists=latest_artists, latest_venues=latest_venues)
 
 
+@route('/autocomplete')
+def autocomplete():
+    # typeahead for the search boxes: name prefix matches from the in-memory index,
+    # ?type=venue|artist narrows the results
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    results = get_index().search(request.args.get('q', ''), limit, request.args.get('type'))
+    for result in results:
+        result['url'] = '/%ss/%d' % (result['type'], result['id'])
+    return jsonify(results=results)
+
+
+@route('/search')
+def search():
+    # ranked full-text search over names, genres, locations and seeking descriptions,
+    # ?type=venue|artist, ?genre=Jazz and ?seeking=1 narrow it, ?format=json for the API
+    search_term = request.args.get('q', '')
+    kind = request.args.get('type') if request.args.get('type') in fulltext.TABLES else None
+    results = fulltext.search(search_term, kind=kind, genre=request.args.get('genre'),
+                              seeking=bool(request.args.get('seeking')),
+                              limit=min(request.args.get('limit', 20, type=int), 100))
+    for result in results:
+        result['url'] = '/%ss/%d' % (result['type'], result['id'])
+    if request.args.get('format') == 'json':
+        return jsonify(results=[dict(result, snippet=str(result['snippet'])) for result in results])
+    return render_template('pages/search.html', results=results, search_term=search_term,
+                           genre=request.args.get('genre', ''))
+
+
+@route('/api/changes')
+def api_changes():
+    # venues, artists and shows created, updated or deleted after ?since=<cursor>,
+    # oldest first, for mirrors of the catalog; send the returned cursor next time
+    config = current_app.config
+    limit = min(max(request.args.get('limit', config['CHANGES_PAGE_SIZE'], type=int), 1),
+                config['CHANGES_MAX_PAGE_SIZE'])
+    return jsonify(changes.feed(max(request.args.get('since', 0, type=int), 0), limit))
+
+
+@route('/analytics')
+def analytics_report():
+    # shows per month, busiest venues, cities and artists over the last ?months=,
+    # read from the rollup tables only, ?format=json for the API
+    months = min(max(request.args.get('months', 12, type=int), 1), 120)
+    report = analytics.report(months)
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    return render_template('pages/analytics.html', report=report, months=months)
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@route('/venues')
 def venues():
     # Retrieve data from DB and sort it by City, State
     data = Venue.query.all()
@@ -205,13 +359,51 @@ def venues():
     return render_template('pages/venues.html', areas=areas);
 
 
-@app.route('/venues/search', methods=['POST'])
+@route('/venues/nearby')
+def nearby_venues():
+    # venues within ?km= of a city (?city=&state=), an artist's home city (?artist_id=)
+    # or a point (?lat=&lon=), closest first, ?format=json for the API
+    km = min(request.args.get('km', 25.0, type=float), current_app.config['GEO_MAX_RADIUS_KM'])
+    origin = None
+    if request.args.get('artist_id', type=int):
+        artist = Artist.query.get_or_404(request.args.get('artist_id', type=int))
+        label = '%s (%s, %s)' % (artist.name, artist.city, artist.state)
+        if artist.latitude is not None:
+            origin = (artist.latitude, artist.longitude)
+    elif 'lat' in request.args:
+        label = '%s, %s' % (request.args.get('lat'), request.args.get('lon'))
+        origin = (request.args.get('lat', type=float), request.args.get('lon', type=float))
+        if None in origin or not -90 <= origin[0] <= 90 or not -180 <= origin[1] <= 180:
+            origin = None
+    else:
+        label = '%s, %s' % (request.args.get('city', ''), request.args.get('state', ''))
+        origin = geo.lookup(request.args.get('city'), request.args.get('state'))
+
+    results = []
+    if origin is not None:
+        for distance, venue in geo.nearby(Venue, origin[0], origin[1], km,
+                                          limit=min(request.args.get('limit', 50, type=int), 200)):
+            results.append({'id': venue.id, 'name': venue.name, 'city': venue.city,
+                            'state': venue.state, 'distance_km': round(distance, 1)})
+    if request.args.get('format') == 'json':
+        if origin is None:
+            return jsonify(error='unknown location'), 400
+        return jsonify(origin={'latitude': origin[0], 'longitude': origin[1]}, km=km, results=results)
+    return render_template('pages/nearby_venues.html', results=results, label=label, km=km,
+                           located=origin is not None)
+
+
+@route('/venues/search', methods=['POST'])
 def search_venues():
     search_term = request.form['search_term']
-    # Query only venue IDs and names and perform a search on the Python objects rather than the database
-    venues = Venue.query.options(defer('*'), undefer("id"), undefer("name"))
+    # Query only venue IDs, names and location once and perform the searches on the Python objects
+    venues = Venue.query.options(defer('*'), undefer("id"), undefer("name"),
+                                 undefer("city"), undefer("state")).all()
 
     search = basic_name_search(venues, search_term, 'venue')
+    # no substring match, look for names a typo or two away
+    if len(search) == 0:
+        search = fuzzy_name_search(search_term, 'venue')
     # if name search returns 0 results, try city search using the same term
     if len(search) == 0:
         search = location_search(venues, search_term, 'venue')
@@ -227,7 +419,7 @@ def search_venues():
                            search_term=search_term)
 
 
-@app.route('/venues/<int:venue_id>')
+@route('/venues/<int:venue_id>')
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
     join = Venue.query.outerjoin(Show).filter(Venue.id == venue_id).first()
@@ -235,19 +427,31 @@ def show_venue(venue_id):
     join.upcoming_shows_count = upcoming_shows_counter(join.id, 'venue')
     join.past_shows_count = past_shows_counter(join.id, 'venue')
     join.past_shows = [show for show in join.shows if show.date <= datetime.now()]
+    join.similar = similar_to('venue', venue_id)
     return render_template('pages/show_venue.html', venue=join)
 
 
+@route('/venues/<int:venue_id>/shows.ics')
+def venue_calendar(venue_id):
+    return ical.feed_response('venue', venue_id)
+
+
+@route('/venues/<int:venue_id>/live')
+def venue_live(venue_id):
+    return live.stream('venue', venue_id)
+
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@route('/venues/create', methods=['GET'])
 def create_venue_form():
+    from forms import VenueForm
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@route('/venues/create', methods=['POST'])
 def create_venue_submission():
     try:
         form = request.form
@@ -262,11 +466,19 @@ def create_venue_submission():
                       facebook_link=form['facebook_link'], image_link=form['image_link'],
                       website=form['website'], seeking_talent=seeking,
                       seeking_description=form['seeking_description'])
+        geo.locate(venue)
+        save_image_upload(venue)
+        # looked up before the add, the query would flush the new row
+        duplicates = dedupe.likely_duplicates('venue', venue, current_app.config['DEDUPE_THRESHOLD'])
         db.session.add(venue)
+        dedupe.schedule_keys('venue', venue)
+        schedule_refresh('venue')
         db.session.commit()
+        record_saved('venue', venue.id, venue.name)
         # on successful db insert, flash success
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
-    except (RuntimeError, TypeError, NameError):
+        flash_duplicates(duplicates)
+    except (RuntimeError, TypeError, NameError, ValueError):
         db.session.rollback()
         flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
         # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
@@ -276,14 +488,20 @@ def create_venue_submission():
     return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>/delete', methods=['POST'])
+@route('/venues/<venue_id>/delete', methods=['POST'])
 # As HTTP does not allow DELETE method in forms, and I don't want to use any AJAX
 # I changed the endpoint for handling deletes to use post method on venue_id/delete
 def delete_venue(venue_id):
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
     try:
         Venue.query.filter_by(id=venue_id).delete()
+        dedupe.schedule_keys('venue', venue_id)
+        # bulk deletes bypass the mapper events, file the tombstone here
+        changes.record('venue', [int(venue_id)], 'delete')
+        schedule_refresh('venue')
         db.session.commit()
+        record_deleted('venue', int(venue_id))
+        ical.invalidate('venue', venue_id)
         flash('Venue was successfully deleted!')
     except:
         db.session.rollback()
@@ -297,20 +515,24 @@ def delete_venue(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@route('/artists')
 def artists():
     data = Artist.query.all()
     return render_template('pages/artists.html', artists=data)
 
 
-@app.route('/artists/search', methods=['POST'])
+@route('/artists/search', methods=['POST'])
 def search_artists():
     search_term = request.form['search_term']
 
-    # Query only venue IDs and names and perform a search on the Python objects rather than the database
-    artists = Artist.query.options(defer('*'), undefer("id"), undefer("name"))
+    # Query only artist IDs, names and location once and perform the searches on the Python objects
+    artists = Artist.query.options(defer('*'), undefer("id"), undefer("name"),
+                                   undefer("city"), undefer("state")).all()
 
     search = basic_name_search(artists, search_term, 'artist')
+    # no substring match, look for names a typo or two away
+    if len(search) == 0:
+        search = fuzzy_name_search(search_term, 'artist')
     #if name search returns 0 results, try city search using the same term
     if len(search) == 0:
         search = location_search(artists, search_term, 'artist')
@@ -326,7 +548,7 @@ def search_artists():
                            search_term=search_term)
 
 
-@app.route('/artists/<int:artist_id>')
+@route('/artists/<int:artist_id>')
 def show_artist(artist_id):
     # shows the venue page with the given venue_id
     join = Artist.query.outerjoin(Show).filter(Artist.id == artist_id).first()
@@ -334,10 +556,21 @@ def show_artist(artist_id):
     join.upcoming_shows_count = upcoming_shows_counter(join.id, 'artist')
     join.past_shows_count = past_shows_counter(join.id, 'artist')
     join.past_shows = [show for show in join.shows if show.date <= datetime.now()]
+    join.similar = similar_to('artist', artist_id)
     return render_template('pages/show_artist.html', artist=join)
 
 
-@app.route('/test')
+@route('/artists/<int:artist_id>/shows.ics')
+def artist_calendar(artist_id):
+    return ical.feed_response('artist', artist_id)
+
+
+@route('/artists/<int:artist_id>/live')
+def artist_live(artist_id):
+    return live.stream('artist', artist_id)
+
+
+@route('/test')
 def test():
     data1 = Artist.query.join(Show)
     return render_template('pages/test.html', data1=data1, time=datetime.now())
@@ -345,14 +578,15 @@ def test():
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
+    from forms import ArtistForm
     form = ArtistForm()
     artist = Artist.query.get(artist_id)
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     try:
         form = request.form
@@ -360,7 +594,7 @@ def edit_artist_submission(artist_id):
         # get all column keys using __table__ attribute and set each column
         # using __setattr__ instead of going through each attribute manually
         for column in Artist.__table__.columns.keys():
-            if column != 'id':
+            if column not in NON_FORM_COLUMNS:
                 if column == 'genres':
                     old_artist.__setattr__(column, form.getlist('genres'))
                 elif column == 'seeking_venue':
@@ -373,11 +607,17 @@ def edit_artist_submission(artist_id):
                     old_artist.__setattr__(column, seeking)
                 else:
                     old_artist.__setattr__(column, form[column])
+        geo.locate(old_artist)
+        save_image_upload(old_artist)
+        dedupe.schedule_keys('artist', old_artist)
 
+        schedule_refresh('artist')
         db.session.commit()
+        record_saved('artist', old_artist.id, old_artist.name)
+        ical.invalidate('artist', old_artist.id)
         # on successful db insert, flash success
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
-    except (RuntimeError, TypeError, NameError):
+    except (RuntimeError, TypeError, NameError, ValueError):
         db.session.rollback()
         flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
         # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
@@ -386,14 +626,20 @@ def edit_artist_submission(artist_id):
     return redirect(url_for('show_artist', artist_id=artist_id))
 
 
-@app.route('/artists/<artist_id>/delete', methods=['POST'])
+@route('/artists/<artist_id>/delete', methods=['POST'])
 # As HTTP does not allow DELETE method in forms, and I don't want to use any AJAX
 # I changed the endpoint for handling deletes to use post method on artist_id/delete
 def delete_artist(artist_id):
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
     try:
         Artist.query.filter_by(id=artist_id).delete()
+        dedupe.schedule_keys('artist', artist_id)
+        # bulk deletes bypass the mapper events, file the tombstone here
+        changes.record('artist', [int(artist_id)], 'delete')
+        schedule_refresh('artist')
         db.session.commit()
+        record_deleted('artist', int(artist_id))
+        ical.invalidate('artist', artist_id)
         flash('Venue was successfully deleted!')
     except:
         db.session.rollback()
@@ -405,14 +651,15 @@ def delete_artist(artist_id):
     return redirect(url_for('artists'))
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
+    from forms import VenueForm
     form = VenueForm()
     venue = Venue.query.get(venue_id)
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     # venue record with ID <venue_id> using the new attributes
     try:
@@ -421,7 +668,7 @@ def edit_venue_submission(venue_id):
         # get all column keys using __table__ attribute and set each column
         # using __setattr__ instead of going through each attribute manually
         for column in Venue.__table__.columns.keys():
-            if column != 'id':
+            if column not in NON_FORM_COLUMNS:
                 if column == 'genres':
                     old_venue.__setattr__(column, form.getlist('genres'))
                 elif column == 'seeking_talent':
@@ -434,11 +681,17 @@ def edit_venue_submission(venue_id):
                     old_venue.__setattr__(column, seeking)
                 else:
                     old_venue.__setattr__(column, form[column])
+        geo.locate(old_venue)
+        save_image_upload(old_venue)
+        dedupe.schedule_keys('venue', old_venue)
 
+        schedule_refresh('venue')
         db.session.commit()
+        record_saved('venue', old_venue.id, old_venue.name)
+        ical.invalidate('venue', old_venue.id)
         # on successful db insert, flash success
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
-    except (RuntimeError, TypeError, NameError):
+    except (RuntimeError, TypeError, NameError, ValueError):
         db.session.rollback()
         flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
         # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
@@ -450,13 +703,14 @@ def edit_venue_submission(venue_id):
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@route('/artists/create', methods=['GET'])
 def create_artist_form():
+    from forms import ArtistForm
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
-@app.route('/artists/create', methods=['POST'])
+@route('/artists/create', methods=['POST'])
 def create_artist_submission():
     # called upon submitting the new artist listing form
     try:
@@ -470,11 +724,19 @@ def create_artist_submission():
                         phone=form['phone'], genres=form.getlist('genres'), website=form['website'],
                         facebook_link=form['facebook_link'], image_link=form['image_link'],
                         seeking_venue=seeking, seeking_description=form['seeking_description'])
+        geo.locate(artist)
+        save_image_upload(artist)
+        # looked up before the add, the query would flush the new row
+        duplicates = dedupe.likely_duplicates('artist', artist, current_app.config['DEDUPE_THRESHOLD'])
         db.session.add(artist)
+        dedupe.schedule_keys('artist', artist)
+        schedule_refresh('artist')
         db.session.commit()
+        record_saved('artist', artist.id, artist.name)
         # on successful db insert, flash success
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
-    except (RuntimeError, TypeError, NameError):
+        flash_duplicates(duplicates)
+    except (RuntimeError, TypeError, NameError, ValueError):
         db.session.rollback()
         flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
     finally:
@@ -486,7 +748,7 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@route('/shows')
 def shows():
     # displays list of shows at /shows
     shows = []
@@ -503,14 +765,15 @@ def shows():
     return render_template('pages/shows.html', shows=shows)
 
 
-@app.route('/shows/create')
+@route('/shows/create')
 def create_shows():
     # renders form. do not touch.
+    from forms import ShowForm
     form = ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@app.route('/shows/create', methods=['POST'])
+@route('/shows/create', methods=['POST'])
 def create_show_submission():
     form = request.form
     artist_id = form['artist_id']
@@ -521,9 +784,16 @@ def create_show_submission():
     venue_exists = Venue.query.get(venue_id)
 
     if artist_exists and venue_exists:
-        show = Show(date=form['start_time'], artist_id=artist_id, venue_id=venue_id)
+        import dateutil.parser
+        # parsed here, SQLite does not take date strings as Postgres does
+        show = Show(date=dateutil.parser.parse(form['start_time']), artist_id=artist_id, venue_id=venue_id)
         db.session.add(show)
+        schedule_refresh('artist', 'venue')
+        events = live.show_events(show)
         db.session.commit()
+        ical.invalidate('venue', venue_id)
+        ical.invalidate('artist', artist_id)
+        live.publish(events)
         # on successful db insert, flash success
         flash('Show was successfully listed!')
     else:
@@ -531,42 +801,26 @@ def create_show_submission():
             flash('Artist ID not found')
         if venue_exists is None:
             flash('Venue ID not found')
+        from forms import ShowForm
         render_form = ShowForm()
         return render_template('forms/new_show.html', form=render_form)
     return render_template('pages/home.html')
 
 
-@app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 # ----------------------------------------------------------------------------#
 # Launch.
 # ----------------------------------------------------------------------------#
 
-# Default port:
-if __name__ == '__main__':
-    app.run(port=5000)
-
-# Or specify port manually:
-'''
+# Development server only, production runs the preforking server:
+#   gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
-'''
+    create_app().run(port=port)
@@ -0,0 +1,7 @@
+# ASGI entry point for the async read path, see async_app.py.
+import os
+
+from async_app import create_async_app
+
+# servers run the production config unless told otherwise
+app = create_async_app(os.environ.get('FYYUR_CONFIG', 'production'))
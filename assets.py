@@ -0,0 +1,143 @@
+# ----------------------------------------------------------------------------#
+# Fingerprinted, pre-compressed static assets.
+#
+# `flask assets build` copies static/{css,js,fonts,img} into static/dist under
+# content-hashed names (main.css -> main.1a2b3c4d5e.css), writes .gz and .br
+# variants next to them and records the mapping in static/dist/manifest.json.
+# Templates link assets through asset_url('css/main.css'); /static/dist/ is
+# served with the best variant the client accepts and far-future headers.
+# ----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+ASSET_DIRS = ('css', 'js', 'fonts', 'img')
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.ttf', '.otf', '.eot', '.json', '.txt')
+# hashed names never change content, let browsers keep them for a year
+MAX_AGE = 365 * 24 * 3600
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")?#]+)([^'")]*)\1\s*\)''')
+
+
+# ----------------------------------------------------------------------------#
+# Build.
+# ----------------------------------------------------------------------------#
+
+def fingerprint(name, content):
+    stem, ext = posixpath.splitext(name)
+    return '%s.%s%s' % (stem, hashlib.md5(content).hexdigest()[:10], ext)
+
+
+def rewrite_css_urls(name, content, manifest):
+    # point url(../fonts/x.ttf) at the fingerprinted file, leave unknown urls alone
+    base = posixpath.dirname(name)
+
+    def replace(match):
+        quote, path, suffix = match.groups()
+        target = posixpath.normpath(posixpath.join(base, path))
+        if target not in manifest:
+            return match.group(0)
+        hashed = posixpath.relpath(manifest[target], base)
+        return 'url(%s%s%s%s)' % (quote, hashed, suffix, quote)
+
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def write_variants(path, content, min_size):
+    written = []
+    if not path.endswith(COMPRESSIBLE) or len(content) < min_size:
+        return written
+    variants = [('.gz', gzip.compress(content, 9))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    for suffix, compressed in variants:
+        # no point sending a variant that is not smaller
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(suffix)
+    return written
+
+
+def build(static_folder, build_dir, min_size=256):
+    """Fingerprint and compress the assets, returns the manifest."""
+    sources = []
+    for top in ASSET_DIRS:
+        for root, _, files in os.walk(os.path.join(static_folder, top)):
+            for filename in files:
+                path = os.path.join(root, filename)
+                sources.append(os.path.relpath(path, static_folder).replace(os.sep, '/'))
+    # stylesheets last, they reference the fingerprinted fonts and images
+    sources.sort(key=lambda name: (name.endswith('.css'), name))
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            content = f.read()
+        if name.endswith('.css'):
+            content = rewrite_css_urls(name, content, manifest)
+        manifest[name] = fingerprint(name, content)
+        target = os.path.join(build_dir, manifest[name])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+        write_variants(target, content, min_size)
+
+    with open(os.path.join(build_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# ----------------------------------------------------------------------------#
+# Serving.
+# ----------------------------------------------------------------------------#
+
+def load_manifest(path):
+    if not path or not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def asset_url(app, filename):
+    """URL of the fingerprinted `filename`, or the plain static URL when it
+    is not part of the build (development, missing files)."""
+    manifest = app.extensions.get('assets', {})
+    if filename in manifest:
+        return '%s/dist/%s' % (app.static_url_path, manifest[filename])
+    return '%s/%s' % (app.static_url_path, filename)
+
+
+def send_asset(filename):
+    directory = current_app.config['ASSET_BUILD_DIR']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        variant = safe_join(directory, filename + suffix)
+        if request.accept_encodings[encoding] and variant and os.path.isfile(variant):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype,
+                                           max_age=MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype, max_age=MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    app.extensions['assets'] = load_manifest(app.config.get('ASSET_MANIFEST'))
+    app.add_url_rule(app.static_url_path + '/dist/<path:filename>', 'assets', send_asset)
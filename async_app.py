@@ -0,0 +1,346 @@
+# ----------------------------------------------------------------------------#
+# Async read path.
+#   hypercorn -w 4 -b 0.0.0.0:5001 asgi:app
+# Serves the read-only pages with the same models and templates as app.py,
+# but every query is awaited on an asyncpg connection pool, so a worker keeps
+# serving other requests while Postgres answers. Route GET traffic for these
+# paths (and the search POSTs) here; writes stay on the WSGI app. The live
+# show streams of the venue and artist pages (see live.py) are served here
+# too, one idle coroutine each, fed by the WSGI workers with LIVE_PUBSUB.
+# ----------------------------------------------------------------------------#
+
+import asyncio
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from databases import Database
+from quart import Quart, Response, abort, current_app, render_template, request
+from sqlalchemy import func, select
+
+from app import basic_name_search, configure_jinja, fuzzy_name_search, location_search
+from assets import load_manifest
+from autocomplete import init_autocomplete
+from config import configs, get_config
+import live
+from models import Venue, Artist, Show, Similarity, Change
+
+venue_table = Venue.__table__
+artist_table = Artist.__table__
+show_table = Show.__table__
+similarity_table = Similarity.__table__
+change_table = Change.__table__
+
+routes = []
+
+
+def route(rule, **options):
+    def decorator(f):
+        routes.append((rule, options, f))
+        return f
+
+    return decorator
+
+
+def create_async_app(config=None):
+    """Async counterpart of app.create_app(), takes the same `config`."""
+    app = Quart(__name__)
+    if config is None or config in configs:
+        config = get_config(config)
+    app.config.from_object(config)
+
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    options = {}
+    if url.startswith('postgresql'):
+        options = {'min_size': app.config['ASYNC_DB_POOL_MIN_SIZE'],
+                   'max_size': app.config['ASYNC_DB_POOL_MAX_SIZE']}
+    app.extensions['database'] = Database(url, **options)
+
+    configure_jinja(app)
+    # fingerprinted assets themselves are served by the WSGI app
+    app.extensions['assets'] = load_manifest(app.config.get('ASSET_MANIFEST'))
+    init_autocomplete(app)
+    live.init_live(app)
+
+    for rule, options, view_func in routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+    app.register_error_handler(404, not_found_error)
+
+    @app.before_serving
+    async def connect():
+        await app.extensions['database'].connect()
+
+    @app.after_serving
+    async def disconnect():
+        await app.extensions['database'].disconnect()
+
+    return app
+
+
+# ----------------------------------------------------------------------------#
+# Utils.
+# ----------------------------------------------------------------------------#
+
+def database():
+    return current_app.extensions['database']
+
+
+# records come back as mappings, templates and the search helpers use attributes
+def objects(records):
+    return [SimpleNamespace(**dict(record)) for record in records]
+
+
+async def upcoming_shows_counts(column):
+    # one grouped query instead of one count per search hit
+    query = select([column, func.count(show_table.c.id)]) \
+        .where(show_table.c.date >= datetime.now()) \
+        .group_by(column)
+    return {row[0]: row[1] for row in await database().fetch_all(query)}
+
+
+async def name_index():
+    # the index of fuzzy_name_search(), kept like autocomplete.get_index() but
+    # rebuilt whenever the change feed moved rather than patched row by row
+    index = current_app.extensions['autocomplete']
+    now = time.monotonic()
+    if index.built and now - index.checked_at <= current_app.config['AUTOCOMPLETE_REFRESH_INTERVAL']:
+        return index
+    index.checked_at = now
+    seq = await database().fetch_val(select([func.max(change_table.c.seq)])) or 0
+    if not index.built or seq != index.seq:
+        rows = []
+        for kind, table in (('venue', venue_table), ('artist', artist_table)):
+            rows += [(kind, row['id'], row['name'])
+                     for row in await database().fetch_all(select([table.c.id, table.c.name]))]
+        index.load(rows)
+        index.seq = seq
+    return index
+
+
+async def search(table, column, param):
+    search_term = (await request.form)['search_term']
+    rows = objects(await database().fetch_all(
+        select([table.c.id, table.c.name, table.c.city, table.c.state])))
+    counts = await upcoming_shows_counts(column)
+    counter = lambda id, param: counts.get(id, 0)
+
+    hits = basic_name_search(rows, search_term, param, counter=counter)
+    # no substring match, look for names a typo or two away
+    if len(hits) == 0:
+        hits = fuzzy_name_search(search_term, param, index=await name_index(),
+                                 config=current_app.config, counter=counter)
+    # if name search returns 0 results, try city search using the same term
+    if len(hits) == 0:
+        hits = location_search(rows, search_term, param, counter=counter)
+    return search_term, {'count': len(hits), 'data': hits}
+
+
+async def shows_with(table, column, entity_id):
+    # shows of one venue/artist joined with the other side of the booking,
+    # split into upcoming and past the way the templates expect them
+    side = 'artist' if table is artist_table else 'venue'
+    rows = await database().fetch_all(
+        select([show_table.c.id.label('show_id'), show_table.c.date, show_table.c.artist_id,
+                show_table.c.venue_id, table.c.id, table.c.name, table.c.image_link, table.c.updated_at])
+        .select_from(show_table.join(table))
+        .where(column == entity_id))
+    now = datetime.now()
+    upcoming, past = [], []
+    for row in rows:
+        show = SimpleNamespace(id=row['show_id'], date=row['date'], artist_id=row['artist_id'],
+                               venue_id=row['venue_id'])
+        setattr(show, side, SimpleNamespace(id=row['id'], name=row['name'], image_link=row['image_link'],
+                                            updated_at=row['updated_at']))
+        (upcoming if row['date'] >= now else past).append(show)
+    return upcoming, past
+
+
+async def similar_with(table, kind, entity_id):
+    # precomputed neighbours, see similarity.similar_to()
+    return objects(await database().fetch_all(
+        select([table.c.id, table.c.name, table.c.image_link, similarity_table.c.score])
+        .select_from(table.join(similarity_table, similarity_table.c.neighbor_id == table.c.id))
+        .where((similarity_table.c.kind == kind) & (similarity_table.c.entity_id == entity_id))
+        .order_by(similarity_table.c.rank)))
+
+
+async def missed_events(kind, entity_id, since):
+    # shows booked after `since`, see live.missed()
+    column = show_table.c[kind + '_id']
+    sides = [show_table.c.id, show_table.c.date]
+    for side, table in (('venue', venue_table), ('artist', artist_table)):
+        sides += [table.c.id.label(side + '_id'), table.c.name.label(side + '_name'),
+                  table.c.image_link.label(side + '_image_link')]
+    rows = await database().fetch_all(
+        select(sides).select_from(show_table.join(venue_table).join(artist_table))
+        .where((column == entity_id) & (show_table.c.id > since))
+        .order_by(show_table.c.id).limit(live.CATCH_UP))
+    if not rows:
+        return []
+    now = datetime.now()
+    count = select([func.count(show_table.c.id)]).where(column == entity_id)
+    counts = {'upcoming_shows_count': (await database().fetch_one(count.where(show_table.c.date >= now)))[0],
+              'past_shows_count': (await database().fetch_one(count.where(show_table.c.date <= now)))[0]}
+    return [live.event(SimpleNamespace(
+        id=row['id'], date=row['date'],
+        venue=SimpleNamespace(id=row['venue_id'], name=row['venue_name'], image_link=row['venue_image_link']),
+        artist=SimpleNamespace(id=row['artist_id'], name=row['artist_name'], image_link=row['artist_image_link'])),
+        counts, now) for row in rows]
+
+
+async def live_stream(kind, entity_id):
+    # live.stream() with a coroutine in place of a thread
+    config = current_app.config
+    streams = live.broadcaster(current_app)
+    if streams is None:
+        abort(503)
+    channel = (kind, entity_id)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def put(update):
+        if events.qsize() < config['LIVE_QUEUE_SIZE']:
+            events.put_nowait(update)
+        else:
+            streams.unsubscribe(channel, deliver)
+            events.put_nowait(None)
+
+    def deliver(update):
+        # called from the relay thread
+        loop.call_soon_threadsafe(put, update)
+
+    streams.subscribe(channel, deliver)
+    try:
+        backlog = await missed_events(kind, entity_id, live.last_event_id(request))
+    except Exception:
+        streams.unsubscribe(channel, deliver)
+        raise
+
+    async def generate():
+        try:
+            yield ('retry: %d\n\n' % config['LIVE_RETRY_MS']).encode()
+            for update in backlog:
+                yield live.format_event(update).encode()
+            while True:
+                try:
+                    update = await asyncio.wait_for(events.get(), config['LIVE_HEARTBEAT'])
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+                    continue
+                if update is None:
+                    return
+                yield live.format_event(update).encode()
+        finally:
+            streams.unsubscribe(channel, deliver)
+
+    response = Response(generate(), mimetype='text/event-stream', headers=live.HEADERS)
+    # pages of the WSGI app open it from their origin, see LIVE_URL
+    if config['LIVE_ALLOW_ORIGIN']:
+        response.headers['Access-Control-Allow-Origin'] = config['LIVE_ALLOW_ORIGIN']
+    # open for as long as the page is
+    response.timeout = None
+    return response
+
+
+# ----------------------------------------------------------------------------#
+# Controllers.
+# ----------------------------------------------------------------------------#
+
+@route('/')
+async def index():
+    latest_artists = objects(await database().fetch_all(
+        artist_table.select().order_by(artist_table.c.id.desc()).limit(10)))
+    latest_venues = objects(await database().fetch_all(
+        venue_table.select().order_by(venue_table.c.id.desc()).limit(10)))
+    return await render_template('pages/home.html', latest_artists=latest_artists,
+                                 latest_venues=latest_venues)
+
+
+@route('/venues')
+async def venues():
+    areas = {}
+    for venue in objects(await database().fetch_all(venue_table.select())):
+        areas.setdefault(venue.city + ', ' + venue.state, []).append(venue)
+    return await render_template('pages/venues.html', areas=areas)
+
+
+@route('/venues/search', methods=['POST'])
+async def search_venues():
+    search_term, response = await search(venue_table, show_table.c.venue_id, 'venue')
+    return await render_template('pages/search_venues.html', results=response,
+                                 search_term=search_term)
+
+
+@route('/venues/<int:venue_id>')
+async def show_venue(venue_id):
+    venue = await database().fetch_one(venue_table.select().where(venue_table.c.id == venue_id))
+    if venue is None:
+        abort(404)
+    venue = objects([venue])[0]
+    venue.upcoming_shows, venue.past_shows = await shows_with(
+        artist_table, show_table.c.venue_id, venue_id)
+    venue.upcoming_shows_count = len(venue.upcoming_shows)
+    venue.past_shows_count = len(venue.past_shows)
+    venue.similar = await similar_with(venue_table, 'venue', venue_id)
+    return await render_template('pages/show_venue.html', venue=venue)
+
+
+@route('/venues/<int:venue_id>/live')
+async def venue_live(venue_id):
+    return await live_stream('venue', venue_id)
+
+
+@route('/artists')
+async def artists():
+    data = objects(await database().fetch_all(artist_table.select()))
+    return await render_template('pages/artists.html', artists=data)
+
+
+@route('/artists/search', methods=['POST'])
+async def search_artists():
+    search_term, response = await search(artist_table, show_table.c.artist_id, 'artist')
+    return await render_template('pages/search_venues.html', results=response,
+                                 search_term=search_term)
+
+
+@route('/artists/<int:artist_id>')
+async def show_artist(artist_id):
+    artist = await database().fetch_one(artist_table.select().where(artist_table.c.id == artist_id))
+    if artist is None:
+        abort(404)
+    artist = objects([artist])[0]
+    artist.upcoming_shows, artist.past_shows = await shows_with(
+        venue_table, show_table.c.artist_id, artist_id)
+    artist.upcoming_shows_count = len(artist.upcoming_shows)
+    artist.past_shows_count = len(artist.past_shows)
+    artist.similar = await similar_with(artist_table, 'artist', artist_id)
+    return await render_template('pages/show_artist.html', artist=artist)
+
+
+@route('/artists/<int:artist_id>/live')
+async def artist_live(artist_id):
+    return await live_stream('artist', artist_id)
+
+
+@route('/shows')
+async def shows():
+    rows = await database().fetch_all(
+        select([show_table.c.venue_id, venue_table.c.name.label('venue_name'),
+                show_table.c.artist_id, artist_table.c.name.label('artist_name'),
+                artist_table.c.image_link.label('artist_image_link'), show_table.c.date])
+        .select_from(show_table.join(venue_table).join(artist_table)))
+    shows = [{
+        "venue_id": row['venue_id'],
+        "venue_name": row['venue_name'],
+        "artist_id": row['artist_id'],
+        "artist_name": row['artist_name'],
+        "artist_image_link": row['artist_image_link'],
+        "start_time": str(row['date'])
+    } for row in rows]
+    return await render_template('pages/shows.html', shows=shows)
+
+
+async def not_found_error(error):
+    return await render_template('errors/404.html'), 404
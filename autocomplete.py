@@ -0,0 +1,191 @@
+# ----------------------------------------------------------------------------#
+# Typeahead index for /autocomplete.
+#
+# Artist and venue names live in two sorted arrays searched with bisect: one
+# keyed by the full (normalized) name, one by every later word of the name,
+# so "hop" finds "The Musical Hop" after the names that start with "hop".
+# The same entries feed the trigram index used by the fuzzy search (fuzzy.py).
+# The index is built from one id/name query per worker. The worker handling a
+# create/edit/delete updates it right after the commit; other workers pick the
+# change up on their next lookup after AUTOCOMPLETE_REFRESH_INTERVAL seconds
+# from the change feed (changes.py): the venues and artists filed after the
+# last seq they applied are fetched again, or dropped if they are gone. Seqs
+# follow commit order, so unlike a timestamp the cursor can't pass a change
+# that commits late.
+# ----------------------------------------------------------------------------#
+
+import bisect
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, literal
+
+from fuzzy import TrigramIndex, normalize
+from models import db, Venue, Artist, Change
+
+MODELS = {'venue': Venue, 'artist': Artist}
+# changed records past which sync() reloads the whole index
+REBUILD_AFTER = 1000
+
+
+class PrefixIndex(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = []  # sorted (normalized full name, kind, id)
+        self.words = []  # sorted (normalized name from its 2nd, 3rd... word, kind, id)
+        self.entries = {}  # (kind, id) -> display name
+        self.fuzzy = TrigramIndex()
+        self.built = False
+        self.checked_at = 0.0
+        self.seq = None  # last change feed seq applied
+
+    # ------------------------------------------------------------------------#
+
+    def keys(self, kind, id, name):
+        words = normalize(name).split(' ')
+        name_key = (' '.join(words), kind, id)
+        word_keys = [(' '.join(words[i:]), kind, id) for i in range(1, len(words))]
+        return name_key, word_keys
+
+    def _add(self, kind, id, name):
+        self._remove(kind, id)
+        name_key, word_keys = self.keys(kind, id, name)
+        bisect.insort(self.names, name_key)
+        for key in word_keys:
+            bisect.insort(self.words, key)
+        self.entries[(kind, id)] = name
+        self.fuzzy.add(kind, id, name)
+
+    def _remove(self, kind, id):
+        name = self.entries.pop((kind, id), None)
+        if name is None:
+            return
+        self.fuzzy.remove(kind, id)
+        name_key, word_keys = self.keys(kind, id, name)
+        for array, key in [(self.names, name_key)] + [(self.words, key) for key in word_keys]:
+            position = bisect.bisect_left(array, key)
+            if position < len(array) and array[position] == key:
+                del array[position]
+
+    def add(self, kind, id, name):
+        with self.lock:
+            self._add(kind, id, name)
+
+    def remove(self, kind, id):
+        with self.lock:
+            self._remove(kind, id)
+
+    def load(self, rows):
+        # bulk load: sort once instead of insort per row
+        names, words, entries, fuzzy = [], [], {}, TrigramIndex()
+        for kind, id, name in rows:
+            name_key, word_keys = self.keys(kind, id, name)
+            names.append(name_key)
+            words.extend(word_keys)
+            entries[(kind, id)] = name
+            fuzzy.add(kind, id, name)
+        names.sort()
+        words.sort()
+        with self.lock:
+            self.names, self.words, self.entries, self.fuzzy = names, words, entries, fuzzy
+            self.built = True
+
+    # ------------------------------------------------------------------------#
+
+    def search(self, prefix, limit=10, kind=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self.lock:
+            for array in (self.names, self.words):
+                position = bisect.bisect_left(array, (prefix,))
+                while position < len(array) and len(results) < limit:
+                    key, entry_kind, id = array[position]
+                    if not key.startswith(prefix):
+                        break
+                    position += 1
+                    if (entry_kind, id) in seen or (kind and entry_kind != kind):
+                        continue
+                    seen.add((entry_kind, id))
+                    results.append({'type': entry_kind, 'id': id,
+                                    'name': self.entries[(entry_kind, id)]})
+        return results
+
+    def fuzzy_search(self, query, kind=None, max_distance=2, limit=20):
+        """[(kind, id, name)] within max_distance edits of `query`, closest first."""
+        with self.lock:
+            return [(key[0], key[1], self.entries[key])
+                    for _, key in self.fuzzy.search(query, kind, max_distance, limit)]
+
+
+# ----------------------------------------------------------------------------#
+# Keeping the index in sync with the database.
+# ----------------------------------------------------------------------------#
+
+def feed_seq():
+    return db.session.query(func.max(Change.seq)).scalar() or 0
+
+
+def build(index):
+    # taken first: whatever commits meanwhile is fetched again by sync()
+    seq = feed_seq()
+    query = db.session.query(literal('venue'), Venue.id, Venue.name).union_all(
+        db.session.query(literal('artist'), Artist.id, Artist.name))
+    index.load(query.all())
+    index.seq = seq
+
+
+def sync(index):
+    seq = feed_seq()
+    if seq == index.seq:
+        return
+    changed = db.session.query(Change.kind, Change.entity_id).distinct() \
+        .filter(Change.seq > index.seq, Change.seq <= seq, Change.kind.in_(list(MODELS))).all()
+    if len(changed) > REBUILD_AFTER:
+        # e.g. `flask changes seed`, cheaper to reload everything
+        return build(index)
+    for kind, model in MODELS.items():
+        ids = [id for changed_kind, id in changed if changed_kind == kind]
+        if not ids:
+            continue
+        names = dict(db.session.query(model.id, model.name).filter(model.id.in_(ids)))
+        for id in ids:
+            if id in names:
+                index.add(kind, id, names[id])
+            else:
+                index.remove(kind, id)
+    index.seq = seq
+
+
+def get_index():
+    """The worker's index, built on first use and refreshed when stale."""
+    index = current_app.extensions['autocomplete']
+    now = time.monotonic()
+    if not index.built:
+        build(index)
+        index.checked_at = now
+    elif now - index.checked_at > current_app.config['AUTOCOMPLETE_REFRESH_INTERVAL']:
+        index.checked_at = now
+        sync(index)
+    return index
+
+
+# called by the create/edit/delete handlers after their commit
+def record_saved(kind, id, name):
+    index = current_app.extensions['autocomplete']
+    if index.built:
+        index.add(kind, id, name)
+
+
+def record_deleted(kind, id):
+    index = current_app.extensions['autocomplete']
+    if index.built:
+        index.remove(kind, id)
+
+
+def init_autocomplete(app):
+    app.config.setdefault('AUTOCOMPLETE_REFRESH_INTERVAL', 5)
+    app.extensions['autocomplete'] = PrefixIndex()
@@ -0,0 +1,70 @@
+# ----------------------------------------------------------------------------#
+# Concurrent throughput of the sync (gunicorn) and async (hypercorn) read
+# paths against the same local database. Start both servers first:
+#
+#   gunicorn -c gunicorn.conf.py -b 127.0.0.1:5000 wsgi:app
+#   hypercorn -w 4 -b 127.0.0.1:5001 asgi:app
+#   python benchmarks/async_read.py --sync http://127.0.0.1:5000 \
+#       --async http://127.0.0.1:5001 --concurrency 64 --requests 2000
+# ----------------------------------------------------------------------------#
+
+import argparse
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PATHS = ['/', '/venues', '/artists', '/shows', '/venues/1', '/artists/1']
+SEARCHES = ['/venues/search', '/artists/search']
+
+
+def fetch(url, data=None):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, data=data) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return status, time.perf_counter() - start
+
+
+def run(base_url, path, concurrency, total, data=None):
+    url = base_url.rstrip('/') + path
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: fetch(url, data), range(total)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status != 200)
+    return {
+        'rps': total / elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sync and async read throughput.')
+    parser.add_argument('--sync', dest='sync_url', default='http://127.0.0.1:5000')
+    parser.add_argument('--async', dest='async_url', default='http://127.0.0.1:5001')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--search-term', default='a')
+    args = parser.parse_args()
+
+    form = urllib.parse.urlencode({'search_term': args.search_term}).encode()
+    cases = [(path, None) for path in PATHS] + [(path, form) for path in SEARCHES]
+
+    print('%-18s %-6s %10s %10s %10s %7s' % ('path', 'mode', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for path, data in cases:
+        for mode, base_url in (('sync', args.sync_url), ('async', args.async_url)):
+            result = run(base_url, path, args.concurrency, args.requests, data)
+            print('%-18s %-6s %10.1f %10.1f %10.1f %7d' % (
+                path, mode, result['rps'], result['p50'], result['p99'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# ----------------------------------------------------------------------------#
+# Change feed for mirrors, /api/changes.
+#
+# Every insert, update and delete of a Venue, Artist or Show appends a row to
+# Change in the same transaction: the ORM ones through the mapper events
+# below, bulk Query.delete() / update() calls through record(), which their
+# callers (the delete handlers, dedupe.merge) make themselves. Change.seq
+# only grows, so a mirror keeps the last seq it applied as its cursor and
+#
+#   GET /api/changes?since=<cursor>&limit=500
+#
+# returns what changed after it, in seq order, with the current record of
+# each changed row or a tombstone for deleted ones, plus the cursor to send
+# next. A sync costs as much as what changed since the last one.
+#
+# Sequence numbers follow commit order, or a transaction committing late could
+# slip a seq in below a cursor already served. The changes of a transaction
+# are collected in its session and inserted just before it commits, on
+# Postgres under a transaction level advisory lock that the commit releases:
+# a seq is visible before the next one is taken. SQLite writers run one at a
+# time anyway. `flask changes seed` files every existing row once (mirrors
+# start from since=0) and `flask changes compact` drops rows superseded by a
+# later change of the same record, which keeps the feed complete from 0 at
+# one row per record.
+# ----------------------------------------------------------------------------#
+
+from datetime import datetime
+
+from sqlalchemy import event, inspect, text
+
+from models import db, Venue, Artist, Show, Change
+
+MODELS = {'venue': Venue, 'artist': Artist, 'show': Show}
+INSERT = '''
+    INSERT INTO "Change" (kind, entity_id, op, changed_at)
+    VALUES (:kind, :entity_id, :op, :changed_at)
+'''
+SEED = '''
+    INSERT INTO "Change" (kind, entity_id, op, changed_at)
+    SELECT :kind, id, 'upsert', :changed_at FROM "{table}" ORDER BY id
+'''
+# pg_advisory_xact_lock key of the seq allocation
+FEED_LOCK = 0x666565640001
+COMPACT = '''
+    DELETE FROM "Change" WHERE EXISTS (
+        SELECT 1 FROM "Change" later
+        WHERE later.kind = "Change".kind AND later.entity_id = "Change".entity_id
+          AND later.seq > "Change".seq)
+'''
+
+
+def record(kind, ids, op='upsert', session=None):
+    """Append `op` ('upsert' or 'delete') for `ids` to the feed when the
+    current transaction commits."""
+    now = datetime.utcnow()
+    (session or db.session).info.setdefault('changes', []).extend(
+        {'kind': kind, 'entity_id': id, 'op': op, 'changed_at': now} for id in ids)
+
+
+def lock(connection):
+    # held until the commit, seqs are taken one transaction at a time
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': FEED_LOCK})
+
+
+@event.listens_for(db.session, 'before_commit')
+def committing(session):
+    # the commit's own flush comes after this event, do it first
+    session.flush()
+    rows = session.info.pop('changes', None)
+    if rows:
+        connection = session.connection()
+        lock(connection)
+        connection.execute(text(INSERT), rows)
+
+
+# rolled back or closed without a commit
+@event.listens_for(db.session, 'after_transaction_end')
+def ended(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('changes', None)
+
+
+# ----------------------------------------------------------------------------#
+# ORM changes.
+# ----------------------------------------------------------------------------#
+
+def changed(mapper, row):
+    # after_update also fires for rows that were only touched
+    state = inspect(row)
+    return any(state.attrs[column.key].history.has_changes() for column in mapper.column_attrs)
+
+
+def listen(model, kind):
+    @event.listens_for(model, 'after_insert')
+    def inserted(mapper, connection, row):
+        record(kind, [row.id], 'upsert', inspect(row).session)
+
+    @event.listens_for(model, 'after_update')
+    def updated(mapper, connection, row):
+        if changed(mapper, row):
+            record(kind, [row.id], 'upsert', inspect(row).session)
+
+    @event.listens_for(model, 'after_delete')
+    def deleted(mapper, connection, row):
+        record(kind, [row.id], 'delete', inspect(row).session)
+
+
+for kind, model in MODELS.items():
+    listen(model, kind)
+
+
+# ----------------------------------------------------------------------------#
+# Reading.
+# ----------------------------------------------------------------------------#
+
+def as_json(row):
+    values = {}
+    for column in row.__table__.columns:
+        value = getattr(row, column.key)
+        values[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return values
+
+
+def feed(since, limit):
+    """{'changes': [...], 'cursor': seq to ask from next, 'more': bool}"""
+    rows = Change.query.filter(Change.seq > since).order_by(Change.seq).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    # a record changed twice in the page is sent once, at its last seq
+    latest = {}
+    for change in rows:
+        latest[change.kind, change.entity_id] = change
+    current = {}
+    for kind, model in MODELS.items():
+        ids = [id for (change_kind, id), change in latest.items() if change_kind == kind and change.op != 'delete']
+        if ids:
+            current.update(((kind, row.id), row) for row in model.query.filter(model.id.in_(ids)))
+
+    changes = []
+    for change in rows:
+        key = (change.kind, change.entity_id)
+        if latest[key] is not change:
+            continue
+        row = current.get(key)
+        changes.append({
+            'seq': change.seq,
+            'type': change.kind,
+            'id': change.entity_id,
+            # deleted after this change, its tombstone follows in a later page
+            'op': 'upsert' if row is not None else 'delete',
+            'record': as_json(row) if row is not None else None,
+            'changed_at': change.changed_at.isoformat(),
+        })
+    return {'changes': changes, 'cursor': rows[-1].seq if rows else since, 'more': more}
+
+
+# ----------------------------------------------------------------------------#
+# Maintenance.
+# ----------------------------------------------------------------------------#
+
+def seed():
+    """File every existing record once, returns {kind: rows}."""
+    now = datetime.utcnow()
+    counts = {}
+    lock(db.session.connection())
+    for kind, model in MODELS.items():
+        counts[kind] = db.session.execute(
+            text(SEED.format(table=model.__tablename__)), {'kind': kind, 'changed_at': now}).rowcount
+    db.session.commit()
+    return counts
+
+
+def compact():
+    """Drop changes superseded by a later one of the same record, returns
+    the number dropped."""
+    dropped = db.session.execute(text(COMPACT)).rowcount
+    db.session.commit()
+    return dropped
+
+
+def init_changes(app):
+    app.config.setdefault('CHANGES_PAGE_SIZE', 500)
+    app.config.setdefault('CHANGES_MAX_PAGE_SIZE', 5000)
@@ -0,0 +1,378 @@
+# ----------------------------------------------------------------------------#
+# CLI commands, registered on every app by create_app().
+#   flask templates compile
+#   flask assets build
+#   flask startup-report
+#   flask warmup
+#   flask geo backfill
+#   flask similar refresh
+#   flask analytics backfill
+#   flask images resize
+#   flask jobs work|status|retry|prune
+#   flask profile token|merge
+#   flask dedupe index|find|merge
+#   flask snapshot export
+#   flask changes seed|compact
+# ----------------------------------------------------------------------------#
+
+import os
+import re
+import subprocess
+import sys
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+templates_cli = AppGroup('templates', help='Template maintenance.')
+assets_cli = AppGroup('assets', help='Static asset pipeline.')
+geo_cli = AppGroup('geo', help='Venue and artist coordinates.')
+similar_cli = AppGroup('similar', help='Similar artists and venues.')
+analytics_cli = AppGroup('analytics', help='Show rollups behind /analytics.')
+images_cli = AppGroup('images', help='Uploaded artist and venue images.')
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+profile_cli = AppGroup('profile', help='Request profiler dumps.')
+dedupe_cli = AppGroup('dedupe', help='Duplicate artists and venues.')
+snapshot_cli = AppGroup('snapshot', help='Read-only catalog snapshots.')
+changes_cli = AppGroup('changes', help='Change feed behind /api/changes.')
+
+
+@templates_cli.command('compile')
+def compile_templates():
+    """Compile every template into the Jinja bytecode cache."""
+    env = current_app.jinja_env
+    if env.bytecode_cache is None:
+        raise click.ClickException('JINJA_BYTECODE_CACHE_DIR is not set.')
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    click.echo('Compiled %d templates into %s' % (len(names), env.bytecode_cache.directory))
+
+
+@assets_cli.command('build')
+@click.option('--min-size', default=256, help='Smallest file worth compressing, in bytes.')
+def build_assets(min_size):
+    """Fingerprint static assets and write gzip/brotli variants."""
+    from assets import brotli, build
+    build_dir = current_app.config['ASSET_BUILD_DIR']
+    manifest = build(current_app.static_folder, build_dir, min_size)
+    click.echo('Built %d assets into %s%s' % (
+        len(manifest), build_dir, '' if brotli else ' (brotli not installed, gzip only)'))
+
+
+# python -X importtime writes one line per import to stderr:
+#   import time: self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+@click.command('startup-report')
+@click.option('--module', default='wsgi', help='Module a worker imports on boot.')
+@click.option('--top', default=25, help='Number of imports to list.')
+@click.option('--min-ms', default=0.0, help='Hide imports cheaper than this.')
+def startup_report(module, top, min_ms):
+    """Report the slowest imports of a cold worker start."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True,
+        cwd=current_app.root_path, env=dict(os.environ))
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((int(cumulative_us), int(self_us), len(indent) // 2, name))
+    if result.returncode != 0 or not imports:
+        raise click.ClickException('import %s failed:\n%s' % (module, result.stderr[-2000:]))
+
+    total_ms = sum(cumulative for cumulative, _, depth, _ in imports if depth == 0) / 1000.0
+    click.echo('import %s: %.1f ms, %d modules' % (module, total_ms, len(imports)))
+    click.echo('%10s %10s  %s' % ('cumul ms', 'self ms', 'module'))
+    imports.sort(reverse=True)
+    for cumulative, self_us, depth, name in imports[:top]:
+        if cumulative / 1000.0 < min_ms:
+            break
+        click.echo('%10.1f %10.1f  %s' % (cumulative / 1000.0, self_us / 1000.0, name))
+
+
+@click.command('warmup')
+@with_appcontext
+@click.option('--access-log', type=click.Path(dir_okay=False), help='Replay the top routes of this log.')
+@click.option('--top', type=int, help='Routes taken from the access log, WARMUP_TOP by default.')
+@click.option('--route', 'routes', multiple=True, help='Replay this route, instead of the log or list.')
+@click.option('--concurrency', type=int, help='Routes replayed at once, WARMUP_CONCURRENCY by default.')
+@click.option('--url', help='Replay against a running server, e.g. http://127.0.0.1:5000.')
+def warmup_command(access_log, top, routes, concurrency, url):
+    """Compile templates, build the caches and replay the busiest routes."""
+    import time
+    from warmup import format_result, run
+    started = time.monotonic()
+    results = run(current_app._get_current_object(), list(routes), access_log, top,
+                  concurrency=concurrency, base_url=url)
+    for step, status, ms in results:
+        click.echo(format_result(step, status, ms))
+    failed = [step for step, status, ms in results if status is not None and status >= 500]
+    skipped = [step for step, status, ms in results if status is None and step.startswith('/')]
+    click.echo('warmed up in %.2fs, %d routes failed, %d skipped' % (
+        time.monotonic() - started, len(failed), len(skipped)))
+    if failed:
+        raise click.ClickException('failing routes: ' + ', '.join(failed))
+
+
+@geo_cli.command('backfill')
+@click.option('--batch-size', default=500, help='Rows updated per commit.')
+def geo_backfill(batch_size):
+    """Set coordinates of every venue and artist from its city."""
+    import geo
+    from models import db, Venue, Artist
+    for model in (Venue, Artist):
+        located = missing = 0
+        last_id = 0
+        while True:
+            rows = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                if geo.locate(row):
+                    located += 1
+                else:
+                    missing += 1
+            last_id = rows[-1].id
+            db.session.commit()
+        click.echo('%s: %d located, %d cities not in %s' % (
+            model.__tablename__, located, missing, current_app.config['GEO_CITIES']))
+
+
+@similar_cli.command('refresh')
+@click.option('--kind', type=click.Choice(['artist', 'venue']), multiple=True,
+              help='Only refresh artists or venues.')
+@click.option('--full', is_flag=True, help='Recompute everything, not just what changed.')
+def similar_refresh(kind, full):
+    """Recompute similar artists/venues changed since the last run."""
+    import time
+    from similarity import refresh
+    config = current_app.config
+    for name in kind or ('artist', 'venue'):
+        started = time.monotonic()
+        count = refresh(name, config['SIMILAR_TOP_K'], config['SIMILAR_METRIC'], full)
+        click.echo('%s: %d lists rewritten in %.2fs' % (name, count, time.monotonic() - started))
+
+
+@analytics_cli.command('backfill')
+@click.option('--batch-size', default=5000, help='Shows fetched at a time.')
+def analytics_backfill(batch_size):
+    """Correct the show rollups from the Show table."""
+    from analytics import backfill
+
+    def progress(done):
+        click.echo('%d shows counted' % done)
+
+    done, corrected = backfill(batch_size, progress)
+    click.echo('%d shows counted, %d rollup rows corrected' % (done, corrected))
+
+
+@images_cli.command('resize')
+@click.option('--workers', default=4, help='Images resized at once.')
+def images_resize(workers):
+    """Write the resized copies missing for IMAGE_WIDTHS, e.g. after
+    adding a width or restoring the originals from a backup."""
+    from concurrent.futures import ThreadPoolExecutor
+    from images import ORIGINAL, resize_logged
+    directory = current_app.config['IMAGE_UPLOAD_DIR']
+    widths = current_app.config['IMAGE_WIDTHS']
+    logger = current_app.logger
+    originals = sorted(name for name in os.listdir(directory) if ORIGINAL.match(name)) \
+        if os.path.isdir(directory) else []
+    with ThreadPoolExecutor(workers) as pool:
+        written = pool.map(lambda name: resize_logged(logger, directory, name, widths),
+                           originals)
+        count = sum(len(names or ()) for names in written)
+    click.echo('%d images, %d copies written' % (len(originals), count))
+
+
+@jobs_cli.command('work')
+@click.option('--threads', default=2, help='Jobs run at once.')
+@click.option('--burst', is_flag=True, help='Exit once no job is ready.')
+def jobs_work(threads, burst):
+    """Run queued jobs until interrupted (SIGINT/SIGTERM finish the
+    running ones first)."""
+    import signal
+    from jobs import Worker
+    worker = Worker(current_app._get_current_object(), threads, burst)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    worker.start()
+    try:
+        worker.join()
+    except KeyboardInterrupt:
+        worker.stop()
+        worker.join()
+    click.echo('%d jobs done, %d failed' % (worker.done, worker.failed))
+
+
+@jobs_cli.command('status')
+def jobs_status():
+    """Count jobs by task and status."""
+    from models import db, Job
+    rows = db.session.query(Job.task, Job.status, db.func.count(), db.func.min(Job.run_at)) \
+        .group_by(Job.task, Job.status).order_by(Job.task, Job.status)
+    for name, status, count, oldest in rows:
+        click.echo('%-30s %-9s %6d  oldest run_at %s' % (name, status, count, oldest))
+
+
+@jobs_cli.command('retry')
+@click.option('--task', 'name', help='Only jobs of this task.')
+def jobs_retry(name):
+    """Give failed jobs a fresh set of attempts."""
+    from datetime import datetime
+    from models import db, Job
+    query = Job.query.filter_by(status='failed')
+    if name:
+        query = query.filter_by(task=name)
+    count = query.update({'status': 'retrying', 'attempts': 0, 'run_at': datetime.utcnow(),
+                          'finished_at': None}, synchronize_session=False)
+    db.session.commit()
+    click.echo('%d jobs queued again' % count)
+
+
+@jobs_cli.command('prune')
+@click.option('--days', default=7, help='Keep finished jobs this long.')
+def jobs_prune(days):
+    """Delete jobs that finished more than --days ago."""
+    from datetime import datetime, timedelta
+    from models import db, Job
+    count = Job.query.filter(Job.status.in_(['done', 'failed']),
+                             Job.finished_at < datetime.utcnow() - timedelta(days=days)) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    click.echo('%d jobs deleted' % count)
+
+
+@profile_cli.command('token')
+def profile_token():
+    """Print an X-Profile header value that gets a request profiled."""
+    from profiler import HEADER, make_token
+    click.echo('%s: %s' % (HEADER, make_token(current_app)))
+
+
+@profile_cli.command('merge')
+@click.option('--endpoint', help='Only dumps of this endpoint, e.g. show_venue.')
+@click.option('--format', 'extension', type=click.Choice(['folded', 'prof']), default='folded',
+              help='Collapsed stacks (PROFILE_MODE=sample) or pstats dumps (cprofile).')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write here instead of stdout.')
+def profile_merge(endpoint, extension, output):
+    """Add the profile dumps up: collapsed stacks for flamegraph.pl or
+    speedscope, or one pstats file."""
+    from profiler import dumps, merge_folded, merge_pstats
+    paths = dumps(current_app.config['PROFILE_DIR'], endpoint, extension)
+    if not paths:
+        raise click.ClickException('no .%s dumps in %s' % (extension, current_app.config['PROFILE_DIR']))
+    if extension == 'prof':
+        stats = merge_pstats(paths)
+        if output:
+            stats.dump_stats(output)
+        else:
+            stats.sort_stats('cumulative').print_stats(30)
+    else:
+        stacks = merge_folded(paths)
+        lines = ''.join('%s %d\n' % (stack, count) for stack, count in sorted(stacks.items()))
+        if output:
+            with open(output, 'w') as f:
+                f.write(lines)
+        else:
+            click.echo(lines, nl=False)
+    click.echo('%d dumps merged' % len(paths), err=True)
+
+
+@dedupe_cli.command('index')
+@click.option('--kind', type=click.Choice(['artist', 'venue']), multiple=True,
+              help='Only index artists or venues.')
+@click.option('--batch-size', default=1000, help='Rows filed per transaction.')
+def dedupe_index(kind, batch_size):
+    """Rebuild the blocking keys, after the migration or a bulk import."""
+    from dedupe import rebuild
+    for name in kind or ('artist', 'venue'):
+        click.echo('%s: %d filed' % (name, rebuild(name, batch_size)))
+
+
+@dedupe_cli.command('find')
+@click.option('--kind', type=click.Choice(['artist', 'venue']), multiple=True,
+              help='Only look at artists or venues.')
+@click.option('--threshold', type=float, help='Lowest score reported, DEDUPE_THRESHOLD by default.')
+def dedupe_find(kind, threshold):
+    """List the likely duplicate pairs, best first."""
+    from dedupe import MODELS, find
+    if threshold is None:
+        threshold = current_app.config['DEDUPE_THRESHOLD']
+    for name in kind or ('artist', 'venue'):
+        pairs = find(name, threshold)
+        model = MODELS[name]
+        names = dict(model.query.with_entities(model.id, model.name).filter(
+            model.id.in_({id for pair in pairs for id in pair[1:]})))
+        for score, a, b in pairs:
+            click.echo('%s %.2f  #%d %s  #%d %s' % (name, score, a, names[a], b, names[b]))
+        click.echo('%s: %d likely duplicates' % (name, len(pairs)))
+
+
+@dedupe_cli.command('merge')
+@click.argument('kind', type=click.Choice(['artist', 'venue']))
+@click.argument('keep', type=int)
+@click.argument('duplicates', type=int, nargs=-1, required=True)
+def dedupe_merge(kind, keep, duplicates):
+    """Fold DUPLICATES into KEEP: their shows move to it, then they are deleted."""
+    from dedupe import merge
+    from models import db
+    try:
+        moved = merge(kind, keep, list(duplicates))
+    except LookupError as e:
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo('%d shows moved to %s #%d, %d deleted' % (moved, kind, keep, len(set(duplicates) - {keep})))
+
+
+@snapshot_cli.command('export')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='SNAPSHOT_PATH by default.')
+def snapshot_export(output):
+    """Write venues, artists and shows to a snapshot for SNAPSHOT_SERVING."""
+    import time
+    from snapshot import export
+    path = output or current_app.config['SNAPSHOT_PATH']
+    started = time.monotonic()
+    rows = export(path)
+    click.echo('%s: %s in %.2fs, %d bytes' % (
+        path, ', '.join('%d %ss' % (count, kind) for kind, count in rows.items()),
+        time.monotonic() - started, os.path.getsize(path)))
+
+
+@changes_cli.command('seed')
+@click.option('--force', is_flag=True, help='Seed even though the feed has changes already.')
+def changes_seed(force):
+    """File every existing venue, artist and show once, for mirrors starting
+    from since=0."""
+    from changes import seed
+    from models import Change
+    if not force and Change.query.first() is not None:
+        raise click.ClickException('the feed is not empty, pass --force to add every record again')
+    counts = seed()
+    click.echo(', '.join('%d %ss' % (count, kind) for kind, count in counts.items()) + ' filed')
+
+
+@changes_cli.command('compact')
+def changes_compact():
+    """Drop changes superseded by a later one of the same record."""
+    from changes import compact
+    click.echo('%d changes dropped' % compact())
+
+
+def register_commands(app):
+    app.cli.add_command(templates_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(startup_report)
+    app.cli.add_command(warmup_command)
+    app.cli.add_command(geo_cli)
+    app.cli.add_command(similar_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(profile_cli)
+    app.cli.add_command(dedupe_cli)
+    app.cli.add_command(snapshot_cli)
+    app.cli.add_command(changes_cli)
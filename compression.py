@@ -0,0 +1,177 @@
+# ----------------------------------------------------------------------------#
+# Dynamic response compression.
+#
+# Compresses text responses (the /shows, /venues and /artists pages in
+# particular) with brotli when the client accepts it and the module is
+# installed, gzip otherwise. Small bodies, other content types and responses
+# that are already encoded (fingerprinted assets, files) are left alone.
+# Streamed responses are compressed chunk by chunk and flushed after every
+# chunk, so clients still see data as soon as it is produced.
+#
+# Per worker statistics (bytes in/out and CPU time per encoding) are kept on
+# the extension and shown at /admin/compression to help tune COMPRESS_LEVEL.
+# ----------------------------------------------------------------------------#
+
+import threading
+import time
+import zlib
+
+from flask import current_app, jsonify, request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+class GzipCompressor(object):
+
+    def __init__(self, level):
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(object):
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+
+class Compress(object):
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ALGORITHMS', ['br', 'gzip'])
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_MIMETYPES', [
+            'text/html', 'text/css', 'text/plain', 'text/xml', 'text/calendar',
+            'application/json', 'application/javascript', 'application/xml',
+        ])
+        app.extensions['compress'] = self
+        app.after_request(self.after_request)
+        if app.config.get('ADMIN_ENABLED'):
+            app.add_url_rule('/admin/compression', 'compression_stats', self.stats_view)
+
+    # ------------------------------------------------------------------------#
+
+    def choose_encoding(self, response):
+        config = current_app.config
+        if response.status_code < 200 or response.status_code in (204, 304) \
+                or 'Content-Encoding' in response.headers \
+                or response.direct_passthrough \
+                or response.mimetype not in config['COMPRESS_MIMETYPES'] \
+                or 'no-transform' in response.headers.get('Cache-Control', ''):
+            return None
+        offered = [name for name in config['COMPRESS_ALGORITHMS'] if name in COMPRESSORS]
+        return request.accept_encodings.best_match(offered)
+
+    def compressor(self, encoding):
+        config = current_app.config
+        level = config['COMPRESS_BR_LEVEL'] if encoding == 'br' else config['COMPRESS_LEVEL']
+        return COMPRESSORS[encoding](level)
+
+    def after_request(self, response):
+        encoding = self.choose_encoding(response)
+        if encoding is None:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if response.is_streamed:
+            response.response = self.compress_stream(
+                response.response, self.compressor(encoding), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+                return response
+            started = time.thread_time()
+            compressor = self.compressor(encoding)
+            compressed = compressor.compress(data) + compressor.finish()
+            self.record(encoding, len(data), len(compressed), time.thread_time() - started)
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # the body is no longer byte-identical to the uncompressed one
+            response.set_etag(etag, weak=True)
+        return response
+
+    def compress_stream(self, source, compressor, encoding):
+        size_in = size_out = 0
+        cpu = 0.0
+        try:
+            for chunk in source:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                started = time.thread_time()
+                out = compressor.compress(chunk) + compressor.flush()
+                cpu += time.thread_time() - started
+                size_in += len(chunk)
+                size_out += len(out)
+                yield out
+            started = time.thread_time()
+            out = compressor.finish()
+            cpu += time.thread_time() - started
+            size_out += len(out)
+            yield out
+        finally:
+            if hasattr(source, 'close'):
+                source.close()
+            self.record(encoding, size_in, size_out, cpu)
+
+    # ------------------------------------------------------------------------#
+
+    def record(self, encoding, size_in, size_out, cpu):
+        with self.lock:
+            stats = self.stats.setdefault(encoding, {
+                'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0})
+            stats['responses'] += 1
+            stats['bytes_in'] += size_in
+            stats['bytes_out'] += size_out
+            stats['cpu_seconds'] += cpu
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for encoding, stats in self.stats.items():
+                summary[encoding] = dict(stats)
+                summary[encoding]['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+                summary[encoding]['ratio'] = \
+                    round(stats['bytes_out'] / float(stats['bytes_in']), 4) if stats['bytes_in'] else None
+        return summary
+
+    def stats_view(self):
+        config = current_app.config
+        return jsonify(levels={'gzip': config['COMPRESS_LEVEL'], 'br': config['COMPRESS_BR_LEVEL']},
+                       stats=self.summary())
@@ -0,0 +1,290 @@
+# ----------------------------------------------------------------------------#
+# Duplicate artists and venues.
+#
+# Every artist and venue is filed under a few blocking keys in DuplicateKey:
+# its phone number (digits only), its website (host and path) and, for the
+# name, the 8 bands of a MinHash signature over its trigrams. Two names whose
+# trigrams overlap by 80% (Jaccard) share a band 98% of the time, by 30%
+# only 6%. Only rows sharing a key are ever compared, so finding duplicates
+# grows with the number of rows instead of the number of pairs. Keys shared
+# by more than MAX_BLOCK rows (a booking agency's phone number) say nothing
+# and are skipped.
+#
+# Candidates are scored on name similarity, same city, phone and website;
+# from DEDUPE_THRESHOLD up they are reported. New listings are checked
+# before they are saved, `flask dedupe find` lists every likely pair and
+# `flask dedupe merge` folds duplicates into one row, moving their shows
+# with one UPDATE. The create/edit/delete handlers file the keys with a
+# job (jobs.py) after their commit.
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from sqlalchemy import func
+
+import changes
+from fuzzy import trigrams
+from geo import city_key
+from jobs import enqueue, task
+from models import db, Venue, Artist, Show, DuplicateKey
+from similarity import schedule_refresh
+
+MODELS = {'venue': Venue, 'artist': Artist}
+COLUMNS = {'venue': Show.venue_id, 'artist': Show.artist_id}
+# 8 bands of 4 rows: names collide from about 0.6 trigram similarity
+BANDS = 8
+ROWS = 4
+PRIME = (1 << 61) - 1
+# fixed so that keys saved by one process match those of the next
+PERMUTATIONS = [(int.from_bytes(hashlib.blake2b(b'a%d' % i, digest_size=8).digest(), 'little') % PRIME,
+                 int.from_bytes(hashlib.blake2b(b'b%d' % i, digest_size=8).digest(), 'little') % PRIME)
+                for i in range(BANDS * ROWS)]
+MAX_BLOCK = 50
+# ids per IN (...) clause
+ID_BATCH = 500
+
+
+# ----------------------------------------------------------------------------#
+# Normalization and keys.
+# ----------------------------------------------------------------------------#
+
+def normalize_name(name):
+    # "The Dueling Pianos Bar" and "dueling pianos bar!" are the same name
+    words = re.sub(r'[^\w\s]', ' ', (name or '').casefold().replace('&', ' and ')).split()
+    if words and words[0] == 'the':
+        words = words[1:]
+    return ' '.join(words)
+
+
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return digits if len(digits) >= 7 else None
+
+
+def normalize_website(website):
+    if not website or not website.strip():
+        return None
+    url = website.strip().casefold()
+    parts = urlsplit(url if '//' in url else '//' + url)
+    host = parts.hostname or ''
+    if host.startswith('www.'):
+        host = host[4:]
+    return (host + parts.path.rstrip('/')) or None
+
+
+def minhash(shingles):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+              for shingle in shingles]
+    return [min((a * value + b) % PRIME for value in hashes) for a, b in PERMUTATIONS]
+
+
+def blocking_keys(row):
+    keys = set()
+    phone = normalize_phone(row.phone)
+    if phone:
+        keys.add('p:' + phone)
+    website = normalize_website(row.website)
+    if website:
+        keys.add('w:' + hashlib.blake2b(website.encode(), digest_size=10).hexdigest())
+    name = normalize_name(row.name)
+    if name:
+        signature = minhash(trigrams(name))
+        for band in range(BANDS):
+            rows = ','.join(map(str, signature[band * ROWS:(band + 1) * ROWS]))
+            keys.add('n%d:%s' % (band, hashlib.blake2b(rows.encode(), digest_size=10).hexdigest()))
+    return keys
+
+
+def insert_keys(kind, rows):
+    values = [{'kind': kind, 'key': key, 'entity_id': row.id}
+              for row in rows for key in sorted(blocking_keys(row))]
+    # an empty list would insert one row of defaults
+    if values:
+        db.session.execute(DuplicateKey.__table__.insert(), values)
+
+
+def save_keys(kind, row):
+    """File `row` under its current keys, in the current transaction."""
+    db.session.flush()  # new rows get their id
+    delete_keys(kind, [row.id])
+    insert_keys(kind, [row])
+
+
+def delete_keys(kind, ids):
+    DuplicateKey.query.filter(DuplicateKey.kind == kind, DuplicateKey.entity_id.in_(ids)) \
+        .delete(synchronize_session=False)
+
+
+@task('dedupe.keys')
+def keys_job(kind, id):
+    """File `id` under its current keys, or drop its keys once it is gone."""
+    row = MODELS[kind].query.get(id)
+    delete_keys(kind, [id])
+    if row is not None:
+        insert_keys(kind, [row])
+
+
+def schedule_keys(kind, *rows):
+    """Queue keys_job() for `rows` (artists or venues, or their ids) with the
+    current transaction."""
+    db.session.flush()  # new rows get their id
+    for row in rows:
+        id = int(getattr(row, 'id', row))
+        enqueue('dedupe.keys', kind, id, key='dedupe.keys:%s:%d' % (kind, id))
+
+
+# ----------------------------------------------------------------------------#
+# Scoring.
+# ----------------------------------------------------------------------------#
+
+def similarity(a, b):
+    """0..1, how likely the two rows are the same artist or venue."""
+    names_a, names_b = trigrams(normalize_name(a.name)), trigrams(normalize_name(b.name))
+    score = 0.6 * len(names_a & names_b) / len(names_a | names_b) if names_a | names_b else 0.0
+    city = city_key(a.city, a.state)
+    if city[0] and city == city_key(b.city, b.state):
+        score += 0.2
+    phone = normalize_phone(a.phone)
+    if phone and phone == normalize_phone(b.phone):
+        score += 0.3
+    website = normalize_website(a.website)
+    if website and website == normalize_website(b.website):
+        score += 0.3
+    return min(score, 1.0)
+
+
+def likely_duplicates(kind, row, threshold, limit=5):
+    """[(score, row)] of the saved rows `row` probably duplicates, best first."""
+    model = MODELS[kind]
+    keys = blocking_keys(row)
+    if not keys:
+        return []
+    blocks = db.session.query(DuplicateKey.key, func.count()) \
+        .filter(DuplicateKey.kind == kind, DuplicateKey.key.in_(keys)) \
+        .group_by(DuplicateKey.key).all()
+    usable = [key for key, size in blocks if size <= MAX_BLOCK]
+    if not usable:
+        return []
+    ids = db.session.query(DuplicateKey.entity_id).distinct() \
+        .filter(DuplicateKey.kind == kind, DuplicateKey.key.in_(usable))
+    if row.id is not None:
+        ids = ids.filter(DuplicateKey.entity_id != row.id)
+    candidates = model.query.filter(model.id.in_(ids.subquery())).all()
+    scored = [(similarity(row, candidate), candidate) for candidate in candidates]
+    scored = [hit for hit in scored if hit[0] >= threshold]
+    scored.sort(key=lambda hit: (-hit[0], hit[1].id))
+    return scored[:limit]
+
+
+def find(kind, threshold):
+    """[(score, id, id)] of all likely duplicate pairs, best first."""
+    model = MODELS[kind]
+    sizes = db.session.query(DuplicateKey.key, func.count().label('size')) \
+        .filter(DuplicateKey.kind == kind).group_by(DuplicateKey.key) \
+        .having(func.count().between(2, MAX_BLOCK)).subquery()
+    members = defaultdict(list)
+    for key, entity_id in db.session.query(DuplicateKey.key, DuplicateKey.entity_id) \
+            .join(sizes, sizes.c.key == DuplicateKey.key) \
+            .filter(DuplicateKey.kind == kind).order_by(DuplicateKey.key, DuplicateKey.entity_id):
+        members[key].append(entity_id)
+    pairs = {(a, b) for ids in members.values()
+             for i, a in enumerate(ids) for b in ids[i + 1:]}
+
+    rows = {}
+    wanted = sorted({id for pair in pairs for id in pair})
+    for start in range(0, len(wanted), ID_BATCH):
+        for row in model.query.filter(model.id.in_(wanted[start:start + ID_BATCH])):
+            rows[row.id] = row
+    found = []
+    for a, b in pairs:
+        if a in rows and b in rows:
+            score = similarity(rows[a], rows[b])
+            if score >= threshold:
+                found.append((score, a, b))
+    found.sort(key=lambda pair: (-pair[0], pair[1], pair[2]))
+    return found
+
+
+def rebuild(kind, batch_size=1000):
+    """Refile every row of `kind`, returns the number of rows."""
+    model = MODELS[kind]
+    DuplicateKey.query.filter_by(kind=kind).delete(synchronize_session=False)
+    done, last_id = 0, 0
+    while True:
+        rows = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            break
+        insert_keys(kind, rows)
+        db.session.commit()
+        done += len(rows)
+        last_id = rows[-1].id
+    return done
+
+
+# ----------------------------------------------------------------------------#
+# Merging.
+# ----------------------------------------------------------------------------#
+
+def merge(kind, keep_id, duplicate_ids):
+    """Move the shows of `duplicate_ids` to `keep_id`, fill the kept row's
+    empty fields from them and delete them, in the current transaction.
+    Returns the number of shows moved."""
+    from analytics import apply, show_keys
+
+    model = MODELS[kind]
+    column = COLUMNS[kind]
+    duplicate_ids = [id for id in duplicate_ids if id != keep_id]
+    keep = model.query.get(keep_id)
+    duplicates = model.query.filter(model.id.in_(duplicate_ids)).order_by(model.id).all()
+    missing = set(duplicate_ids) - {row.id for row in duplicates}
+    if keep is None:
+        missing.add(keep_id)
+    if missing:
+        raise LookupError('no %s with id %s' % (kind, ', '.join(map(str, sorted(missing)))))
+
+    # the bulk UPDATE bypasses the rollup and change feed events, do their work here
+    connection = db.session.connection()
+    deltas = Counter()
+    shows = db.session.query(Show.venue_id, Show.artist_id, Show.date) \
+        .filter(column.in_(duplicate_ids), Show.venue_id.isnot(None),
+                Show.artist_id.isnot(None), Show.date.isnot(None)).all()
+    for venue_id, artist_id, when in shows:
+        moved = (keep_id, artist_id) if kind == 'venue' else (venue_id, keep_id)
+        for key in show_keys(connection, venue_id, artist_id, when).items():
+            deltas[key] -= 1
+        for key in show_keys(connection, moved[0], moved[1], when).items():
+            deltas[key] += 1
+    moved_ids = [id for id, in db.session.query(Show.id).filter(column.in_(duplicate_ids))]
+    moved_shows = Show.query.filter(column.in_(duplicate_ids)) \
+        .update({column.key: keep_id}, synchronize_session=False)
+    apply(connection, deltas)
+    changes.record('show', moved_ids)
+
+    for name in model.__table__.columns.keys():
+        if name in ('id', 'updated_at') or getattr(keep, name) not in (None, ''):
+            continue
+        for duplicate in duplicates:
+            if getattr(duplicate, name) not in (None, ''):
+                setattr(keep, name, getattr(duplicate, name))
+                break
+    delete_keys(kind, duplicate_ids)
+    model.query.filter(model.id.in_(duplicate_ids)).delete(synchronize_session=False)
+    changes.record(kind, duplicate_ids, 'delete')
+    save_keys(kind, keep)
+    # the similarity refresh looks for newer updated_at and show ids, the
+    # moved shows kept theirs: touch the kept row and the other side of them
+    now = datetime.utcnow()
+    keep.updated_at = now
+    other = 'artist' if kind == 'venue' else 'venue'
+    partners = {artist_id if kind == 'venue' else venue_id for venue_id, artist_id, when in shows}
+    if partners:
+        MODELS[other].query.filter(MODELS[other].id.in_(partners)) \
+            .update({'updated_at': now}, synchronize_session=False)
+    schedule_refresh('artist', 'venue')
+    return moved_shows
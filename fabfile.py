@@ -38,6 +38,12 @@ def heroku():
     local("git push heroku master")
 
 
+def warmup():
+    # the web dynos warm up on boot (WARMUP_ON_BOOT in the Procfile) before
+    # they take traffic; this warms the database and reports every route
+    local("heroku run --exit-code FLASK_APP=wsgi flask warmup")
+
+
 def heroku_test():
     local(
         "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
@@ -49,6 +55,7 @@ def deploy():
     test()
     commit()
     heroku()
+    warmup()
     heroku_test()
 
 # rollback
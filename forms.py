@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_wtf import Form
+from flask_wtf.file import FileField
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField, BooleanField
 from wtforms.validators import DataRequired, AnyOf, URL, ValidationError, regexp, Optional
 
@@ -93,6 +94,9 @@ class VenueForm(Form):
     image_link = StringField(
         'image_link'
     )
+    image_file = FileField(
+        'image_file'
+    )
     website = StringField(
         'website', validators=[URL()]
     )
@@ -201,6 +205,9 @@ class ArtistForm(Form):
     image_link = StringField(
         'image_link'
     )
+    image_file = FileField(
+        'image_file'
+    )
     website = StringField(
         'website', validators=[URL()]
     )
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------#
+# Template fragment cache.
+#
+#   {% cache fragment_key('venue-tile', venue), 600 %}
+#       ... expensive markup ...
+#   {% endcache %}
+#
+# The rendered block is kept in a bounded in-process LRU store. Keys carry the
+# entity id and updated_at, so editing a record makes its old fragments
+# unreachable and they simply age out of the store.
+# ----------------------------------------------------------------------------#
+
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class FragmentCache(object):
+    """Thread safe LRU mapping of key -> (expires, value)."""
+
+    def __init__(self, max_size=2048):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_timeout=300)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, timeout, caller):
+        store = self.environment.fragment_cache
+        if store is None:
+            return caller()
+        value = store.get(key)
+        if value is not None:
+            return value
+        value = caller()
+        if inspect.isawaitable(value):
+            # async environments (Quart) render the block as a coroutine
+            return self._cache_async(store, key, timeout, value)
+        store.set(key, value, timeout or self.environment.fragment_cache_timeout)
+        return value
+
+    async def _cache_async(self, store, key, timeout, value):
+        value = await value
+        store.set(key, value, timeout or self.environment.fragment_cache_timeout)
+        return value
+
+
+def fragment_key(prefix, *parts):
+    """Cache key for `prefix` and entities (or plain values): records
+    contribute id@updated_at so the key changes whenever they are edited."""
+    key = [prefix]
+    for part in parts:
+        if hasattr(part, 'id'):
+            updated_at = getattr(part, 'updated_at', None)
+            key.append('%s@%s' % (part.id, updated_at.isoformat() if updated_at else ''))
+        else:
+            key.append(str(part))
+    return ':'.join(key)
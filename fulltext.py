@@ -0,0 +1,178 @@
+# ----------------------------------------------------------------------------#
+# Ranked full-text search over names, genres, locations and seeking
+# descriptions of venues and artists.
+#
+# Postgres: a stored `search_vector` tsvector on "Venue" and "Artist" (name
+# weighted A, genres B, seeking description C, location D), kept current by a
+# BEFORE INSERT OR UPDATE trigger and served by a GIN index.
+# SQLite: one FTS5 table `search_index` (rowid = id * 2 + 0 for venues, 1 for
+# artists) kept current by AFTER INSERT/UPDATE/DELETE triggers.
+# Both are created by migration b7e2d94c0a61. On SQLite db.create_all() adds
+# them too, for test apps whose in-memory database is never migrated.
+# ----------------------------------------------------------------------------#
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, text
+
+from models import db
+
+# ts_headline/snippet mark matches with these, they are swapped for <mark>
+# after the rest of the snippet is HTML escaped
+START, STOP = '\x02', '\x03'
+
+TABLES = {'venue': ('Venue', 'seeking_talent'), 'artist': ('Artist', 'seeking_venue')}
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet or '')).replace(START, '<mark>').replace(STOP, '</mark>'))
+
+
+# ----------------------------------------------------------------------------#
+# Postgres.
+# ----------------------------------------------------------------------------#
+
+POSTGRES_QUERY = '''
+    SELECT '{kind}' AS kind, hit.id, hit.name, hit.rank,
+           ts_headline('english', concat_ws(' / ', hit.seeking_description, hit.genres, hit.city),
+                       hit.query, 'StartSel=' || :start || ', StopSel=' || :stop ||
+                       ', MaxFragments=2, MaxWords=20, MinWords=5') AS snippet
+    FROM (
+        SELECT t.id, t.name, t.seeking_description, t.genres, t.city, q.query,
+               ts_rank_cd(t.search_vector, q.query) AS rank
+        FROM "{table}" t,
+             (SELECT {query} AS query) q
+        WHERE t.search_vector @@ q.query {genre} {seeking}
+        ORDER BY rank DESC
+        LIMIT :limit
+    ) hit
+'''
+
+
+def postgres_query(terms, genre):
+    # plainto_tsquery copes with any user input
+    parts = []
+    if terms:
+        parts.append("plainto_tsquery('english', :terms)")
+    if genre:
+        parts.append("plainto_tsquery('english', :genre)")
+    return ' && '.join(parts)
+
+
+# the GIN index finds rows mentioning the genre anywhere, this rechecks that
+# it is among the genres lexemes (weight B)
+POSTGRES_GENRE = "AND ts_filter(t.search_vector, '{b}') @@ plainto_tsquery('english', :genre)"
+
+
+def search_postgres(terms, kind, genre, seeking, limit):
+    statements = []
+    for entity, (table, seeking_column) in TABLES.items():
+        if kind and kind != entity:
+            continue
+        statements.append(POSTGRES_QUERY.format(
+            kind=entity, table=table, query=postgres_query(terms, genre),
+            genre=POSTGRES_GENRE if genre else '',
+            seeking='AND t.%s' % seeking_column if seeking else ''))
+    sql = ' UNION ALL '.join('(%s)' % statement for statement in statements)
+    sql += ' ORDER BY rank DESC LIMIT :limit'
+    return db.session.execute(text(sql), {
+        'terms': terms, 'genre': genre, 'limit': limit, 'start': START, 'stop': STOP})
+
+
+# ----------------------------------------------------------------------------#
+# SQLite.
+# ----------------------------------------------------------------------------#
+
+# bm25 column weights: kind, entity_id, name, genres, city, state, address,
+# seeking_description, seeking
+SQLITE_QUERY = '''
+    SELECT kind, entity_id AS id, name,
+           -bm25(search_index, 0, 0, 10.0, 5.0, 1.0, 1.0, 1.0, 2.0, 0) AS rank,
+           snippet(search_index, -1, :start, :stop, '...', 16) AS snippet
+    FROM search_index
+    WHERE search_index MATCH :match {filters}
+    ORDER BY rank DESC
+    LIMIT :limit
+'''
+
+
+def fts5_phrase(value):
+    return '"%s"' % value.replace('"', '""')
+
+
+def sqlite_match(terms, genre):
+    # every word must match (prefix match on the last one), genre is
+    # restricted to the genres column
+    words = terms.split()
+    parts = [fts5_phrase(word) for word in words[:-1]]
+    if words:
+        parts.append(fts5_phrase(words[-1]) + '*')
+    if genre:
+        parts.append('genres : ' + fts5_phrase(genre))
+    return ' AND '.join(parts)
+
+
+# the same as migration b7e2d94c0a61, which builds them on a real database
+SQLITE_TABLE = '''
+    CREATE VIRTUAL TABLE search_index USING fts5(
+        kind UNINDEXED, entity_id UNINDEXED, name, genres, city, state, address,
+        seeking_description, seeking UNINDEXED,
+        tokenize = 'porter unicode61'
+    )
+'''
+SQLITE_ROW = '''
+    INSERT INTO search_index (rowid, kind, entity_id, name, genres, city, state, address,
+                              seeking_description, seeking)
+    VALUES (NEW.id * 2 + {offset}, '{kind}', NEW.id, NEW.name, NEW.genres, NEW.city, NEW.state,
+            {address}, NEW.seeking_description, NEW.{seeking});
+'''
+SQLITE_TRIGGERS = [
+    'CREATE TRIGGER "{table}_search_insert" AFTER INSERT ON "{table}" BEGIN %s END' % SQLITE_ROW,
+    'CREATE TRIGGER "{table}_search_update" AFTER UPDATE ON "{table}" BEGIN '
+    'DELETE FROM search_index WHERE rowid = OLD.id * 2 + {offset}; %s END' % SQLITE_ROW,
+    'CREATE TRIGGER "{table}_search_delete" AFTER DELETE ON "{table}" BEGIN '
+    'DELETE FROM search_index WHERE rowid = OLD.id * 2 + {offset}; END',
+]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_sqlite_index(metadata, connection, **kw):
+    if connection.dialect.name != 'sqlite' or connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'search_index'").first():
+        return
+    connection.execute(SQLITE_TABLE)
+    for offset, (kind, (table, seeking)) in enumerate(TABLES.items()):
+        address = 'NEW.address' if kind == 'venue' else 'NULL'
+        for trigger in SQLITE_TRIGGERS:
+            connection.execute(trigger.format(table=table, kind=kind, offset=offset,
+                                              seeking=seeking, address=address))
+
+
+def search_sqlite(terms, kind, genre, seeking, limit):
+    filters = ''
+    if kind:
+        filters += ' AND kind = :kind'
+    if seeking:
+        filters += ' AND seeking = 1'
+    return db.session.execute(text(SQLITE_QUERY.format(filters=filters)), {
+        'match': sqlite_match(terms, genre), 'kind': kind, 'limit': limit,
+        'start': START, 'stop': STOP})
+
+
+# ----------------------------------------------------------------------------#
+
+def search(terms='', kind=None, genre=None, seeking=False, limit=20):
+    """Best matches first: [{'type', 'id', 'name', 'rank', 'snippet'}]. The
+    snippet is safe HTML with the matches in <mark>."""
+    terms = ' '.join((terms or '').split())
+    genre = (genre or '').strip()
+    if not terms and not genre:
+        return []
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        rows = search_postgres(terms, kind, genre, seeking, limit)
+    elif dialect == 'sqlite':
+        rows = search_sqlite(terms, kind, genre, seeking, limit)
+    else:
+        raise NotImplementedError('full-text search is not available on %s' % dialect)
+    return [{'type': row.kind, 'id': row.id, 'name': row.name, 'rank': float(row.rank),
+             'snippet': highlight(row.snippet)} for row in rows]
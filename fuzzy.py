@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------#
+# Typo tolerant name matching.
+#
+# Names are indexed by their trigrams. A name within edit distance k of the
+# query shares at least len(query trigrams) - 4k of them (an edit touches at
+# most 3 trigrams, an adjacent transposition 4), so only names that pass that
+# count filter ever reach the Levenshtein check. Candidates are generated
+# from the rarest query trigrams only (prefix filtering): a name sharing t of
+# the query trigrams must contain one of any len - t + 1 of them.
+# ----------------------------------------------------------------------------#
+
+from collections import defaultdict
+
+
+def normalize(name):
+    return ' '.join((name or '').casefold().split())
+
+
+def trigrams(text):
+    padded = ' %s ' % text
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (Levenshtein plus adjacent
+    transpositions), or limit + 1 as soon as it must exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def window_distance(query, name, limit):
+    # best match of the query against the whole name or any run of the same
+    # number of words, so "muscial hop" finds "The Musical Hop"
+    best = edit_distance(query, name, limit)
+    words = name.split(' ')
+    size = query.count(' ') + 1
+    for start in range(0, len(words) - size + 1):
+        if best == 0:
+            break
+        best = min(best, edit_distance(query, ' '.join(words[start:start + size]), limit))
+    return best
+
+
+class TrigramIndex(object):
+    """Not thread safe on its own, PrefixIndex calls it under its lock."""
+
+    def __init__(self):
+        self.postings = defaultdict(set)  # trigram -> {(kind, id)}
+        self.names = {}  # (kind, id) -> normalized name
+
+    def add(self, kind, id, name):
+        self.remove(kind, id)
+        name = normalize(name)
+        self.names[(kind, id)] = name
+        for gram in trigrams(name):
+            self.postings[gram].add((kind, id))
+
+    def remove(self, kind, id):
+        name = self.names.pop((kind, id), None)
+        if name is None:
+            return
+        for gram in trigrams(name):
+            self.postings[gram].discard((kind, id))
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def search(self, query, kind=None, max_distance=2, limit=20):
+        """[(distance, (kind, id))] closest first, at most max_distance edits."""
+        query = normalize(query)
+        grams = sorted(trigrams(query), key=lambda gram: len(self.postings.get(gram, ())))
+        # allow about one typo per four characters, but keep the filter selective
+        distance = min(max_distance, max(1, len(query) // 4))
+        while distance and len(grams) - 4 * distance < 1:
+            distance -= 1
+        if not distance:
+            return []
+        required = len(grams) - 4 * distance
+
+        candidates = set()
+        for gram in grams[:len(grams) - required + 1]:
+            candidates.update(self.postings.get(gram, ()))
+
+        hits = []
+        for key in candidates:
+            if kind and key[0] != kind:
+                continue
+            shared = sum(1 for gram in grams if key in self.postings.get(gram, ()))
+            if shared < required:
+                continue
+            found = window_distance(query, self.names[key], distance)
+            if found <= distance:
+                hits.append((found, -shared, len(self.names[key]), key))
+        hits.sort()
+        return [(found, key) for found, _, _, key in hits[:limit]]
@@ -0,0 +1,174 @@
+# ----------------------------------------------------------------------------#
+# Nearby venues without PostGIS.
+#
+# Venues and artists get the latitude/longitude of their city from the
+# bundled city centroid table (data/city_centroids.csv, GEO_CITIES), venues
+# also a geohash. A "within N km" query picks the finest geohash cell that is
+# still larger than the bounding box of the circle: the box then touches at
+# most 4 such cells, each one an indexed range scan on the geohash column.
+# Rows in those cells are cut down to the box by latitude/longitude and the
+# survivors are measured exactly with the haversine formula.
+# ----------------------------------------------------------------------------#
+
+import csv
+import math
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+EARTH_RADIUS_KM = 6371.0088
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# ~5 m cells, far finer than a city centroid needs but free to store
+PRECISION = 9
+
+_centroids = {}  # path -> {(city, state): (latitude, longitude)}
+
+
+# ----------------------------------------------------------------------------#
+# City centroids.
+# ----------------------------------------------------------------------------#
+
+def city_key(city, state):
+    # "St. Louis", "saint louis" and "St Louis" are the same city
+    words = (city or '').casefold().replace('.', ' ').split()
+    words = ['st' if word == 'saint' else word for word in words]
+    return ' '.join(words), (state or '').strip().upper()
+
+
+def load_centroids(path):
+    if path not in _centroids:
+        with open(path, newline='') as f:
+            _centroids[path] = {
+                city_key(row['city'], row['state']): (float(row['latitude']), float(row['longitude']))
+                for row in csv.DictReader(f)}
+    return _centroids[path]
+
+
+def lookup(city, state):
+    """(latitude, longitude) of the city centroid, None for unknown cities."""
+    return load_centroids(current_app.config['GEO_CITIES']).get(city_key(city, state))
+
+
+def locate(row):
+    """Set the coordinates (and geohash) of a Venue or Artist from its city,
+    returns whether the city is known."""
+    position = lookup(row.city, row.state)
+    row.latitude, row.longitude = position or (None, None)
+    if hasattr(row, 'geohash'):
+        row.geohash = encode(*position) if position else None
+    return position is not None
+
+
+# ----------------------------------------------------------------------------#
+# Geohash and distances.
+# ----------------------------------------------------------------------------#
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) of a geohash cell in degrees."""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def prefix_range(prefix):
+    # every hash starting with `prefix` sorts in [prefix, upper), upper is None
+    # when there is nothing after the prefix ('zzz')
+    while prefix and prefix[-1] == BASE32[-1]:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in km."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, km):
+    """(south, north, west, east) around the circle, west > east when it
+    crosses the antimeridian, None for west/east when it covers a pole."""
+    angle = km / EARTH_RADIUS_KM
+    south = latitude - math.degrees(angle)
+    north = latitude + math.degrees(angle)
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), min(north, 90.0), None, None
+    delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+    west, east = longitude - delta, longitude + delta
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, north, west, east
+
+
+def covering_cells(box):
+    """Geohash prefixes whose cells cover the box, None when the box is too
+    large for a prefix to narrow anything down."""
+    south, north, west, east = box
+    if west is None:
+        return None
+    height = north - south
+    width = east - west if west <= east else east - west + 360
+    for precision in range(PRECISION, 0, -1):
+        cell_height, cell_width = cell_size(precision)
+        if cell_height >= height and cell_width >= width:
+            # a box smaller than a cell overlaps at most 2 x 2 cells, its
+            # corners fall into each of them
+            return {encode(lat, lon, precision) for lat in (south, north) for lon in (west, east)}
+    return None
+
+
+# ----------------------------------------------------------------------------#
+# Queries.
+# ----------------------------------------------------------------------------#
+
+def nearby(model, latitude, longitude, km, limit=None):
+    """[(distance in km, row)] of `model` rows within `km`, closest first."""
+    box = bounding_box(latitude, longitude, km)
+    south, north, west, east = box
+    conditions = [model.latitude.between(south, north)]
+    if west is not None and west <= east:
+        conditions.append(model.longitude.between(west, east))
+    elif west is not None:
+        conditions.append(or_(model.longitude >= west, model.longitude <= east))
+    cells = covering_cells(box)
+    if cells is not None:
+        ranges = []
+        for prefix in sorted(cells):
+            upper = prefix_range(prefix)
+            ranges.append(and_(model.geohash >= prefix, model.geohash < upper)
+                          if upper else model.geohash >= prefix)
+        conditions.append(or_(*ranges))
+
+    hits = []
+    for row in model.query.filter(*conditions):
+        distance = haversine(latitude, longitude, row.latitude, row.longitude)
+        if distance <= km:
+            hits.append((distance, row))
+    hits.sort(key=lambda hit: (hit[0], hit[1].id))
+    return hits[:limit] if limit else hits
@@ -0,0 +1,29 @@
+# ----------------------------------------------------------------------------#
+# Preforking production server.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# ----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 1))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+
+# Import the app once in the master process, workers inherit it on fork.
+# With WARMUP_ON_BOOT the import also warms it up, before the port is bound.
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Pooled connections opened in the master before the fork would be shared
+    # between workers; drop them so every worker opens its own.
+    from models import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose()
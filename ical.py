@@ -0,0 +1,161 @@
+# ----------------------------------------------------------------------------#
+# iCalendar feeds of venue and artist schedules.
+#
+#   /venues/<id>/shows.ics    /artists/<id>/shows.ics
+#
+# A feed is one query: the venue (or artist) joined to its recent and upcoming
+# shows through the (venue_id, date) / (artist_id, date) indexes and to the
+# other side of each show. It is streamed out with an ETag over the rows and
+# kept per worker, so a polling calendar client that sends If-None-Match gets
+# a 304 without touching the database. create_show_submission and the
+# venue/artist edits drop the feeds they change in the worker that handles
+# them, other workers serve theirs for at most ICAL_CACHE_TIMEOUT seconds.
+# ----------------------------------------------------------------------------#
+
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import Response, abort, current_app, request
+from sqlalchemy import and_
+
+from fragment_cache import FragmentCache
+from models import db, Venue, Artist, Show
+
+PRODID = '-//Fyyur//Show schedule//EN'
+# shows only have a start time
+SHOW_DURATION = timedelta(hours=2)
+
+FEEDS = {
+    # kind: (owner, foreign key on Show, other side, its foreign key)
+    'venue': (Venue, Show.venue_id, Artist, Show.artist_id),
+    'artist': (Artist, Show.artist_id, Venue, Show.venue_id),
+}
+
+
+# ----------------------------------------------------------------------------#
+# Formatting.
+# ----------------------------------------------------------------------------#
+
+def escape_text(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    # content lines are at most 75 octets, continuations start with a space
+    data = line.encode('utf-8')
+    lines = []
+    while len(data) > 75:
+        cut = 75 if not lines else 74
+        # do not split a multi-byte character
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        lines.append(data[:cut])
+        data = data[cut:]
+    lines.append(data)
+    return b'\r\n '.join(lines) + b'\r\n'
+
+
+def format_date(value):
+    # shows are stored in the venue's local time, written as floating times
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def calendar_lines(rows, site_url):
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold('PRODID:' + PRODID)
+    yield fold('CALSCALE:GREGORIAN')
+    yield fold('X-WR-CALNAME:' + escape_text(rows[0].calendar))
+    for row in rows:
+        if row.show_id is None:
+            continue
+        location = ', '.join(part for part in (row.venue_name, row.address, row.city, row.state) if part)
+        yield b''.join([
+            fold('BEGIN:VEVENT'),
+            fold('UID:show-%d@fyyur' % row.show_id),
+            fold('DTSTAMP:' + stamp),
+            fold('DTSTART:' + format_date(row.date)),
+            fold('DTEND:' + format_date(row.date + SHOW_DURATION)),
+            fold('SUMMARY:' + escape_text('%s at %s' % (row.artist_name, row.venue_name))),
+            fold('LOCATION:' + escape_text(location)),
+            fold('URL:%svenues/%d' % (site_url, row.venue_id)),
+            fold('END:VEVENT'),
+        ])
+    yield fold('END:VCALENDAR')
+
+
+# ----------------------------------------------------------------------------#
+# Feeds.
+# ----------------------------------------------------------------------------#
+
+def feed_rows(kind, id):
+    """The owner's name and its shows from ICAL_PAST_DAYS ago on, one row per
+    show (a single row with show_id None when there are none), [] when the
+    venue or artist does not exist."""
+    owner, owner_key, other, other_key = FEEDS[kind]
+    since = datetime.now() - timedelta(days=current_app.config['ICAL_PAST_DAYS'])
+    return db.session.query(
+        owner.name.label('calendar'), Show.id.label('show_id'), Show.date,
+        Venue.id.label('venue_id'), Venue.name.label('venue_name'), Venue.address, Venue.city,
+        Venue.state, Artist.name.label('artist_name')) \
+        .select_from(owner) \
+        .outerjoin(Show, and_(owner_key == owner.id, Show.date >= since)) \
+        .outerjoin(other, other_key == other.id) \
+        .filter(owner.id == id) \
+        .order_by(Show.date, Show.id) \
+        .all()
+
+
+def stream(lines, store, key, etag, timeout):
+    chunks = []
+    for chunk in lines:
+        chunks.append(chunk)
+        yield chunk
+    # only complete bodies are kept
+    store.set(key, (etag, b''.join(chunks)), timeout)
+
+
+def calendar_response(body):
+    response = Response(body, mimetype='text/calendar')
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['ICAL_MAX_AGE']
+    return response
+
+
+def feed_response(kind, id):
+    store = current_app.extensions['ical']
+    key = (kind, id)
+    cached = store.get(key)
+    if cached is not None:
+        etag, body = cached
+        response = calendar_response(body)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    rows = feed_rows(kind, id)
+    if not rows:
+        abort(404)
+    etag = hashlib.md5(repr([tuple(row) for row in rows]).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = calendar_response(b'')
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    response = calendar_response(stream(
+        calendar_lines(rows, request.host_url), store, key, etag,
+        current_app.config['ICAL_CACHE_TIMEOUT']))
+    response.set_etag(etag)
+    return response
+
+
+def invalidate(kind, id):
+    current_app.extensions['ical'].delete((kind, int(id)))
+
+
+def init_ical(app):
+    app.config.setdefault('ICAL_CACHE_SIZE', 1024)
+    app.config.setdefault('ICAL_CACHE_TIMEOUT', 300)
+    app.config.setdefault('ICAL_MAX_AGE', 300)
+    app.config.setdefault('ICAL_PAST_DAYS', 90)
+    app.extensions['ical'] = FragmentCache(app.config['ICAL_CACHE_SIZE'])
@@ -0,0 +1,177 @@
+# ----------------------------------------------------------------------------#
+# Uploaded artist and venue images.
+#
+# An upload is stored once under the hash of its content,
+# IMAGE_UPLOAD_DIR/<sha256 prefix>.<ext>, and its URL (/media/<name>) becomes
+# the image_link. Resized copies <hash>-<width>.jpg (.png for formats that
+# can be transparent) for every IMAGE_WIDTHS are written by a per worker
+# thread pool after the request has been answered; until a copy exists its URL
+# serves the original with a short max-age. Everything under /media/ is
+# otherwise immutable and cached for a year.
+#
+# Templates add srcset="{{ srcset(image_link) }}" next to the src, which
+# lists the resized copies of uploaded images and is empty for external links.
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, current_app, send_from_directory
+
+MEDIA_URL = '/media/'
+MAX_AGE = 365 * 24 * 3600
+# original served in place of a copy that is not written yet
+PENDING_MAX_AGE = 60
+# leading bytes of the accepted formats
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+ORIGINAL = re.compile(r'^([0-9a-f]{20})\.(jpg|png|gif|webp)$')
+RESIZED = re.compile(r'^([0-9a-f]{20})-(\d+)\.(jpg|png)$')
+
+
+def image_type(data):
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def write_atomically(path, data):
+    # readers never see a partly written file
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+# ----------------------------------------------------------------------------#
+# Resizing, run on the thread pool.
+# ----------------------------------------------------------------------------#
+
+def resized_extension(original_extension):
+    # gif, png and webp originals may be transparent
+    return 'jpg' if original_extension == 'jpg' else 'png'
+
+
+def resize(directory, original, widths):
+    """Write every missing resized copy of `original`, returns their names."""
+    from PIL import Image, ImageOps
+
+    digest, extension = original.split('.')
+    extension = resized_extension(extension)
+    with Image.open(os.path.join(directory, original)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB' if extension == 'jpg' else 'RGBA')
+        written = []
+        for width in widths:
+            name = '%s-%d.%s' % (digest, width, extension)
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                continue
+            copy = image.copy()
+            # never upscale, narrower originals are just re-encoded
+            copy.thumbnail((width, width * 4), Image.LANCZOS)
+            buffer = io.BytesIO()
+            if extension == 'png':
+                copy.save(buffer, 'PNG', optimize=True)
+            else:
+                copy.save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+            write_atomically(path, buffer.getvalue())
+            written.append(name)
+    return written
+
+
+def resize_logged(logger, directory, original, widths):
+    try:
+        return resize(directory, original, widths)
+    except Exception:
+        logger.exception('resizing %s failed', original)
+
+
+# ----------------------------------------------------------------------------#
+# Upload and serving.
+# ----------------------------------------------------------------------------#
+
+class Images(object):
+
+    def __init__(self, app=None):
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_UPLOAD_DIR', os.path.join(app.root_path, 'media'))
+        app.config.setdefault('IMAGE_WIDTHS', [160, 320, 640, 1280])
+        app.config.setdefault('IMAGE_WORKERS', 2)
+        app.extensions['images'] = self
+        app.add_url_rule(MEDIA_URL + '<filename>', 'media', self.send)
+
+    def pool(self):
+        # created on first use, after gunicorn forked the worker
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(current_app.config['IMAGE_WORKERS'],
+                                               thread_name_prefix='images')
+        return self.executor
+
+    def save(self, upload):
+        """Store an uploaded werkzeug FileStorage, queue its resizing and
+        return its URL. ValueError when it is not a JPEG, PNG, GIF or WebP."""
+        data = upload.read()
+        extension = image_type(data)
+        if extension is None:
+            raise ValueError('%s is not a JPEG, PNG, GIF or WebP image' % upload.filename)
+        directory = current_app.config['IMAGE_UPLOAD_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = '%s.%s' % (hashlib.sha256(data).hexdigest()[:20], extension)
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            write_atomically(path, data)
+        self.pool().submit(resize_logged, current_app.logger, directory, name,
+                           list(current_app.config['IMAGE_WIDTHS']))
+        return MEDIA_URL + name
+
+    def send(self, filename):
+        directory = current_app.config['IMAGE_UPLOAD_DIR']
+        max_age = MAX_AGE
+        if not os.path.exists(os.path.join(directory, filename)):
+            match = RESIZED.match(filename)
+            if not match:
+                abort(404)
+            originals = [name for name in ('%s.%s' % (match.group(1), extension)
+                                           for extension in ('jpg', 'png', 'gif', 'webp'))
+                         if os.path.exists(os.path.join(directory, name))]
+            if not originals:
+                abort(404)
+            filename, max_age = originals[0], PENDING_MAX_AGE
+        response = send_from_directory(directory, filename, max_age=max_age)
+        response.cache_control.public = True
+        if max_age == MAX_AGE:
+            response.cache_control.immutable = True
+        return response
+
+
+def srcset(url, widths):
+    """srcset value listing the resized copies of an uploaded image, '' for
+    anything else."""
+    if not url or not url.startswith(MEDIA_URL):
+        return ''
+    match = ORIGINAL.match(url[len(MEDIA_URL):])
+    if not match:
+        return ''
+    extension = resized_extension(match.group(2))
+    return ', '.join('%s%s-%d.%s %dw' % (MEDIA_URL, match.group(1), width, extension, width)
+                     for width in widths)
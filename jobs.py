@@ -0,0 +1,264 @@
+# ----------------------------------------------------------------------------#
+# Background jobs.
+#
+# Work that does not have to be done before the response is queued in the
+# Job table by the request handler, before it commits:
+#
+#   enqueue('similar.refresh', 'artist', key='similar.refresh:artist', delay=60)
+#
+# The row is written in the handler's transaction, so a job exists exactly
+# when the change it follows up on does, and workers only see it once that
+# commits. Workers are `flask jobs work` processes (any number, on any host)
+# and, with JOB_WORKERS > 0, threads inside every web worker. On Postgres they
+# claim jobs with FOR UPDATE SKIP LOCKED and never wait on each other.
+#
+# A job that raises is retried after JOB_RETRY_DELAY * 2^(attempt - 1)
+# seconds (jittered, at most JOB_RETRY_MAX_DELAY) until it used up its
+# attempts, then it is left 'failed' for `flask jobs retry`. A job still
+# 'running' after JOB_TIMEOUT seconds lost its worker and is retried too, so
+# jobs run at least once: tasks must be safe to run again. An enqueue with
+# the key of a job that is still queued is dropped, changes made before a
+# delayed job starts therefore fold into one run.
+# ----------------------------------------------------------------------------#
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, text
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+tasks = {}  # name -> (function, max_attempts)
+# set when this process committed a job, wakes its idle workers
+wake = threading.Event()
+
+INSERT = '''
+    INSERT INTO "Job" (task, arguments, "key", status, run_at, attempts, max_attempts, created_at)
+    VALUES (:task, :arguments, :key, 'queued', :run_at, 0, :max_attempts, :now)
+    ON CONFLICT ("key") WHERE status = 'queued' DO NOTHING
+'''
+READY = "status IN ('queued', 'retrying') AND run_at <= :now"
+# rows skipped are being claimed by another worker right now
+CLAIM_POSTGRES = '''
+    UPDATE "Job" SET status = 'running', attempts = attempts + 1, locked_by = :worker, locked_at = :now
+    WHERE id = (SELECT id FROM "Job" WHERE %s ORDER BY run_at LIMIT 1 FOR UPDATE SKIP LOCKED)
+    RETURNING id, task, arguments, attempts, max_attempts
+''' % READY
+REQUEUE_LOST = '''
+    UPDATE "Job" SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'retrying' END,
+        run_at = :now, last_error = 'lost its worker ' || locked_by
+    WHERE status = 'running' AND locked_at < :lost
+'''
+
+
+def task(name, max_attempts=5):
+    """Register the decorated function as the task `name`."""
+    def decorator(f):
+        tasks[name] = (f, max_attempts)
+        return f
+
+    return decorator
+
+
+def enqueue(name, *args, key=None, delay=0, **kwargs):
+    """Queue `name`(*args, **kwargs) in the current transaction, to run
+    `delay` seconds after it commits at the earliest."""
+    if name not in tasks:
+        raise LookupError('unknown task %s' % name)
+    now = datetime.utcnow()
+    db.session.execute(text(INSERT), {
+        'task': name, 'arguments': json.dumps({'args': args, 'kwargs': kwargs}), 'key': key,
+        'run_at': now + timedelta(seconds=delay), 'max_attempts': tasks[name][1], 'now': now})
+    db.session.info['jobs_enqueued'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def committed(session):
+    if session.info.pop('jobs_enqueued', False):
+        wake.set()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def rolled_back(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+# ----------------------------------------------------------------------------#
+# Running jobs.
+# ----------------------------------------------------------------------------#
+
+def claim(worker):
+    """(id, task, arguments, attempts, max_attempts) of the next ready job,
+    now locked by `worker`, or None."""
+    params = {'worker': worker, 'now': datetime.utcnow()}
+    if db.engine.dialect.name == 'postgresql':
+        job = db.session.execute(text(CLAIM_POSTGRES), params).first()
+    else:
+        # without SKIP LOCKED: take the first candidate nobody else claimed
+        # in between, writers are serialized by SQLite anyway
+        job = None
+        candidates = db.session.execute(
+            text('SELECT id FROM "Job" WHERE %s ORDER BY run_at LIMIT 10' % READY), params).fetchall()
+        for id, in candidates:
+            claimed = db.session.execute(text(
+                'UPDATE "Job" SET status = \'running\', attempts = attempts + 1, locked_by = :worker, '
+                'locked_at = :now WHERE id = :id AND status IN (\'queued\', \'retrying\')'),
+                dict(params, id=id))
+            if claimed.rowcount:
+                job = db.session.execute(text(
+                    'SELECT id, task, arguments, attempts, max_attempts FROM "Job" WHERE id = :id'),
+                    {'id': id}).first()
+                break
+    db.session.commit()
+    return job
+
+
+def backoff(attempts):
+    config = current_app.config
+    delay = min(config['JOB_RETRY_MAX_DELAY'], config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1))
+    # jobs that failed together do not all come back at the same moment
+    return delay * random.uniform(0.5, 1.0)
+
+
+def finish(job_id, worker, **values):
+    assignments = ', '.join('%s = :%s' % (name, name) for name in values)
+    finished = db.session.execute(text(
+        'UPDATE "Job" SET %s WHERE id = :id AND status = \'running\' AND locked_by = :worker'
+        % assignments), dict(values, id=job_id, worker=worker))
+    db.session.commit()
+    if not finished.rowcount:
+        logger.warning('job %d was taken over after JOB_TIMEOUT while %s ran it', job_id, worker)
+
+
+def run(job, worker):
+    """Run a claimed job and record how it went, returns whether it succeeded."""
+    id, name, arguments, attempts, max_attempts = job
+    started = time.monotonic()
+    try:
+        if name not in tasks:
+            raise LookupError('unknown task %s' % name)
+        arguments = json.loads(arguments)
+        tasks[name][0](*arguments['args'], **arguments['kwargs'])
+        # whatever the task left uncommitted is committed with its status
+        finish(id, worker, status='done', finished_at=datetime.utcnow(), last_error=None)
+        logger.info('job %d %s done in %.2fs', id, name, time.monotonic() - started)
+        return True
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+        now = datetime.utcnow()
+        if attempts >= max_attempts:
+            finish(id, worker, status='failed', finished_at=now, last_error=error)
+            logger.error('job %d %s failed for good after %d attempts:\n%s', id, name, attempts, error)
+        else:
+            finish(id, worker, status='retrying', last_error=error,
+                   run_at=now + timedelta(seconds=backoff(attempts)))
+            logger.warning('job %d %s failed (attempt %d of %d):\n%s',
+                           id, name, attempts, max_attempts, error)
+        return False
+    finally:
+        db.session.remove()
+
+
+def requeue_lost():
+    now = datetime.utcnow()
+    lost = db.session.execute(text(REQUEUE_LOST), {
+        'now': now, 'lost': now - timedelta(seconds=current_app.config['JOB_TIMEOUT'])})
+    db.session.commit()
+    if lost.rowcount:
+        logger.warning('%d jobs lost their worker', lost.rowcount)
+
+
+class Worker(object):
+    """`threads` threads running jobs until stop(), or until none is ready
+    with `burst`."""
+
+    def __init__(self, app, threads=1, burst=False):
+        self.app = app
+        self.name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.count = threads
+        self.burst = burst
+        self.threads = []
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.done = self.failed = 0
+        self.checked_at = 0.0
+
+    def start(self):
+        for number in range(self.count):
+            thread = threading.Thread(target=self.loop, name='jobs-%d' % number, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        # running jobs are finished, safe to call from a signal handler
+        self.stopping.set()
+        wake.set()
+
+    def join(self):
+        for thread in self.threads:
+            while thread.is_alive():
+                thread.join(1)
+
+    def loop(self):
+        with self.app.app_context():
+            config = self.app.config
+            while not self.stopping.is_set():
+                job = None
+                try:
+                    with self.lock:
+                        check = time.monotonic() - self.checked_at > config['JOB_TIMEOUT'] / 10
+                        if check:
+                            self.checked_at = time.monotonic()
+                    if check:
+                        requeue_lost()
+                    job = claim(self.name)
+                except Exception:
+                    logger.exception('claiming a job failed')
+                    db.session.remove()
+                if job is not None:
+                    succeeded = run(job, self.name)
+                    with self.lock:
+                        if succeeded:
+                            self.done += 1
+                        else:
+                            self.failed += 1
+                elif self.burst:
+                    return
+                else:
+                    wake.wait(config['JOB_POLL_INTERVAL'])
+                    wake.clear()
+
+
+# ----------------------------------------------------------------------------#
+# Setup.
+# ----------------------------------------------------------------------------#
+
+def start_threads():
+    # threads do not survive gunicorn's fork, start them in the worker
+    state = current_app.extensions['jobs']
+    if state['pid'] != os.getpid():
+        state['pid'] = os.getpid()
+        state['worker'] = Worker(current_app._get_current_object(), current_app.config['JOB_WORKERS'])
+        state['worker'].start()
+
+
+def init_jobs(app):
+    app.config.setdefault('JOB_WORKERS', 0)
+    app.config.setdefault('JOB_POLL_INTERVAL', 2.0)
+    app.config.setdefault('JOB_RETRY_DELAY', 10)
+    app.config.setdefault('JOB_RETRY_MAX_DELAY', 3600)
+    app.config.setdefault('JOB_TIMEOUT', 900)
+    app.extensions['jobs'] = {'pid': None, 'worker': None}
+    if app.config['JOB_WORKERS']:
+        app.before_request(start_threads)
@@ -0,0 +1,307 @@
+# ----------------------------------------------------------------------------#
+# Live show updates on the venue and artist pages, as server-sent events.
+#
+#   GET /venues/<id>/live?since=<show id>    GET /artists/<id>/live?since=...
+#
+# An open page keeps one EventSource on its stream and gets a `show` event for
+# every show booked at the venue / for the artist, with the page's new
+# upcoming and past show counts, instead of being reloaded.
+# create_show_submission builds the events in its transaction and after the
+# commit publishes them to the broadcaster of its process, which hands them
+# to every stream of that venue and artist open there. Nothing is queried
+# per open stream.
+#
+# Pages only open a stream when LIVE_URL is set, to the base URL of the async
+# app (async_app.py) serving them, where a stream is one idle coroutine. The
+# WSGI app serves them only on threaded or greenlet servers, such as the
+# development server; a gunicorn sync worker would be held by one until it is
+# killed, so it answers 404. Where the bookings are taken by other processes
+# than those serving the streams (gunicorn workers, hypercorn), LIVE_PUBSUB
+# fans the events out over Unix datagram sockets in LIVE_SOCKET_DIR: every
+# process with open streams binds one there and publishers send to all of
+# them. One node only.
+#
+# Events carry the show id as their SSE id. Pages open their stream with the
+# last show they rendered as `since` and reconnecting browsers send their
+# Last-Event-ID, both first get the shows booked after it. A comment every
+# LIVE_HEARTBEAT seconds keeps proxies from closing idle streams; a stream
+# whose client falls LIVE_QUEUE_SIZE events behind is closed, the browser
+# reconnects and catches up.
+# ----------------------------------------------------------------------------#
+
+import atexit
+import glob
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from flask import Response, current_app, request
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+
+from models import db, Show
+
+COLUMNS = {'venue': Show.venue_id, 'artist': Show.artist_id}
+# missed shows sent to a (re)connecting stream at most
+CATCH_UP = 50
+DATAGRAM_SIZE = 65536
+HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+class Broadcaster(object):
+    """Streams open in this process, by (kind, id)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = defaultdict(set)
+
+    def subscribe(self, channel, deliver):
+        with self.lock:
+            self.channels[channel].add(deliver)
+
+    def unsubscribe(self, channel, deliver):
+        with self.lock:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(deliver)
+                if not subscribers:
+                    del self.channels[channel]
+
+    def count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.channels.values())
+
+    def deliver(self, channel, event):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for deliver in subscribers:
+            deliver(event)
+
+
+# ----------------------------------------------------------------------------#
+# Fan-out between processes.
+# ----------------------------------------------------------------------------#
+
+class Relay(object):
+    """Events between the processes of one node, through one Unix datagram
+    socket per process with open streams in `directory`."""
+
+    def __init__(self, directory, broadcaster, logger):
+        self.directory = directory
+        self.broadcaster = broadcaster
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.pid = None
+        self.path = None
+
+    def listen(self):
+        # bound in the process serving the streams, gunicorn forks after import
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, '%d.sock' % os.getpid())
+            if os.path.exists(path):
+                # left by an earlier process with the same pid
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self.pid, self.path = os.getpid(), path
+            atexit.register(self.close, path)
+            threading.Thread(target=self.receive, args=(sock,), name='live-relay', daemon=True).start()
+
+    def close(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def receive(self, sock):
+        while True:
+            try:
+                kind, id, event = json.loads(sock.recv(DATAGRAM_SIZE))
+            except ValueError:
+                continue
+            self.broadcaster.deliver((kind, id), event)
+
+    def send(self, channel, event):
+        data = json.dumps([channel[0], channel[1], event]).encode()
+        own = self.path if self.pid == os.getpid() else None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # a process not reading fast enough misses the event, the booking never waits
+        sock.setblocking(False)
+        try:
+            for path in glob.glob(os.path.join(self.directory, '*.sock')):
+                if path == own:
+                    continue
+                try:
+                    sock.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # its process is gone
+                    self.close(path)
+                except BlockingIOError:
+                    self.logger.warning('live event for %s dropped, %s is not reading', channel, path)
+        finally:
+            sock.close()
+
+
+# ----------------------------------------------------------------------------#
+# Events.
+# ----------------------------------------------------------------------------#
+
+def event(show, counts, now):
+    """The `show` event of one booking, for the page `counts` are of.
+    `show` has an id, a date, and a venue and an artist (id, name,
+    image_link)."""
+    data = {'id': show.id, 'date': str(show.date), 'upcoming': show.date >= now}
+    for side in ('venue', 'artist'):
+        other = getattr(show, side)
+        data[side] = {'id': other.id, 'name': other.name, 'image_link': other.image_link}
+    data.update(counts)
+    return {'id': show.id, 'event': 'show', 'data': data}
+
+
+def format_event(event):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], event['event'], json.dumps(event['data']))
+
+
+def counts(kind, entity_id, now):
+    shows = Show.query.filter(COLUMNS[kind] == entity_id)
+    return {'upcoming_shows_count': shows.filter(Show.date >= now).count(),
+            'past_shows_count': shows.filter(Show.date <= now).count()}
+
+
+def show_events(show):
+    """{channel: event} of a new show for the pages of its venue and artist,
+    built in the booking's transaction so no other one is begun for them."""
+    db.session.flush()  # the show gets its id and is counted
+    now = datetime.now()
+    events = {}
+    for kind in ('venue', 'artist'):
+        channel = (kind, int(getattr(show, kind + '_id')))
+        events[channel] = event(show, counts(kind, channel[1], now), now)
+    return events
+
+
+def publish(events):
+    """Send show_events() to the open pages, once they are committed."""
+    state = current_app.extensions['live']
+    try:
+        for channel, update in events.items():
+            state['broadcaster'].deliver(channel, update)
+            if state['relay'] is not None:
+                state['relay'].send(channel, update)
+    except Exception:
+        # the booking is saved, open pages just miss it until they reload
+        current_app.logger.exception('publishing %s failed', list(events))
+
+
+def last_event_id(request):
+    """Show id the client has seen up to, Last-Event-ID of a reconnecting
+    browser first. Takes the Flask or the Quart request."""
+    return request.headers.get('Last-Event-ID', type=int) or request.args.get('since', 0, type=int)
+
+
+def broadcaster(app):
+    """The broadcaster of this process, None when it serves LIVE_MAX_STREAMS
+    streams already."""
+    state = app.extensions['live']
+    if state['broadcaster'].count() >= app.config['LIVE_MAX_STREAMS']:
+        return None
+    if state['relay'] is not None:
+        state['relay'].listen()
+    return state['broadcaster']
+
+
+# ----------------------------------------------------------------------------#
+# Streams on the WSGI app.
+# ----------------------------------------------------------------------------#
+
+def can_stream(environ):
+    """Whether the WSGI server can hold a stream open without a whole worker:
+    it runs requests in threads or on patched greenlets."""
+    if environ.get('wsgi.multithread'):
+        return True
+    gevent = sys.modules.get('gevent.monkey')
+    if gevent is not None and gevent.is_module_patched('socket'):
+        return True
+    eventlet = sys.modules.get('eventlet.patcher')
+    return eventlet is not None and eventlet.is_monkey_patched('socket')
+
+
+def missed(kind, entity_id, since):
+    shows = Show.query.filter(COLUMNS[kind] == entity_id, Show.id > since) \
+        .order_by(Show.id).limit(CATCH_UP).all()
+    if not shows:
+        return []
+    now = datetime.now()
+    page_counts = counts(kind, entity_id, now)
+    return [event(show, page_counts, now) for show in shows]
+
+
+def stream(kind, entity_id):
+    config = current_app.config
+    if not can_stream(request.environ):
+        raise NotFound('Live updates are served by the async app, see LIVE_URL.')
+    streams = broadcaster(current_app)
+    if streams is None:
+        raise ServiceUnavailable(retry_after=config['LIVE_RETRY_MS'] // 1000)
+    channel = (kind, entity_id)
+    size, heartbeat = config['LIVE_QUEUE_SIZE'], config['LIVE_HEARTBEAT']
+    events = queue.Queue()
+
+    def deliver(update):
+        if events.qsize() < size:
+            events.put(update)
+        else:
+            streams.unsubscribe(channel, deliver)
+            events.put(None)
+
+    # subscribed first: a show booked meanwhile is sent twice rather than never
+    streams.subscribe(channel, deliver)
+    try:
+        backlog = missed(kind, entity_id, last_event_id(request))
+    except Exception:
+        streams.unsubscribe(channel, deliver)
+        raise
+    # no transaction held open for the life of the stream
+    db.session.close()
+
+    def generate():
+        try:
+            yield 'retry: %d\n\n' % config['LIVE_RETRY_MS']
+            for update in backlog:
+                yield format_event(update)
+            while True:
+                try:
+                    update = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if update is None:
+                    return
+                yield format_event(update)
+        finally:
+            streams.unsubscribe(channel, deliver)
+
+    return Response(generate(), mimetype='text/event-stream', headers=HEADERS)
+
+
+def init_live(app):
+    app.config.setdefault('LIVE_URL', '')
+    app.config.setdefault('LIVE_ALLOW_ORIGIN', '*')
+    app.config.setdefault('LIVE_PUBSUB', False)
+    app.config.setdefault('LIVE_SOCKET_DIR', '/tmp/fyyur-live')
+    app.config.setdefault('LIVE_HEARTBEAT', 15)
+    app.config.setdefault('LIVE_RETRY_MS', 5000)
+    app.config.setdefault('LIVE_QUEUE_SIZE', 100)
+    app.config.setdefault('LIVE_MAX_STREAMS', 1000)
+    broadcaster = Broadcaster()
+    relay = None
+    if app.config['LIVE_PUBSUB']:
+        relay = Relay(app.config['LIVE_SOCKET_DIR'], broadcaster, app.logger)
+    app.extensions['live'] = {'broadcaster': broadcaster, 'relay': relay}
@@ -27,6 +27,18 @@ config.set_main_option(
     str(current_app.extensions['migrate'].db.engine.url).replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+# full-text search columns and tables are maintained by triggers in migration
+# b7e2d94c0a61 and are not part of the models, keep autogenerate off them
+SEARCH_OBJECTS = ('search_vector', 'search_index')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if reflected and name in ('alembic_backfill', 'sqlite_sequence'):
+        # progress of online_migrations.backfill(), SQLite's AUTOINCREMENT counters
+        return False
+    return not (reflected and (name in SEARCH_OBJECTS or name.startswith('search_index_')))
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -79,15 +91,30 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        # SQLite can't ALTER most things in place, autogenerate batch
+        # operations there, which copy the table
+        configure_args = dict(current_app.extensions['migrate'].configure_args)
+        configure_args.setdefault('render_as_batch', connection.dialect.name == 'sqlite')
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
-            **current_app.extensions['migrate'].configure_args
+            include_object=include_object,
+            **configure_args
         )
 
-        with context.begin_transaction():
-            context.run_migrations()
+        # a batch operation drops the table and renames its copy, which the
+        # foreign keys pointing at it would refuse; the pragma is a no-op
+        # inside a transaction, so switch it around the whole run
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            connection.execute('PRAGMA foreign_keys = OFF')
+        try:
+            with context.begin_transaction():
+                context.run_migrations()
+        finally:
+            if sqlite:
+                connection.execute('PRAGMA foreign_keys = ON')
 
 
 if context.is_offline_mode():
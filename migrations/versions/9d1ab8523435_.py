@@ -15,6 +15,10 @@ down_revision = '13cc84d694d0'
 branch_labels = None
 depends_on = None
 
+# SQLite reflects the foreign keys without their names, name them the way
+# Postgres did so that batch mode can drop them
+FOREIGN_KEY_NAMES = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
 
 def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
@@ -23,18 +27,22 @@ def upgrade():
     sa.Column('date', sa.DateTime(), nullable=True),
     sa.PrimaryKeyConstraint('id')
     )
-    op.add_column('Artist', sa.Column('show_id', sa.Integer(), nullable=True))
-    op.create_foreign_key(None, 'Artist', 'Show', ['show_id'], ['id'])
-    op.add_column('Venue', sa.Column('show_id', sa.Integer(), nullable=True))
-    op.create_foreign_key(None, 'Venue', 'Show', ['show_id'], ['id'])
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.add_column(sa.Column('show_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('Artist_show_id_fkey', 'Show', ['show_id'], ['id'])
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.add_column(sa.Column('show_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('Venue_show_id_fkey', 'Show', ['show_id'], ['id'])
     # ### end Alembic commands ###
 
 
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_constraint(None, 'Venue', type_='foreignkey')
-    op.drop_column('Venue', 'show_id')
-    op.drop_constraint(None, 'Artist', type_='foreignkey')
-    op.drop_column('Artist', 'show_id')
+    with op.batch_alter_table('Venue', naming_convention=FOREIGN_KEY_NAMES) as batch_op:
+        batch_op.drop_constraint('Venue_show_id_fkey', type_='foreignkey')
+        batch_op.drop_column('show_id')
+    with op.batch_alter_table('Artist', naming_convention=FOREIGN_KEY_NAMES) as batch_op:
+        batch_op.drop_constraint('Artist_show_id_fkey', type_='foreignkey')
+        batch_op.drop_column('show_id')
     op.drop_table('Show')
     # ### end Alembic commands ###
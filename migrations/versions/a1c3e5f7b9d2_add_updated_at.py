@@ -0,0 +1,33 @@
+"""add updated_at to Venue and Artist
+
+Revision ID: a1c3e5f7b9d2
+Revises: 3f605313d459
+Create Date: 2026-10-19 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c3e5f7b9d2'
+down_revision = '3f605313d459'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows get the migration time so their cache keys are stable
+    op.add_column('Artist', sa.Column('updated_at', sa.DateTime(), nullable=True,
+                                      server_default=sa.func.now()))
+    op.add_column('Venue', sa.Column('updated_at', sa.DateTime(), nullable=True,
+                                     server_default=sa.func.now()))
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.alter_column('updated_at', server_default=None)
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.alter_column('updated_at', server_default=None)
+
+
+def downgrade():
+    op.drop_column('Venue', 'updated_at')
+    op.drop_column('Artist', 'updated_at')
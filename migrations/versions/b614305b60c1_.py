@@ -18,11 +18,12 @@ depends_on = None
 
 def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.add_column('Venue', sa.Column('genres', sa.ARRAY(sa.String(length=30)), nullable=True))
+    op.add_column('Venue', sa.Column('genres', sa.ARRAY(sa.String(length=30)).with_variant(sa.String(), 'sqlite'), nullable=True))
     # ### end Alembic commands ###
 
 
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_column('Venue', 'genres')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('genres')
     # ### end Alembic commands ###
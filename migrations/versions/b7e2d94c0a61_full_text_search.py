@@ -0,0 +1,120 @@
+"""full-text search index for Venue and Artist
+
+Revision ID: b7e2d94c0a61
+Revises: a1c3e5f7b9d2
+Create Date: 2026-10-19 10:02:17.540913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import backfill, create_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d94c0a61'
+down_revision = 'a1c3e5f7b9d2'
+branch_labels = None
+depends_on = None
+
+# genres are stored as '{Jazz,Rock}', strip the braces and quotes
+POSTGRES_VECTOR = '''
+    setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+    setweight(to_tsvector('english', translate(coalesce(NEW.genres, ''), '{{}},"', '    ')), 'B') ||
+    setweight(to_tsvector('english', coalesce(NEW.seeking_description, '')), 'C') ||
+    setweight(to_tsvector('english', concat_ws(' ', NEW.city, NEW.state{address})), 'D')
+'''
+
+# the backfill commits and leaves alembic_version behind, a resumed upgrade
+# runs all of this again
+POSTGRES_TRIGGER = '''
+ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION "{table}_search_vector_update"() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {vector};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS "{table}_search_vector" ON "{table}";
+CREATE TRIGGER "{table}_search_vector"
+    BEFORE INSERT OR UPDATE ON "{table}"
+    FOR EACH ROW EXECUTE PROCEDURE "{table}_search_vector_update"();
+'''
+
+# rowid = id * 2 + 0 for venues, 1 for artists
+SQLITE_TRIGGERS = '''
+CREATE TRIGGER "{table}_search_insert" AFTER INSERT ON "{table}" BEGIN
+    INSERT INTO search_index (rowid, kind, entity_id, name, genres, city, state, address,
+                              seeking_description, seeking)
+    VALUES (NEW.id * 2 + {offset}, '{kind}', NEW.id, NEW.name, NEW.genres, NEW.city, NEW.state,
+            {address}, NEW.seeking_description, NEW.{seeking});
+END;
+CREATE TRIGGER "{table}_search_update" AFTER UPDATE ON "{table}" BEGIN
+    DELETE FROM search_index WHERE rowid = OLD.id * 2 + {offset};
+    INSERT INTO search_index (rowid, kind, entity_id, name, genres, city, state, address,
+                              seeking_description, seeking)
+    VALUES (NEW.id * 2 + {offset}, '{kind}', NEW.id, NEW.name, NEW.genres, NEW.city, NEW.state,
+            {address}, NEW.seeking_description, NEW.{seeking});
+END;
+CREATE TRIGGER "{table}_search_delete" AFTER DELETE ON "{table}" BEGIN
+    DELETE FROM search_index WHERE rowid = OLD.id * 2 + {offset};
+END;
+'''
+
+TABLES = [
+    # table, kind, rowid offset, seeking column, has an address
+    ('Venue', 'venue', 0, 'seeking_talent', True),
+    ('Artist', 'artist', 1, 'seeking_venue', False),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        return upgrade_sqlite()
+    for table, kind, offset, seeking, has_address in TABLES:
+        vector = POSTGRES_VECTOR.format(address=', NEW.address' if has_address else '')
+        op.execute(POSTGRES_TRIGGER.format(table=table, vector=vector))
+        # fire the trigger once for the existing rows
+        backfill('search_vector_%s' % kind, table, 'name = name', where='search_vector IS NULL')
+        create_index_concurrently('ix_%s_search_vector' % table, table, ['search_vector'],
+                                  postgresql_using='gin')
+
+
+def upgrade_sqlite():
+    op.execute('''
+        CREATE VIRTUAL TABLE search_index USING fts5(
+            kind UNINDEXED, entity_id UNINDEXED, name, genres, city, state, address,
+            seeking_description, seeking UNINDEXED,
+            tokenize = 'porter unicode61'
+        )
+    ''')
+    for table, kind, offset, seeking, has_address in TABLES:
+        address = 'NEW.address' if has_address else 'NULL'
+        for statement in SQLITE_TRIGGERS.format(table=table, kind=kind, offset=offset,
+                                                seeking=seeking, address=address).split('END;'):
+            if statement.strip():
+                op.execute(statement + 'END;')
+        op.execute('''
+            INSERT INTO search_index (rowid, kind, entity_id, name, genres, city, state, address,
+                                      seeking_description, seeking)
+            SELECT id * 2 + {offset}, '{kind}', id, name, genres, city, state, {address},
+                   seeking_description, {seeking}
+            FROM "{table}"
+        '''.format(table=table, kind=kind, offset=offset, seeking=seeking,
+                   address=address.replace('NEW.', '')))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table, kind, offset, seeking, has_address in TABLES:
+            for suffix in ('insert', 'update', 'delete'):
+                op.execute('DROP TRIGGER IF EXISTS "%s_search_%s"' % (table, suffix))
+        op.execute('DROP TABLE search_index')
+        return
+    for table, kind, offset, seeking, has_address in TABLES:
+        op.drop_index('ix_%s_search_vector' % table, table)
+        op.execute('DROP TRIGGER "%s_search_vector" ON "%s"' % (table, table))
+        op.execute('DROP FUNCTION "%s_search_vector_update"()' % table)
+        op.drop_column(table, 'search_vector')
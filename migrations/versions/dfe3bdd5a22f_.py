@@ -15,28 +15,38 @@ down_revision = '9d1ab8523435'
 branch_labels = None
 depends_on = None
 
+# SQLite reflects the foreign keys without their names, name them the way
+# Postgres did so that batch mode can drop them
+FOREIGN_KEY_NAMES = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
 
 def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_constraint('Artist_show_id_fkey', 'Artist', type_='foreignkey')
-    op.drop_column('Artist', 'show_id')
-    op.add_column('Show', sa.Column('artist_id', sa.Integer(), nullable=True))
-    op.add_column('Show', sa.Column('venue_id', sa.Integer(), nullable=True))
-    op.create_foreign_key(None, 'Show', 'Venue', ['venue_id'], ['id'])
-    op.create_foreign_key(None, 'Show', 'Artist', ['artist_id'], ['id'])
-    op.drop_constraint('Venue_show_id_fkey', 'Venue', type_='foreignkey')
-    op.drop_column('Venue', 'show_id')
+    with op.batch_alter_table('Artist', naming_convention=FOREIGN_KEY_NAMES) as batch_op:
+        batch_op.drop_constraint('Artist_show_id_fkey', type_='foreignkey')
+        batch_op.drop_column('show_id')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.add_column(sa.Column('artist_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('venue_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('Show_venue_id_fkey', 'Venue', ['venue_id'], ['id'])
+        batch_op.create_foreign_key('Show_artist_id_fkey', 'Artist', ['artist_id'], ['id'])
+    with op.batch_alter_table('Venue', naming_convention=FOREIGN_KEY_NAMES) as batch_op:
+        batch_op.drop_constraint('Venue_show_id_fkey', type_='foreignkey')
+        batch_op.drop_column('show_id')
     # ### end Alembic commands ###
 
 
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.add_column('Venue', sa.Column('show_id', sa.INTEGER(), autoincrement=False, nullable=True))
-    op.create_foreign_key('Venue_show_id_fkey', 'Venue', 'Show', ['show_id'], ['id'])
-    op.drop_constraint(None, 'Show', type_='foreignkey')
-    op.drop_constraint(None, 'Show', type_='foreignkey')
-    op.drop_column('Show', 'venue_id')
-    op.drop_column('Show', 'artist_id')
-    op.add_column('Artist', sa.Column('show_id', sa.INTEGER(), autoincrement=False, nullable=True))
-    op.create_foreign_key('Artist_show_id_fkey', 'Artist', 'Show', ['show_id'], ['id'])
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.add_column(sa.Column('show_id', sa.INTEGER(), autoincrement=False, nullable=True))
+        batch_op.create_foreign_key('Venue_show_id_fkey', 'Show', ['show_id'], ['id'])
+    with op.batch_alter_table('Show', naming_convention=FOREIGN_KEY_NAMES) as batch_op:
+        batch_op.drop_constraint('Show_artist_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('Show_venue_id_fkey', type_='foreignkey')
+        batch_op.drop_column('venue_id')
+        batch_op.drop_column('artist_id')
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.add_column(sa.Column('show_id', sa.INTEGER(), autoincrement=False, nullable=True))
+        batch_op.create_foreign_key('Artist_show_id_fkey', 'Show', ['show_id'], ['id'])
     # ### end Alembic commands ###
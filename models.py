@@ -0,0 +1,218 @@
+import re
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.types import TypeDecorator
+
+# ----------------------------------------------------------------------------#
+# Models.
+# ----------------------------------------------------------------------------#
+
+# The extension is created unbound so that every app built by create_app()
+# (production, tests, CLI) gets its own engine through db.init_app(app).
+db = SQLAlchemy()
+
+# array elements Postgres puts in double quotes
+QUOTED_GENRE = re.compile(r'^$|^null$|[\s{},"\\]', re.IGNORECASE)
+
+
+def array_element(genre):
+    if QUOTED_GENRE.search(genre):
+        return '"%s"' % genre.replace('\\', '\\\\').replace('"', '\\"')
+    return genre
+
+
+class Genres(TypeDecorator):
+    """The form's list of genres, kept as text the way Postgres casts a
+    text[] ('{Jazz,"Hip Hop"}'), which the templates unpack."""
+    impl = db.String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # psycopg2 sends a list as an array and Postgres casts it itself
+        if isinstance(value, (list, tuple)) and dialect.name != 'postgresql':
+            return '{%s}' % ','.join(map(array_element, value))
+        return value
+
+    @property
+    def python_type(self):
+        # TypeDecorator doesn't pass it through; snapshot.py reads it
+        return self.impl.python_type
+
+
+class Venue(db.Model):
+    __tablename__ = 'Venue'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    address = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    genres = db.Column(Genres(200))
+    website = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean(), nullable=True, default=False)
+    seeking_description = db.Column(db.String(250))
+    # centroid of the city, see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
+    # part of the template fragment cache keys, see fragment_cache.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    shows = db.relationship('Show', backref='venue', lazy=True)
+
+
+class Artist(db.Model):
+    __tablename__ = 'Artist'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    genres = db.Column(Genres(200))
+    image_link = db.Column(db.String(500))
+    website = db.Column(db.String(120))
+    facebook_link = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean(), nullable=True, default=False)
+    seeking_description = db.Column(db.String(250))
+    # home city centroid, see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    shows = db.relationship('Show', backref='artist', lazy=True)
+
+
+class Show(db.Model):
+    __tablename__ = 'Show'
+    # a venue's or artist's schedule in date order, see ical.py
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_date', 'venue_id', 'date'),
+        db.Index('ix_Show_artist_id_date', 'artist_id', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.DateTime)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
+
+
+class Similarity(db.Model):
+    """Precomputed nearest neighbours of a venue or artist, see similarity.py."""
+    __tablename__ = 'Similarity'
+    __table_args__ = (
+        db.Index('ix_Similarity_kind_neighbor_id', 'kind', 'neighbor_id'),
+    )
+
+    kind = db.Column(db.String(10), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    neighbor_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+
+
+class SimilarityRefresh(db.Model):
+    """Where the last `flask similar refresh` of each kind left off."""
+    __tablename__ = 'SimilarityRefresh'
+
+    kind = db.Column(db.String(10), primary_key=True)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+    max_show_id = db.Column(db.Integer, nullable=False, default=0)
+    # a refresh with other settings starts over
+    top_k = db.Column(db.Integer, nullable=False)
+    metric = db.Column(db.String(10), nullable=False)
+
+
+class DuplicateKey(db.Model):
+    """Blocking key of a venue or artist, see dedupe.py."""
+    __tablename__ = 'DuplicateKey'
+    __table_args__ = (
+        db.Index('ix_DuplicateKey_kind_entity_id', 'kind', 'entity_id'),
+    )
+
+    kind = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(40), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+
+
+# ----------------------------------------------------------------------------#
+# Show rollups, maintained by analytics.py.
+# ----------------------------------------------------------------------------#
+
+class VenueMonthlyShows(db.Model):
+    __tablename__ = 'VenueMonthlyShows'
+
+    venue_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ArtistMonthlyShows(db.Model):
+    __tablename__ = 'ArtistMonthlyShows'
+
+    artist_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CityMonthlyShows(db.Model):
+    __tablename__ = 'CityMonthlyShows'
+
+    # where the venue is now, see analytics.venue_moved
+    city = db.Column(db.String(120), primary_key=True)
+    state = db.Column(db.String(120), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+# ----------------------------------------------------------------------------#
+# Background jobs, see jobs.py.
+# ----------------------------------------------------------------------------#
+
+class Job(db.Model):
+    __tablename__ = 'Job'
+    __table_args__ = (
+        db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+        # one waiting job per idempotency key
+        db.Index('ix_Job_queued_key', 'key', unique=True,
+                 postgresql_where=db.text("status = 'queued'"),
+                 sqlite_where=db.text("status = 'queued'")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(120), nullable=False)
+    # JSON {"args": [...], "kwargs": {...}}
+    arguments = db.Column(db.Text, nullable=False)
+    key = db.Column(db.String(200))
+    # queued, running, retrying, done or failed
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    locked_by = db.Column(db.String(120))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+# ----------------------------------------------------------------------------#
+# Change feed for mirrors, see changes.py.
+# ----------------------------------------------------------------------------#
+
+class Change(db.Model):
+    __tablename__ = 'Change'
+    __table_args__ = (
+        db.Index('ix_Change_kind_entity_id_seq', 'kind', 'entity_id', 'seq'),
+        # never hand out a seq again, even after the newest rows are deleted
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # upsert or delete
+    op = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
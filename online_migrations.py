@@ -0,0 +1,191 @@
+# ----------------------------------------------------------------------------#
+# Helpers for Alembic revisions that must not lock big tables.
+#
+#   from online_migrations import backfill, create_index_concurrently
+#
+#   def upgrade():
+#       op.execute('ALTER TABLE "Venue" ADD COLUMN IF NOT EXISTS city_key VARCHAR(120)')
+#       backfill('venue_city_key', 'Venue', 'city_key = lower(city)',
+#                where='city_key IS NULL')
+#       create_index_concurrently('ix_Venue_city_key', 'Venue', ['city_key'])
+#
+# On Postgres a backfill commits whatever the revision did so far, then runs
+# its UPDATE in primary key ranges, each range committed on its own, so row
+# locks are held for one batch only. The last finished key is saved in
+# alembic_backfill, an interrupted `flask db upgrade` resumes from there.
+# alembic_version only moves once the whole revision is done, so the resumed
+# upgrade runs the revision from the top again: what comes before a backfill
+# must be safe to repeat (ADD COLUMN IF NOT EXISTS, CREATE OR REPLACE
+# FUNCTION, DROP TRIGGER IF EXISTS before CREATE TRIGGER; an index built by
+# create_index_concurrently is kept), or be a revision of its own. Batches
+# must be idempotent too (SET x = f(y), or guard with `where`).
+# The batch size adapts to `target_seconds` per batch and `pause` leaves room
+# for other traffic (and replicas) in between. Indexes are built CONCURRENTLY
+# outside the transaction. SQLite has no such locking to avoid, there the
+# same calls run as plain statements inside the migration transaction.
+# ----------------------------------------------------------------------------#
+
+import contextlib
+import logging
+import time
+
+from alembic import op
+from sqlalchemy import text
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+PROGRESS_TABLE = 'alembic_backfill'
+# seconds between progress lines
+REPORT_EVERY = 10
+
+
+def is_postgres():
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def outside_transaction():
+    """Commit the revision's transaction and run the block in autocommit mode
+    (Postgres, COMMIT/BEGIN in --sql scripts), a no-op elsewhere."""
+    if is_postgres():
+        return op.get_context().autocommit_block()
+    return contextlib.nullcontext()
+
+
+# ----------------------------------------------------------------------------#
+# Resumable progress.
+# ----------------------------------------------------------------------------#
+
+def saved_position(connection, name):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS %s (name VARCHAR(120) PRIMARY KEY, last_key BIGINT NOT NULL)'
+        % PROGRESS_TABLE))
+    row = connection.execute(text('SELECT last_key FROM %s WHERE name = :name' % PROGRESS_TABLE),
+                             {'name': name}).first()
+    return row[0] if row else None
+
+
+def save_position(connection, name, last_key):
+    updated = connection.execute(text('UPDATE %s SET last_key = :last_key WHERE name = :name'
+                                      % PROGRESS_TABLE), {'name': name, 'last_key': last_key})
+    if not updated.rowcount:
+        connection.execute(text('INSERT INTO %s (name, last_key) VALUES (:name, :last_key)'
+                                % PROGRESS_TABLE), {'name': name, 'last_key': last_key})
+
+
+def forget_position(connection, name):
+    connection.execute(text('DELETE FROM %s WHERE name = :name' % PROGRESS_TABLE), {'name': name})
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return '%dm%02ds' % (minutes, seconds) if minutes else '%ds' % seconds
+
+
+# ----------------------------------------------------------------------------#
+# Batches.
+# ----------------------------------------------------------------------------#
+
+def key_ranges(name, table, key='id', batch_size=1000, pause=0.0, target_seconds=None,
+               max_batch_size=100000):
+    """Yield (start, end] primary key ranges of `table` up to its current
+    largest key, saving progress after each one. The caller does its work
+    for a range before asking for the next; that work is timed to adapt the
+    batch size to `target_seconds`."""
+    connection = op.get_bind()
+    position = saved_position(connection, name)
+    if position is None:
+        position = connection.execute(text('SELECT min("%s") - 1 FROM "%s"' % (key, table))).scalar()
+    last = connection.execute(text('SELECT max("%s") FROM "%s"' % (key, table))).scalar()
+    if position is None or last is None:
+        forget_position(connection, name)
+        return
+    first = position
+    started = reported = time.monotonic()
+    logger.info('backfill %s: "%s".%s %d..%d', name, table, key, position + 1, last)
+
+    while position < last:
+        end = min(position + batch_size, last)
+        batch_started = time.monotonic()
+        yield position, end
+        elapsed = time.monotonic() - batch_started
+        position = end
+        save_position(connection, name, position)
+
+        if target_seconds:
+            # scale towards the target, at most doubling per step
+            scale = target_seconds / max(elapsed, 0.001)
+            batch_size = int(min(max_batch_size, max(1, batch_size * min(scale, 2.0))))
+        now = time.monotonic()
+        if now - reported >= REPORT_EVERY or position >= last:
+            reported = now
+            rate = (position - first) / max(now - started, 0.001)
+            logger.info('backfill %s: %d/%d (%.0f%%), %.0f keys/s, batch %d, eta %s',
+                        name, position, last, 100.0 * (position - first) / max(last - first, 1),
+                        rate, batch_size, format_seconds((last - position) / max(rate, 0.001)))
+        if pause and position < last:
+            time.sleep(pause)
+    forget_position(connection, name)
+
+
+def backfill(name, table, assignments, where=None, key='id', batch_size=1000, pause=0.0,
+             target_seconds=1.0, lock_timeout='5s'):
+    """UPDATE "table" SET <assignments> [WHERE <where>] in committed primary
+    key ranges, resumable under `name`. Returns the number of rows updated.
+    `lock_timeout` (Postgres) makes a batch fail fast instead of queueing
+    behind, and in front of, other lock holders."""
+    sql = 'UPDATE "%s" SET %s WHERE "%s" > :start AND "%s" <= :end' % (table, assignments, key, key)
+    if where:
+        sql += ' AND (%s)' % where
+    if op.get_context().as_sql:
+        # offline (--sql) scripts cannot see the key range, emit one statement
+        op.execute('UPDATE "%s" SET %s%s' % (table, assignments, ' WHERE %s' % where if where else ''))
+        return 0
+
+    rows = 0
+    with outside_transaction():
+        connection = op.get_bind()
+        if lock_timeout and is_postgres():
+            connection.execute(text("SET lock_timeout = '%s'" % lock_timeout))
+        try:
+            for start, end in key_ranges(name, table, key, batch_size, pause, target_seconds):
+                rows += connection.execute(text(sql), {'start': start, 'end': end}).rowcount
+        finally:
+            if lock_timeout and is_postgres():
+                connection.execute(text('RESET lock_timeout'))
+    logger.info('backfill %s: %d rows updated', name, rows)
+    return rows
+
+
+# ----------------------------------------------------------------------------#
+# DDL.
+# ----------------------------------------------------------------------------#
+
+def drop_invalid_index(name):
+    """Whether a valid index `name` exists. A failed CREATE INDEX
+    CONCURRENTLY leaves an INVALID index behind that would make the retry
+    fail with "already exists", that one is dropped."""
+    row = op.get_bind().execute(text(
+        'SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid '
+        'WHERE c.relname = :name'), {'name': name}).first()
+    if row is not None and not row[0]:
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS "%s"' % name)
+        return False
+    return row is not None
+
+
+def create_index_concurrently(name, table, columns, unique=False, **kw):
+    """op.create_index() that does not block writes on Postgres. An index
+    already built by an interrupted run of the revision is kept."""
+    if not is_postgres():
+        return op.create_index(name, table, columns, unique=unique, **kw)
+    with outside_transaction():
+        if not op.get_context().as_sql and drop_invalid_index(name):
+            return
+        op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(name, table):
+    if not is_postgres():
+        return op.drop_index(name, table_name=table)
+    with outside_transaction():
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
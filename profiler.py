@@ -0,0 +1,210 @@
+# ----------------------------------------------------------------------------#
+# Sampling request profiler.
+#
+# With PROFILE_ENABLED one request in PROFILE_SAMPLE_RATE (0: none) is
+# profiled, and so is every request carrying an X-Profile header signed with
+# the SECRET_KEY (`flask profile token` prints one). PROFILE_MODE picks
+#
+#   sample    a thread reading the request thread's stack every
+#             PROFILE_INTERVAL seconds, written as collapsed stacks (.folded)
+#   cprofile  cProfile over the whole request, written as a pstats dump (.prof)
+#
+# Dumps go to PROFILE_DIR/<endpoint>/<time>-<pid>-<ms>ms.<ext>, only the
+# newest PROFILE_KEEP of an endpoint are kept. `flask profile merge` adds the
+# dumps of an endpoint up into one file for flamegraph.pl / speedscope
+# (.folded) or snakeviz / pstats (.prof).
+# ----------------------------------------------------------------------------#
+
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from images import write_atomically
+
+HEADER = 'X-Profile'
+EXTENSIONS = {'sample': 'folded', 'cprofile': 'prof'}
+
+
+def signer(app):
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='profile')
+
+
+def make_token(app):
+    return signer(app).dumps('profile')
+
+
+def valid_token(app, token):
+    try:
+        signer(app).loads(token, max_age=app.config['PROFILE_TOKEN_MAX_AGE'])
+        return True
+    except BadSignature:
+        return False
+
+
+# ----------------------------------------------------------------------------#
+# Profiling one request.
+# ----------------------------------------------------------------------------#
+
+def frame_label(code):
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+def collapse(frame):
+    """The stack of `frame` as "outermost;...;innermost"."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler(object):
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self.stacks.items()).encode()
+
+
+class CProfiler(object):
+
+    def __init__(self, interval):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.create_stats()
+        # what Profile.dump_stats() writes
+        return marshal.dumps(self.profile.stats)
+
+
+PROFILERS = {'sample': StackSampler, 'cprofile': CProfiler}
+
+
+def save(directory, data, extension, elapsed, keep):
+    os.makedirs(directory, exist_ok=True)
+    name = '%s-%d-%dms.%s' % (datetime.utcnow().strftime('%Y%m%dT%H%M%S.%f'), os.getpid(),
+                              elapsed * 1000, extension)
+    write_atomically(os.path.join(directory, name), data)
+    # names start with the time, the oldest sort first
+    dumps = sorted(name for name in os.listdir(directory) if name.endswith('.' + extension))
+    for name in dumps[:max(len(dumps) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # rotated by another worker
+
+
+class Profiler(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_ENABLED', False)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0)
+        app.config.setdefault('PROFILE_MODE', 'sample')
+        app.config.setdefault('PROFILE_INTERVAL', 0.005)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.root_path, 'profiles'))
+        app.config.setdefault('PROFILE_KEEP', 50)
+        app.config.setdefault('PROFILE_TOKEN_MAX_AGE', 24 * 3600)
+        if app.config['PROFILE_MODE'] not in PROFILERS:
+            raise ValueError('PROFILE_MODE must be one of %s' % ', '.join(PROFILERS))
+        if app.config['PROFILE_ENABLED']:
+            app.before_request(self.before_request)
+            app.teardown_request(self.teardown_request)
+
+    def wanted(self):
+        rate = current_app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() * rate < 1:
+            return True
+        token = request.headers.get(HEADER)
+        return bool(token) and valid_token(current_app, token)
+
+    def before_request(self):
+        if self.wanted():
+            config = current_app.config
+            profiler = PROFILERS[config['PROFILE_MODE']](config['PROFILE_INTERVAL'])
+            g.profiler = (profiler, time.perf_counter())
+            profiler.start()
+
+    def teardown_request(self, exc):
+        if 'profiler' not in g:
+            return
+        profiler, started = g.pop('profiler')
+        data = profiler.stop()
+        config = current_app.config
+        try:
+            save(os.path.join(config['PROFILE_DIR'], request.endpoint or 'unknown'), data,
+                 EXTENSIONS[config['PROFILE_MODE']], time.perf_counter() - started,
+                 config['PROFILE_KEEP'])
+        except OSError:
+            current_app.logger.exception('writing the profile of %s failed', request.path)
+
+
+# ----------------------------------------------------------------------------#
+# Merging dumps.
+# ----------------------------------------------------------------------------#
+
+def dumps(directory, endpoint=None, extension='folded'):
+    """Paths of the dumps of `endpoint` (all endpoints when None)."""
+    if endpoint:
+        endpoints = [endpoint]
+    else:
+        endpoints = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    paths = []
+    for name in endpoints:
+        folder = os.path.join(directory, name)
+        if os.path.isdir(folder):
+            paths.extend(os.path.join(folder, dump) for dump in sorted(os.listdir(folder))
+                         if dump.endswith('.' + extension))
+    return paths
+
+
+def merge_folded(paths):
+    """Counter of collapsed stacks over every file in `paths`."""
+    stacks = Counter()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
+
+
+def merge_pstats(paths):
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    return stats
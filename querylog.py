@@ -0,0 +1,197 @@
+# ----------------------------------------------------------------------------#
+# Slow query log.
+#
+# Every statement the app sends is timed by engine events. Those slower than
+# SLOW_QUERY_MS are recorded with their SQL, the shape of their parameters
+# (types and lengths, never values), the endpoint and the first line of our
+# own code on the stack (app.py:312 show_venue). A background thread then asks
+# the database for the plan on a separate connection, EXPLAIN (ANALYZE off)
+# on Postgres, EXPLAIN QUERY PLAN on SQLite, once per distinct statement.
+#
+# The last SLOW_QUERY_BUFFER records of the worker are at /admin/slow-queries
+# (ADMIN_ENABLED), every record goes to SLOW_QUERY_LOG as one JSON line once
+# its plan is in. A Seq Scan on "Show" or "Venue" there is a missing index.
+# ----------------------------------------------------------------------------#
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app, has_app_context, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('fyyur.slow_queries')
+
+EXPLAIN = {
+    'postgresql': 'EXPLAIN (ANALYZE off) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+# plans kept per worker, by statement
+PLAN_CACHE_SIZE = 256
+
+
+def shape(value):
+    """Type (and length) of a bound parameter."""
+    if isinstance(value, (str, bytes, list, tuple)):
+        return '%s[%d]' % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def parameter_shapes(parameters, executemany):
+    if executemany:
+        return {'executemany': len(parameters),
+                'first': parameter_shapes(parameters[0], False) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: shape(value) for name, value in parameters.items()}
+    return [shape(value) for value in parameters or ()]
+
+
+def call_site(root):
+    """First frame of the app's own code, "app.py:312 show_venue"."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if path.startswith(root) and path != __file__ and 'site-packages' not in path:
+            if path.endswith('.html'):
+                # line numbers of compiled templates are not template lines
+                return os.path.relpath(path, root)
+            return '%s:%d %s' % (os.path.relpath(path, root), frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class QueryLog(object):
+    """Slow queries of one app in this worker."""
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.records = deque(maxlen=size)
+        self.plans = OrderedDict()
+        self.executor = None
+        self.pid = None
+
+    def pool(self):
+        # one thread, started after gunicorn forked the worker
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix='explain')
+        return self.executor
+
+    def add(self, record, engine, parameters, explain):
+        with self.lock:
+            self.records.append(record)
+            plan = self.plans.get(record['statement'])
+        if plan is not None or not explain:
+            record['plan'] = plan
+            write(record)
+        else:
+            self.pool().submit(self.explain, record, engine, parameters)
+
+    def explain(self, record, engine, parameters):
+        prefix = EXPLAIN[engine.dialect.name]
+        try:
+            # a raw DBAPI connection, its statements do not come back here
+            connection = engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(prefix + record['statement'], parameters)
+                # the plan text is the last column on both
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+                cursor.close()
+            finally:
+                connection.rollback()
+                connection.close()
+        except Exception as e:
+            plan = 'EXPLAIN failed: %s' % e
+        with self.lock:
+            self.plans[record['statement']] = plan
+            if len(self.plans) > PLAN_CACHE_SIZE:
+                self.plans.popitem(last=False)
+        record['plan'] = plan
+        write(record)
+
+    def recent(self):
+        with self.lock:
+            return list(reversed(self.records))
+
+
+def write(record):
+    logger.warning(json.dumps(record, default=str))
+
+
+# ----------------------------------------------------------------------------#
+# Engine events, for every engine: each app looks up its own QueryLog.
+# ----------------------------------------------------------------------------#
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+# a statement that raised never reaches after_cursor_execute, drop its start
+# or it stays on the pooled connection for good
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    # no execution context: it failed before before_cursor_execute ran
+    if context.execution_context is None or context.connection is None:
+        return
+    started = context.connection.info.get('query_started')
+    if started:
+        started.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info.get('query_started')
+    if not started:
+        return
+    elapsed = (time.perf_counter() - started.pop()) * 1000
+    if not has_app_context() or 'querylog' not in current_app.extensions:
+        return
+    config = current_app.config
+    if not config['SLOW_QUERY_MS'] or elapsed < config['SLOW_QUERY_MS']:
+        return
+    record = {
+        'at': datetime.utcnow().isoformat(),
+        'ms': round(elapsed, 1),
+        'statement': statement,
+        'parameters': parameter_shapes(parameters, executemany),
+        'endpoint': request.endpoint if has_request_context() else None,
+        'caller': call_site(current_app.root_path),
+        'plan': None,
+    }
+    engine = connection.engine
+    explain = config['SLOW_QUERY_EXPLAIN'] and not executemany and engine.dialect.name in EXPLAIN \
+        and statement.split(None, 1)[0].upper() in ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+    current_app.extensions['querylog'].add(record, engine, parameters, explain)
+
+
+def stats_view():
+    return jsonify(threshold_ms=current_app.config['SLOW_QUERY_MS'],
+                   queries=current_app.extensions['querylog'].recent())
+
+
+def init_querylog(app):
+    app.config.setdefault('SLOW_QUERY_MS', 200)
+    app.config.setdefault('SLOW_QUERY_BUFFER', 200)
+    app.config.setdefault('SLOW_QUERY_LOG', None)
+    app.config.setdefault('SLOW_QUERY_EXPLAIN', True)
+    if not app.config['SLOW_QUERY_MS']:
+        return
+    app.extensions['querylog'] = QueryLog(app.config['SLOW_QUERY_BUFFER'])
+    path = app.config['SLOW_QUERY_LOG']
+    if path and not any(getattr(handler, 'baseFilename', None) == os.path.abspath(path)
+                        for handler in logger.handlers):
+        handler = logging.FileHandler(path, delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    if app.config.get('ADMIN_ENABLED'):
+        app.add_url_rule('/admin/slow-queries', 'slow_queries', stats_view)
@@ -0,0 +1,352 @@
+# ----------------------------------------------------------------------------#
+# Admission control for the expensive endpoints.
+#
+# RATE_LIMIT_ENDPOINTS puts endpoints in groups: the searches in 'search', the
+# create/edit/delete handlers in 'write'. Every group in RATE_LIMITS gets
+#
+#   client       (rate, burst) token bucket per client address, empty -> 429
+#                (behind a proxy set TRUSTED_PROXIES, or every visitor
+#                shares the proxy's address and bucket)
+#   global       (rate, burst) token bucket shared by all clients, empty -> 503
+#   concurrency  requests of the group running at once; `queue` more wait up
+#                to `wait` seconds for a slot, anything beyond is sent a 503
+#
+# so a burst of searches or form posts is turned away in microseconds before
+# it reaches the database, instead of slowing down every other page.
+#
+# The state is kept per worker. With RATE_LIMIT_BACKEND = 'shared' it lives in
+# an anonymous shared memory map created with the app; gunicorn's preload_app
+# builds the app in the master, so every forked worker sees the same map and
+# the limits hold for the whole server. Client buckets are then a fixed table
+# of RATE_LIMIT_SHARED_SLOTS per group, clients colliding in it share a bucket.
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, jsonify, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+ENDPOINTS = {
+    'search_venues': 'search',
+    'search_artists': 'search',
+    'search': 'search',
+    'create_venue_submission': 'write',
+    'edit_venue_submission': 'write',
+    'delete_venue': 'write',
+    'create_artist_submission': 'write',
+    'edit_artist_submission': 'write',
+    'delete_artist': 'write',
+    'create_show_submission': 'write',
+}
+LIMITS = {
+    'search': {'client': (2, 10), 'global': (20, 40), 'concurrency': 8, 'queue': 16, 'wait': 2.0},
+    'write': {'client': (1, 5), 'global': (10, 20), 'concurrency': 4, 'queue': 8, 'wait': 5.0},
+}
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBackend(object):
+    """Limiter state of one worker."""
+
+    def __init__(self, max_clients):
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.buckets = {}  # (group, client or None) -> (tokens, updated)
+        self.running = Counter()
+        self.waiting = Counter()
+        self.max_clients = max_clients
+        self.pruned_at = 0.0
+
+    def take(self, group, client, rate, burst):
+        """Take a token, returns 0 or the seconds until one is available."""
+        now = time.monotonic()
+        key = (group, client)
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self.buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now)
+            if len(self.buckets) > self.max_clients and now - self.pruned_at > 1:
+                self.pruned_at = now
+                self.prune(now)
+        return wait
+
+    def refund(self, group, client, rate, burst):
+        """Give back a token taken for a request turned away after all."""
+        with self.lock:
+            tokens, updated = self.buckets.get((group, client), (burst, time.monotonic()))
+            self.buckets[group, client] = (min(burst, tokens + 1), updated)
+
+    def prune(self, now):
+        # a full bucket is the same as no bucket
+        limits = current_app.config['RATE_LIMITS']
+        for (group, client), (tokens, updated) in list(self.buckets.items()):
+            rate, burst = limits[group]['client' if client is not None else 'global']
+            if refill(tokens, updated, now, rate, burst) >= burst:
+                del self.buckets[group, client]
+
+    def acquire(self, group, limit, queue, wait):
+        """Take a concurrency slot, waiting for one in the queue if there is
+        room. Returns whether a slot was taken."""
+        deadline = time.monotonic() + wait
+        with self.lock:
+            if self.running[group] >= limit:
+                if self.waiting[group] >= queue:
+                    return False
+                self.waiting[group] += 1
+                try:
+                    while self.running[group] >= limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        self.slot_freed.wait(remaining)
+                finally:
+                    self.waiting[group] -= 1
+            self.running[group] += 1
+            return True
+
+    def release(self, group):
+        with self.lock:
+            self.running[group] -= 1
+            self.slot_freed.notify_all()
+
+    def in_flight(self, group):
+        with self.lock:
+            return self.running[group], self.waiting[group]
+
+
+# client bucket: owner (hash of the client address, 0 for free), tokens, updated
+BUCKET = struct.Struct('<Qdd')
+# concurrency of one worker: pid, running, waiting
+WORKER = struct.Struct('<qqq')
+# slots looked at before a client shares a bucket
+PROBES = 4
+# seconds between looks at the shared counts while queued
+POLL = 0.005
+
+
+class SharedBackend(object):
+    """Limiter state in shared memory, for workers forked after it was
+    created. Per group: the client buckets, the global bucket and a
+    concurrency entry per worker process."""
+
+    def __init__(self, groups, slots, max_workers=256):
+        self.lock = multiprocessing.Lock()
+        self.groups = {group: number for number, group in enumerate(sorted(groups))}
+        self.slots = slots
+        self.max_workers = max_workers
+        self.group_size = (slots + 1) * BUCKET.size + max_workers * WORKER.size
+        self.memory = mmap.mmap(-1, max(len(groups), 1) * self.group_size)
+        self.entries = {}  # (pid, group) -> offset of this worker's entry
+
+    def bucket(self, group, client, now, rate, burst):
+        base = self.groups[group] * self.group_size
+        if client is None:
+            return base + self.slots * BUCKET.size, 1
+        owner = int.from_bytes(hashlib.blake2b(client.encode(), digest_size=8).digest(), 'little') or 1
+        start = owner % self.slots
+        for probe in range(PROBES):
+            offset = base + (start + probe) % self.slots * BUCKET.size
+            current, tokens, updated = BUCKET.unpack_from(self.memory, offset)
+            if current == owner:
+                return offset, owner
+            if current == 0 or refill(tokens, updated, now, rate, burst) >= burst:
+                BUCKET.pack_into(self.memory, offset, owner, burst, now)
+                return offset, owner
+        return base + start * BUCKET.size, owner
+
+    def take(self, group, client, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            offset, owner = self.bucket(group, client, now, rate, burst)
+            current, tokens, updated = BUCKET.unpack_from(self.memory, offset)
+            if current == 0:
+                # the global bucket, first use
+                tokens, updated = burst, now
+            tokens = refill(tokens, updated, now, rate, burst)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            BUCKET.pack_into(self.memory, offset, current or owner,
+                             tokens - 1 if tokens >= 1 else tokens, now)
+        return wait
+
+    def refund(self, group, client, rate, burst):
+        with self.lock:
+            offset, owner = self.bucket(group, client, time.monotonic(), rate, burst)
+            current, tokens, updated = BUCKET.unpack_from(self.memory, offset)
+            # the slot take() used, whoever owns it
+            BUCKET.pack_into(self.memory, offset, current or owner, min(burst, tokens + 1), updated)
+
+    def worker_offsets(self, group):
+        base = self.groups[group] * self.group_size + (self.slots + 1) * BUCKET.size
+        return [base + number * WORKER.size for number in range(self.max_workers)]
+
+    def own_entry(self, group):
+        pid = os.getpid()
+        if (pid, group) not in self.entries:
+            for attempt in range(2):
+                free = None
+                for offset in self.worker_offsets(group):
+                    owner, _, _ = WORKER.unpack_from(self.memory, offset)
+                    if owner == pid:
+                        free = offset
+                        break
+                    if owner == 0 and free is None:
+                        free = offset
+                if free is not None:
+                    break
+                # entries of workers that were replaced are freed by reaping
+                self.counts(group, reap=True)
+            else:
+                raise RuntimeError('more than %d workers share the rate limiter' % self.max_workers)
+            WORKER.pack_into(self.memory, free, pid, 0, 0)
+            self.entries[pid, group] = free
+        return self.entries[pid, group]
+
+    def counts(self, group, reap=False):
+        running = waiting = 0
+        for offset in self.worker_offsets(group):
+            pid, worker_running, worker_waiting = WORKER.unpack_from(self.memory, offset)
+            if pid and reap and pid != os.getpid():
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    # a worker killed mid request never released its slots
+                    WORKER.pack_into(self.memory, offset, 0, 0, 0)
+                    continue
+                except PermissionError:
+                    pass
+            running += worker_running
+            waiting += worker_waiting
+        return running, waiting
+
+    def add(self, offset, running=0, waiting=0):
+        pid, worker_running, worker_waiting = WORKER.unpack_from(self.memory, offset)
+        WORKER.pack_into(self.memory, offset, pid, worker_running + running, worker_waiting + waiting)
+
+    def acquire(self, group, limit, queue, wait):
+        deadline = time.monotonic() + wait
+        queued = False
+        while True:
+            with self.lock:
+                entry = self.own_entry(group)
+                running, waiting = self.counts(group)
+                if running >= limit:
+                    running, waiting = self.counts(group, reap=True)
+                if running < limit:
+                    self.add(entry, running=1, waiting=-1 if queued else 0)
+                    return True
+                if not queued:
+                    if waiting >= queue:
+                        return False
+                    self.add(entry, waiting=1)
+                    queued = True
+                elif time.monotonic() >= deadline:
+                    self.add(entry, waiting=-1)
+                    return False
+            time.sleep(POLL)
+
+    def release(self, group):
+        with self.lock:
+            self.add(self.own_entry(group), running=-1)
+
+    def in_flight(self, group):
+        with self.lock:
+            return self.counts(group)
+
+
+# ----------------------------------------------------------------------------#
+# Extension.
+# ----------------------------------------------------------------------------#
+
+class Limiter(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMITS', LIMITS)
+        app.config.setdefault('RATE_LIMIT_ENDPOINTS', ENDPOINTS)
+        app.config.setdefault('RATE_LIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATE_LIMIT_SHARED_SLOTS', 4096)
+        app.config.setdefault('RATE_LIMIT_MAX_CLIENTS', 100000)
+        if not app.config['RATE_LIMIT_ENABLED']:
+            return
+        if app.config['RATE_LIMIT_BACKEND'] == 'shared':
+            backend = SharedBackend(app.config['RATE_LIMITS'], app.config['RATE_LIMIT_SHARED_SLOTS'])
+        else:
+            backend = MemoryBackend(app.config['RATE_LIMIT_MAX_CLIENTS'])
+        app.extensions['ratelimit'] = {'backend': backend, 'lock': threading.Lock(), 'stats': Counter()}
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+        if app.config.get('ADMIN_ENABLED'):
+            app.add_url_rule('/admin/ratelimit', 'ratelimit_stats', self.stats_view)
+
+    # ------------------------------------------------------------------------#
+
+    def record(self, group, outcome):
+        state = current_app.extensions['ratelimit']
+        with state['lock']:
+            state['stats'][group, outcome] += 1
+
+    def before_request(self):
+        group = current_app.config['RATE_LIMIT_ENDPOINTS'].get(request.endpoint)
+        if group is None:
+            return
+        limits = current_app.config['RATE_LIMITS'][group]
+        backend = current_app.extensions['ratelimit']['backend']
+        client = request.remote_addr or ''
+        # the client's own bucket first, one client must not drain the global one
+        if 'client' in limits:
+            wait = backend.take(group, client, *limits['client'])
+            if wait:
+                self.record(group, 'limited')
+                raise TooManyRequests(retry_after=math.ceil(wait))
+        if 'global' in limits:
+            wait = backend.take(group, None, *limits['global'])
+            if wait:
+                # shed for everybody, the client did not use its token
+                if 'client' in limits:
+                    backend.refund(group, client, *limits['client'])
+                self.record(group, 'shed')
+                raise ServiceUnavailable(retry_after=math.ceil(wait))
+        if 'concurrency' in limits:
+            if not backend.acquire(group, limits['concurrency'], limits.get('queue', 0),
+                                   limits.get('wait', 0)):
+                # not served, give back what the buckets charged for it
+                for bucket, key in (('client', client), ('global', None)):
+                    if bucket in limits:
+                        backend.refund(group, key, *limits[bucket])
+                self.record(group, 'shed')
+                raise ServiceUnavailable(retry_after=1)
+            g.admitted_group = group
+        self.record(group, 'admitted')
+
+    def teardown_request(self, exc):
+        group = g.pop('admitted_group', None)
+        if group is not None:
+            current_app.extensions['ratelimit']['backend'].release(group)
+
+    def stats_view(self):
+        state = current_app.extensions['ratelimit']
+        with state['lock']:
+            stats = dict(state['stats'])
+        groups = {}
+        for group in current_app.config['RATE_LIMITS']:
+            running, waiting = state['backend'].in_flight(group)
+            groups[group] = {outcome: stats.get((group, outcome), 0)
+                             for outcome in ('admitted', 'limited', 'shed')}
+            groups[group].update(running=running, waiting=waiting)
+        return jsonify(backend=current_app.config['RATE_LIMIT_BACKEND'], groups=groups)
@@ -0,0 +1,277 @@
+# ----------------------------------------------------------------------------#
+# Similar artists and venues.
+#
+# Every artist (venue) is a row of a sparse binary matrix whose columns are
+# genres and the venues it played (the artists it booked). One sparse product
+# M[rows] @ M.T gives the feature overlap of a batch of rows with everybody,
+# turned into cosine or Jaccard scores; the best SIMILAR_TOP_K of each row are
+# stored in the Similarity table, which the detail pages read.
+#
+# `flask similar refresh` only recomputes what changed since its last run:
+# entities edited (updated_at) or with new shows (Show.id) get a fresh list,
+# and the lists of everybody scoring against them are patched with the new
+# scores. A patched list is recomputed in full when one of its members fell
+# out or got worse and it may have pushed out a neighbour nobody remembers.
+# Deleted shows leave no trace to pick up, run with --full after removing any.
+# Saving an artist, venue or show also queues a refresh job (jobs.py) that
+# runs SIMILAR_REFRESH_DELAY seconds later, changes in between share it.
+#
+# NumPy and SciPy are only imported by the refresh, not by the web workers.
+# ----------------------------------------------------------------------------#
+
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func
+
+from jobs import enqueue, task
+from models import db, Venue, Artist, Show, Similarity, SimilarityRefresh
+
+KINDS = {
+    # kind: (model, its column on Show, the other side's column on Show)
+    'artist': (Artist, Show.artist_id, Show.venue_id),
+    'venue': (Venue, Show.venue_id, Show.artist_id),
+}
+METRICS = ('cosine', 'jaccard')
+# matrix rows scored at once
+CHUNK_SIZE = 1000
+# ids per IN (...) clause
+ID_BATCH = 500
+
+
+def batches(values, size=ID_BATCH):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def parse_genres(value):
+    # genres are stored as a Postgres array literal: {Jazz,"Hip-Hop"}
+    return {genre.strip().strip('"').casefold()
+            for genre in (value or '').strip('{}').split(',') if genre.strip()}
+
+
+# ----------------------------------------------------------------------------#
+# Scores.
+# ----------------------------------------------------------------------------#
+
+def load_features(kind):
+    """(ids, matrix, sizes): entity ids in row order, the entity-by-feature
+    CSR matrix and the number of features of each row."""
+    import numpy as np
+    from scipy import sparse
+
+    model, own_column, other_column = KINDS[kind]
+    entities = db.session.query(model.id, model.genres).order_by(model.id).all()
+    position = {id: row for row, (id, _) in enumerate(entities)}
+    features = {}
+    rows, columns = [], []
+    for row, (_, genres) in enumerate(entities):
+        for genre in parse_genres(genres):
+            rows.append(row)
+            columns.append(features.setdefault(('genre', genre), len(features)))
+    for own_id, other_id in db.session.query(own_column, other_column).distinct():
+        if own_id in position and other_id is not None:
+            rows.append(position[own_id])
+            columns.append(features.setdefault(('show', other_id), len(features)))
+
+    ids = np.array([id for id, _ in entities], dtype=np.int64)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                               shape=(len(entities), max(len(features), 1)))
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    return ids, matrix, sizes
+
+
+def scores(matrix, sizes, rows, metric):
+    """CSR matrix of the similarity of `rows` (positions) to every row."""
+    import numpy as np
+    from scipy import sparse
+
+    overlap = (matrix[rows] @ matrix.T).tocoo()
+    row_sizes = sizes[rows][overlap.row]
+    column_sizes = sizes[overlap.col]
+    if metric == 'jaccard':
+        data = overlap.data / (row_sizes + column_sizes - overlap.data)
+    else:
+        data = overlap.data / np.sqrt(row_sizes * column_sizes)
+    return sparse.csr_matrix((data, (overlap.row, overlap.col)), shape=overlap.shape)
+
+
+def top_k(row_scores, row, exclude, k):
+    """[(position, score)] of the best `k` of one row, `exclude` (the entity
+    itself) left out, ties broken by position."""
+    import numpy as np
+
+    start, end = row_scores.indptr[row], row_scores.indptr[row + 1]
+    columns, data = row_scores.indices[start:end], row_scores.data[start:end]
+    keep = columns != exclude
+    columns, data = columns[keep], data[keep]
+    if len(data) > k:
+        best = np.argpartition(-data, k - 1)[:k]
+        columns, data = columns[best], data[best]
+    order = np.lexsort((columns, -data))
+    return list(zip(columns[order].tolist(), data[order].tolist()))
+
+
+def neighbours(ids, matrix, sizes, positions, metric, k):
+    """{entity id: [(neighbour id, score)]} for the rows at `positions`."""
+    lists = {}
+    for chunk in batches(positions, CHUNK_SIZE):
+        chunk_scores = scores(matrix, sizes, chunk, metric)
+        for row, position in enumerate(chunk):
+            lists[int(ids[position])] = [(int(ids[column]), score) for column, score
+                                         in top_k(chunk_scores, row, position, k)]
+    return lists
+
+
+# ----------------------------------------------------------------------------#
+# Stored lists.
+# ----------------------------------------------------------------------------#
+
+def stored_lists(kind, entity_ids):
+    lists = defaultdict(list)
+    for batch in batches(entity_ids):
+        rows = db.session.query(Similarity.entity_id, Similarity.neighbor_id, Similarity.score) \
+            .filter(Similarity.kind == kind, Similarity.entity_id.in_(batch)) \
+            .order_by(Similarity.entity_id, Similarity.rank)
+        for entity_id, neighbor_id, score in rows:
+            lists[entity_id].append((neighbor_id, score))
+    return lists
+
+
+def delete_lists(kind, entity_ids):
+    for batch in batches(entity_ids):
+        Similarity.query.filter(Similarity.kind == kind, Similarity.entity_id.in_(batch)) \
+            .delete(synchronize_session=False)
+
+
+def save_lists(kind, lists):
+    """Replace the stored lists of the entities in `lists`."""
+    delete_lists(kind, lists)
+    rows = [{'kind': kind, 'entity_id': entity_id, 'neighbor_id': neighbor_id,
+             'score': score, 'rank': rank}
+            for entity_id, neighbours_ in lists.items()
+            for rank, (neighbor_id, score) in enumerate(neighbours_)]
+    for batch in batches(rows, 5000):
+        db.session.execute(Similarity.__table__.insert(), batch)
+
+
+# ----------------------------------------------------------------------------#
+# Refresh.
+# ----------------------------------------------------------------------------#
+
+def changed_ids(kind, state):
+    model, own_column, _ = KINDS[kind]
+    edited = db.session.query(model.id).filter(model.updated_at > state.refreshed_at)
+    booked = db.session.query(own_column).filter(Show.id > state.max_show_id, own_column.isnot(None))
+    return {id for id, in edited} | {id for id, in booked}
+
+
+def patch(old, new_scores, changed, gone, k):
+    """The list `old` with the members in `changed` rescored (new_scores) and
+    those in `gone` dropped, None when that cannot be done without a full
+    recompute."""
+    if len(old) >= k:
+        for neighbor_id, score in old:
+            if neighbor_id in gone or (neighbor_id in changed and new_scores.get(neighbor_id, 0) < score):
+                # whoever was k + 1th could move up, only a recompute knows
+                return None
+    merged = [(neighbor_id, score) for neighbor_id, score in old
+              if neighbor_id not in changed and neighbor_id not in gone]
+    merged.extend(new_scores.items())
+    merged.sort(key=lambda item: (-item[1], item[0]))
+    return merged[:k]
+
+
+def refresh(kind, k=10, metric='cosine', full=False):
+    """Bring the stored neighbours of `kind` up to date, returns the number
+    of entities whose list was rewritten."""
+    if metric not in METRICS:
+        raise ValueError('metric must be one of %s' % ', '.join(METRICS))
+    started = datetime.utcnow()
+    max_show_id = db.session.query(func.max(Show.id)).scalar() or 0
+    state = SimilarityRefresh.query.get(kind)
+    if state is None or state.top_k != k or state.metric != metric:
+        full = True
+
+    ids, matrix, sizes = load_features(kind)
+    position = {int(id): row for row, id in enumerate(ids)}
+
+    if full:
+        Similarity.query.filter_by(kind=kind).delete(synchronize_session=False)
+        lists = neighbours(ids, matrix, sizes, list(range(len(ids))), metric, k)
+        save_lists(kind, lists)
+        rewritten = len(lists)
+    else:
+        changed = {id for id in changed_ids(kind, state) if id in position}
+        stored = {id for id, in db.session.query(Similarity.entity_id).filter_by(kind=kind).distinct()}
+        gone = stored - set(position)
+
+        # everybody with a new score against a changed entity, or listing
+        # a changed or deleted one
+        changed_positions = sorted(position[id] for id in changed)
+        new_scores = defaultdict(dict)  # entity id -> {changed id: score}
+        lists = {}
+        for chunk in batches(changed_positions, CHUNK_SIZE):
+            chunk_scores = scores(matrix, sizes, chunk, metric)
+            for row, changed_position in enumerate(chunk):
+                changed_id = int(ids[changed_position])
+                lists[changed_id] = [(int(ids[column]), score) for column, score
+                                     in top_k(chunk_scores, row, changed_position, k)]
+                start, end = chunk_scores.indptr[row], chunk_scores.indptr[row + 1]
+                for column, score in zip(chunk_scores.indices[start:end].tolist(),
+                                         chunk_scores.data[start:end].tolist()):
+                    new_scores[int(ids[column])][changed_id] = score
+        listing = set()
+        for batch in batches(changed | gone):
+            listing.update(id for id, in db.session.query(Similarity.entity_id).filter(
+                Similarity.kind == kind, Similarity.neighbor_id.in_(batch)))
+        affected = (set(new_scores) | listing) - changed - gone
+
+        old_lists = stored_lists(kind, affected)
+        recompute = []
+        for entity_id in affected:
+            patched = patch(old_lists.get(entity_id, []), new_scores.get(entity_id, {}),
+                            changed, gone, k)
+            if patched is None:
+                recompute.append(position[entity_id])
+            else:
+                lists[entity_id] = patched
+        lists.update(neighbours(ids, matrix, sizes, sorted(recompute), metric, k))
+        delete_lists(kind, gone)
+        save_lists(kind, lists)
+        rewritten = len(lists)
+
+    if state is None:
+        state = SimilarityRefresh(kind=kind)
+        db.session.add(state)
+    state.refreshed_at, state.max_show_id, state.top_k, state.metric = started, max_show_id, k, metric
+    db.session.commit()
+    return rewritten
+
+
+@task('similar.refresh')
+def refresh_job(kind):
+    refresh(kind, current_app.config['SIMILAR_TOP_K'], current_app.config['SIMILAR_METRIC'])
+
+
+def schedule_refresh(*kinds):
+    """Queue a refresh of `kinds` with the current transaction."""
+    for kind in kinds:
+        enqueue('similar.refresh', kind, key='similar.refresh:' + kind,
+                delay=current_app.config['SIMILAR_REFRESH_DELAY'])
+
+
+# ----------------------------------------------------------------------------#
+# Pages.
+# ----------------------------------------------------------------------------#
+
+def similar_to(kind, id, limit=None):
+    """Stored neighbours of a venue or artist, most similar first."""
+    model = KINDS[kind][0]
+    query = db.session.query(model.id, model.name, model.image_link, Similarity.score) \
+        .join(Similarity, Similarity.neighbor_id == model.id) \
+        .filter(Similarity.kind == kind, Similarity.entity_id == id) \
+        .order_by(Similarity.rank)
+    return query.limit(limit).all() if limit else query.all()
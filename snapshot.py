@@ -0,0 +1,435 @@
+# ----------------------------------------------------------------------------#
+# Read-only catalog snapshots.
+#
+# `flask snapshot export` writes Venue, Artist, Show and the similar lists to
+# one file laid out as columns: a flat array per column (strings as numbers
+# into a shared, deduplicated string table), an id -> row array per table and,
+# per venue and artist, its shows sorted by date. Nothing is parsed when it is
+# opened: the file is mapped and each array is a memoryview cast over its
+# bytes, so a worker is ready in milliseconds and every worker on the host
+# reads the same pages from the page cache instead of holding its own copy.
+#
+# With SNAPSHOT_SERVING the home page, the venue, artist and show pages and
+# the name searches are answered from SNAPSHOT_PATH and never touch the
+# database; everything else is a 503. Use it to ride out a traffic spike or
+# keep the site up through database maintenance. A newer export replaces the
+# file atomically and workers pick it up within SNAPSHOT_CHECK_INTERVAL.
+# ----------------------------------------------------------------------------#
+
+import bisect
+import json
+import math
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask import abort, current_app, render_template, request
+from werkzeug.exceptions import ServiceUnavailable
+
+from models import db, Venue, Artist, Show, Similarity
+
+MAGIC = b'FYYURSN1'
+# magic, length of the JSON directory that follows
+HEADER_SIZE = 16
+ALIGN = 8
+NONE = -1
+EPOCH = datetime(1970, 1, 1)
+MODELS = {'venue': Venue, 'artist': Artist, 'show': Show}
+# column kind -> array typecode
+TYPECODES = {'int': 'q', 'float': 'd', 'bool': 'b', 'time': 'd', 'str': 'i'}
+KINDS = {int: 'int', float: 'float', bool: 'bool', datetime: 'time', str: 'str'}
+
+
+def column_kind(column):
+    return KINDS[column.type.python_type]
+
+
+def aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+# ----------------------------------------------------------------------------#
+# Export.
+# ----------------------------------------------------------------------------#
+
+class Writer(object):
+
+    def __init__(self):
+        self.arrays = {}  # name -> array, written in insertion order
+        self.numbers = {}  # string -> number in the string table
+        self.string_data = bytearray()
+        self.string_offsets = array('Q', [0])
+
+    def string(self, value):
+        if value is None:
+            return NONE
+        number = self.numbers.get(value)
+        if number is None:
+            number = self.numbers[value] = len(self.numbers)
+            self.string_data += value.encode()
+            self.string_offsets.append(len(self.string_data))
+        return number
+
+    def encode(self, kind, value):
+        if kind == 'str':
+            return self.string(value)
+        if kind == 'time':
+            return math.nan if value is None else (value - EPOCH).total_seconds()
+        if kind == 'float':
+            return math.nan if value is None else value
+        return NONE if value is None else int(value)
+
+    def write(self, path, tables):
+        self.arrays['strings.offsets'] = self.string_offsets
+        self.arrays['strings.data'] = array('B', bytes(self.string_data))
+        directory, offset = {}, 0
+        for name, values in self.arrays.items():
+            directory[name] = [values.typecode, values.itemsize, offset, len(values)]
+            offset = aligned(offset + values.itemsize * len(values))
+        header = json.dumps({'created_at': datetime.utcnow().isoformat(), 'byteorder': sys.byteorder,
+                             'tables': tables, 'arrays': directory}).encode()
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+                f.write(bytes(aligned(f.tell()) - f.tell()))
+                for values in self.arrays.values():
+                    values.tofile(f)
+                    f.write(bytes(aligned(f.tell()) - f.tell()))
+            # serving workers keep the old file mapped until they reopen
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+def export(path, batch_size=5000):
+    """Write the snapshot to `path`, returns {table: rows}."""
+    writer = Writer()
+    tables, rows_of = {}, {}
+    for kind, model in MODELS.items():
+        table = model.__table__
+        columns = {column.name: column_kind(column) for column in table.columns}
+        values = {name: array(TYPECODES[type_]) for name, type_ in columns.items()}
+        for row in db.session.query(*table.columns).order_by(table.c.id).yield_per(batch_size):
+            for (name, type_), value in zip(columns.items(), row):
+                values[name].append(writer.encode(type_, value))
+        ids = values['id']
+        min_id = ids[0] if ids else 0
+        index = array('i', [NONE]) * (ids[-1] - min_id + 1 if ids else 0)
+        for number, id in enumerate(ids):
+            index[id - min_id] = number
+        for name, column in values.items():
+            writer.arrays['%s.%s' % (kind, name)] = column
+        writer.arrays[kind + '.index'] = index
+        tables[kind] = {'columns': columns, 'rows': len(ids), 'min_id': min_id}
+        rows_of[kind] = lambda id, index=index, min_id=min_id: \
+            index[id - min_id] if 0 <= id - min_id < len(index) else NONE
+
+    # shows of every venue and artist, by date, as CSR: start[row]:start[row + 1]
+    dates = writer.arrays['show.date']
+    for kind in ('venue', 'artist'):
+        members = [[] for _ in range(tables[kind]['rows'])]
+        for number, id in enumerate(writer.arrays['show.%s_id' % kind]):
+            row = rows_of[kind](id) if id != NONE else NONE
+            if row != NONE and not math.isnan(dates[number]):
+                members[row].append(number)
+        start, shows, show_dates = array('I', [0]), array('i'), array('d')
+        for numbers in members:
+            numbers.sort(key=dates.__getitem__)
+            shows.extend(numbers)
+            show_dates.extend(dates[number] for number in numbers)
+            start.append(len(shows))
+        writer.arrays[kind + '.shows.start'] = start
+        writer.arrays[kind + '.shows.rows'] = shows
+        writer.arrays[kind + '.shows.dates'] = show_dates
+
+        # similar lists, best first
+        members = [[] for _ in range(tables[kind]['rows'])]
+        for entity_id, neighbor_id, score in db.session.query(
+                Similarity.entity_id, Similarity.neighbor_id, Similarity.score) \
+                .filter(Similarity.kind == kind).order_by(Similarity.entity_id, Similarity.rank) \
+                .yield_per(batch_size):
+            row, neighbor = rows_of[kind](entity_id), rows_of[kind](neighbor_id)
+            if row != NONE and neighbor != NONE:
+                members[row].append((neighbor, score))
+        start, neighbors, scores = array('I', [0]), array('i'), array('d')
+        for pairs in members:
+            neighbors.extend(neighbor for neighbor, score in pairs)
+            scores.extend(score for neighbor, score in pairs)
+            start.append(len(neighbors))
+        writer.arrays[kind + '.similar.start'] = start
+        writer.arrays[kind + '.similar.rows'] = neighbors
+        writer.arrays[kind + '.similar.scores'] = scores
+
+    writer.write(path, tables)
+    return {kind: table['rows'] for kind, table in tables.items()}
+
+
+# ----------------------------------------------------------------------------#
+# Reading.
+# ----------------------------------------------------------------------------#
+
+class Snapshot(object):
+    """A mapped snapshot file, rows come out as SimpleNamespaces shaped
+    like the models for the templates."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.memory[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a snapshot' % path)
+        length = int.from_bytes(self.memory[len(MAGIC):HEADER_SIZE], 'little')
+        header = json.loads(self.memory[HEADER_SIZE:HEADER_SIZE + length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('%s was written on a %s-endian host' % (path, header['byteorder']))
+        self.created_at = header['created_at']
+        self.tables = header['tables']
+        start = aligned(HEADER_SIZE + length)
+        view = memoryview(self.memory)
+        self.arrays = {}
+        for name, (typecode, itemsize, offset, count) in header['arrays'].items():
+            if array(typecode).itemsize != itemsize:
+                raise ValueError('%s: %s items are %d bytes here' % (path, typecode, array(typecode).itemsize))
+            begin = start + offset
+            self.arrays[name] = view[begin:begin + itemsize * count].cast(typecode)
+
+    def string(self, number):
+        if number < 0:
+            return None
+        offsets = self.arrays['strings.offsets']
+        return str(self.arrays['strings.data'][offsets[number]:offsets[number + 1]], 'utf-8')
+
+    def value(self, kind, name, row):
+        raw = self.arrays['%s.%s' % (kind, name)][row]
+        column = self.tables[kind]['columns'][name]
+        if column == 'str':
+            return self.string(raw)
+        if column in ('time', 'float'):
+            if math.isnan(raw):
+                return None
+            return EPOCH + timedelta(seconds=raw) if column == 'time' else raw
+        if raw == NONE:
+            return None
+        return bool(raw) if column == 'bool' else raw
+
+    def record(self, kind, row, names=None):
+        return SimpleNamespace(**{name: self.value(kind, name, row)
+                                  for name in names or self.tables[kind]['columns']})
+
+    def count(self, kind):
+        return self.tables[kind]['rows']
+
+    def row_of(self, kind, id):
+        index = self.arrays[kind + '.index']
+        position = id - self.tables[kind]['min_id']
+        return index[position] if 0 <= position < len(index) else NONE
+
+    def get(self, kind, id):
+        row = self.row_of(kind, id)
+        return None if row == NONE else self.record(kind, row)
+
+    def show_range(self, kind, row):
+        start = self.arrays[kind + '.shows.start']
+        return start[row], start[row + 1]
+
+    def show_counts(self, kind, row, now):
+        """(upcoming, past) shows of a venue or artist row at `now`."""
+        begin, end = self.show_range(kind, row)
+        dates = self.arrays[kind + '.shows.dates']
+        now = (now - EPOCH).total_seconds()
+        return (end - bisect.bisect_left(dates, now, begin, end),
+                bisect.bisect_right(dates, now, begin, end) - begin)
+
+    def shows(self, kind, row, now):
+        """(upcoming, past) shows of a venue or artist row, each carrying
+        the other side of the booking like Show.artist / Show.venue."""
+        other = 'artist' if kind == 'venue' else 'venue'
+        begin, end = self.show_range(kind, row)
+        upcoming, past = [], []
+        for number in self.arrays[kind + '.shows.rows'][begin:end]:
+            show = self.record('show', number, ('id', 'date', 'artist_id', 'venue_id'))
+            other_row = self.row_of(other, getattr(show, other + '_id'))
+            if other_row == NONE:
+                continue
+            setattr(show, other, self.record(other, other_row, ('id', 'name', 'image_link', 'updated_at')))
+            if show.date >= now:
+                upcoming.append(show)
+            if show.date <= now:
+                past.append(show)
+        return upcoming, past
+
+    def similar(self, kind, row):
+        start = self.arrays[kind + '.similar.start']
+        scores = self.arrays[kind + '.similar.scores']
+        neighbors = self.arrays[kind + '.similar.rows']
+        similar = []
+        for position in range(start[row], start[row + 1]):
+            neighbor = self.record(kind, neighbors[position], ('id', 'name', 'image_link'))
+            neighbor.score = scores[position]
+            similar.append(neighbor)
+        return similar
+
+
+# ----------------------------------------------------------------------------#
+# Serving.
+# ----------------------------------------------------------------------------#
+
+views = {}  # endpoint -> view answering it from the snapshot
+# endpoints that never touch the database
+PASSTHROUGH = ('static', 'assets', 'media')
+
+
+def view(endpoint):
+    def decorator(f):
+        views[endpoint] = f
+        return f
+
+    return decorator
+
+
+def current():
+    """The snapshot of this worker, reopened when the file was replaced."""
+    state = current_app.extensions['snapshot']
+    now = time.monotonic()
+    if now - state['checked_at'] >= current_app.config['SNAPSHOT_CHECK_INTERVAL']:
+        with state['lock']:
+            if now - state['checked_at'] >= current_app.config['SNAPSHOT_CHECK_INTERVAL']:
+                state['checked_at'] = now
+                stat = os.stat(state['path'])
+                if (stat.st_ino, stat.st_mtime_ns) != state['stat']:
+                    state['snapshot'] = Snapshot(state['path'])
+                    state['stat'] = (stat.st_ino, stat.st_mtime_ns)
+    return state['snapshot']
+
+
+def entity_page(kind, id, template):
+    snapshot = current()
+    row = snapshot.row_of(kind, id)
+    if row == NONE:
+        abort(404)
+    now = datetime.now()
+    entity = snapshot.record(kind, row)
+    entity.upcoming_shows, entity.past_shows = snapshot.shows(kind, row, now)
+    entity.upcoming_shows_count = len(entity.upcoming_shows)
+    entity.past_shows_count = len(entity.past_shows)
+    entity.similar = snapshot.similar(kind, row)
+    return render_template(template, **{kind: entity})
+
+
+def search_page(kind):
+    from app import basic_name_search, location_search
+    snapshot = current()
+    search_term = request.form['search_term']
+    rows = [snapshot.record(kind, row, ('id', 'name', 'city', 'state'))
+            for row in range(snapshot.count(kind))]
+    now = datetime.now()
+    counter = lambda id, param: snapshot.show_counts(kind, snapshot.row_of(kind, id), now)[0]
+    hits = basic_name_search(rows, search_term, kind, counter=counter)
+    # if name search returns 0 results, try city search using the same term
+    if len(hits) == 0:
+        hits = location_search(rows, search_term, kind, counter=counter)
+    return render_template('pages/search_venues.html', results={'count': len(hits), 'data': hits},
+                           search_term=search_term)
+
+
+@view('index')
+def index():
+    snapshot = current()
+    # rows are in id order, the newest last
+    latest = {kind: [snapshot.record(kind, row)
+                     for row in range(snapshot.count(kind) - 1, max(snapshot.count(kind) - 11, -1), -1)]
+              for kind in ('artist', 'venue')}
+    return render_template('pages/home.html', latest_artists=latest['artist'], latest_venues=latest['venue'])
+
+
+@view('venues')
+def venues():
+    snapshot = current()
+    areas = {}
+    for row in range(snapshot.count('venue')):
+        venue = snapshot.record('venue', row, ('id', 'name', 'city', 'state', 'updated_at'))
+        areas.setdefault(venue.city + ', ' + venue.state, []).append(venue)
+    return render_template('pages/venues.html', areas=areas)
+
+
+@view('show_venue')
+def show_venue(venue_id):
+    return entity_page('venue', venue_id, 'pages/show_venue.html')
+
+
+@view('search_venues')
+def search_venues():
+    return search_page('venue')
+
+
+@view('artists')
+def artists():
+    snapshot = current()
+    data = [snapshot.record('artist', row, ('id', 'name', 'updated_at'))
+            for row in range(snapshot.count('artist'))]
+    return render_template('pages/artists.html', artists=data)
+
+
+@view('show_artist')
+def show_artist(artist_id):
+    return entity_page('artist', artist_id, 'pages/show_artist.html')
+
+
+@view('search_artists')
+def search_artists():
+    return search_page('artist')
+
+
+@view('shows')
+def shows():
+    snapshot = current()
+    shows = []
+    for row in range(snapshot.count('show')):
+        show = snapshot.record('show', row, ('date', 'artist_id', 'venue_id'))
+        venue_row = snapshot.row_of('venue', show.venue_id) if show.venue_id is not None else NONE
+        artist_row = snapshot.row_of('artist', show.artist_id) if show.artist_id is not None else NONE
+        if venue_row == NONE or artist_row == NONE:
+            continue
+        shows.append({
+            "venue_id": show.venue_id,
+            "venue_name": snapshot.value('venue', 'name', venue_row),
+            "artist_id": show.artist_id,
+            "artist_name": snapshot.value('artist', 'name', artist_row),
+            "artist_image_link": snapshot.value('artist', 'image_link', artist_row),
+            "start_time": str(show.date)
+        })
+    return render_template('pages/shows.html', shows=shows)
+
+
+def serve():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint in PASSTHROUGH:
+        return None
+    if endpoint not in views:
+        raise ServiceUnavailable('The site is read-only for now, please try again later.',
+                                 retry_after=current_app.config['SNAPSHOT_RETRY_AFTER'])
+    return views[endpoint](**request.view_args)
+
+
+def init_snapshot(app):
+    app.config.setdefault('SNAPSHOT_PATH', os.path.join(app.root_path, 'snapshot.fyyur'))
+    app.config.setdefault('SNAPSHOT_SERVING', False)
+    app.config.setdefault('SNAPSHOT_CHECK_INTERVAL', 5)
+    app.config.setdefault('SNAPSHOT_RETRY_AFTER', 300)
+    if not app.config['SNAPSHOT_SERVING']:
+        return
+    path = app.config['SNAPSHOT_PATH']
+    stat = os.stat(path)
+    # mapped here, before gunicorn (preload_app) forks the workers
+    app.extensions['snapshot'] = {'path': path, 'snapshot': Snapshot(path), 'lock': threading.Lock(),
+                                  'stat': (stat.st_ino, stat.st_mtime_ns), 'checked_at': time.monotonic()}
+    # no job threads polling a database that may be down
+    app.config['JOB_WORKERS'] = 0
+    app.before_request(serve)
@@ -0,0 +1,94 @@
+# ----------------------------------------------------------------------------#
+# Embedded SQLite, for single node deployments and tests.
+#
+#   DATABASE_URL=sqlite:///fyyur.db flask db upgrade
+#
+# (relative paths are relative to the app folder). Every connection is
+# switched to WAL, where readers never wait for the writer nor it for them,
+# with synchronous=NORMAL (a power cut can lose the last commits, never the
+# database) and with a SQLITE_MMAP_SIZE memory map and a SQLITE_CACHE_SIZE KiB
+# page cache. Connections are pooled so the cache outlives a request.
+# Foreign keys are enforced as on Postgres (SQLite leaves them off by default),
+# so a venue or artist with shows can't be deleted from under them.
+#
+# SQLite has one writer at a time. A transaction that has read and then wants
+# to write while another writer committed in between fails at once with
+# "database is locked", whatever the busy timeout. So transactions of requests
+# that can write (anything but GET and HEAD), of the job threads and of the
+# CLI start with BEGIN IMMEDIATE: they take the write lock up front and queue
+# for it for up to SQLITE_BUSY_TIMEOUT ms instead. Page views, and connections
+# given the read_only execution option, keep a plain BEGIN and read their
+# snapshot alongside.
+#
+# The migrations run in batch mode there (migrations/env.py), which copies a
+# table for the ALTERs SQLite lacks, with foreign keys off while it drops and
+# renames the tables.
+# ----------------------------------------------------------------------------#
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def is_sqlite(app):
+    return make_url(app.config['SQLALCHEMY_DATABASE_URI']).drivername.startswith('sqlite')
+
+
+def is_memory(app):
+    return make_url(app.config['SQLALCHEMY_DATABASE_URI']).database in (None, '', ':memory:')
+
+
+def pragmas(config):
+    return [
+        'PRAGMA busy_timeout = %d' % config['SQLITE_BUSY_TIMEOUT'],
+        'PRAGMA foreign_keys = ON',
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA mmap_size = %d' % config['SQLITE_MMAP_SIZE'],
+        # negative: in KiB rather than pages
+        'PRAGMA cache_size = -%d' % config['SQLITE_CACHE_SIZE'],
+    ]
+
+
+def begin_statement(connection):
+    if connection.get_execution_options().get('read_only'):
+        return 'BEGIN'
+    if has_request_context() and request.method in READ_METHODS:
+        return 'BEGIN'
+    return 'BEGIN IMMEDIATE'
+
+
+def init_sqlite(app, db):
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+    app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    app.config.setdefault('SQLITE_CACHE_SIZE', 64 * 1024)
+    app.config.setdefault('SQLITE_POOL_SIZE', 5)
+    if not is_sqlite(app):
+        return
+
+    if not is_memory(app):
+        # Flask-SQLAlchemy opens a new connection per checkout for files;
+        # a pooled connection is only used by one thread at a time
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'], poolclass=QueuePool,
+            pool_size=app.config['SQLITE_POOL_SIZE'], connect_args={'check_same_thread': False})
+    statements = pragmas(app.config)
+    engine = db.get_engine(app)
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        # transactions are begun below, not by the driver
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        cursor = connection.connection.cursor()
+        cursor.execute(begin_statement(connection))
+        cursor.close()
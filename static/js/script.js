@@ -2,3 +2,80 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Typeahead for the search boxes, suggestions come from /autocomplete
+(function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        var q = input.value.trim();
+        if (!q) { list.innerHTML = ''; return; }
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', '/autocomplete?type=' + input.getAttribute('data-autocomplete') +
+          '&q=' + encodeURIComponent(q));
+        xhr.onload = function () {
+          if (xhr.status !== 200) { return; }
+          list.innerHTML = '';
+          JSON.parse(xhr.responseText).results.forEach(function (result) {
+            var option = document.createElement('option');
+            option.value = result.name;
+            list.appendChild(option);
+          });
+        };
+        xhr.send();
+      }, 100);
+    });
+  });
+})();
+
+// New bookings on venue and artist pages, pushed by /venues|artists/<id>/live
+(function () {
+  var section = document.querySelector('[data-live]');
+  if (!section || !window.EventSource) { return; }
+  var side = section.getAttribute('data-live-side');
+  var seen = {};
+
+  function setCount(which, label, count) {
+    var heading = document.querySelector('[data-live-count="' + which + '"]');
+    heading.textContent = count + ' ' + label + ' ' + (count === 1 ? 'Show' : 'Shows');
+  }
+
+  function tile(show) {
+    var other = show[side];
+    var column = document.createElement('div');
+    column.className = 'col-sm-4';
+    var box = document.createElement('div');
+    box.className = 'tile tile-show';
+    var image = document.createElement('img');
+    image.src = other.image_link || '';
+    image.alt = 'Show ' + (side === 'artist' ? 'Artist' : 'Venue') + ' Image';
+    var name = document.createElement('h5');
+    var link = document.createElement('a');
+    link.href = '/' + side + 's/' + other.id;
+    link.textContent = other.name;
+    name.appendChild(link);
+    var date = document.createElement('h6');
+    date.textContent = show.date;
+    box.appendChild(image);
+    box.appendChild(name);
+    box.appendChild(date);
+    column.appendChild(box);
+    return column;
+  }
+
+  var source = new EventSource(section.getAttribute('data-live'));
+  source.addEventListener('show', function (message) {
+    var show = JSON.parse(message.data);
+    setCount('upcoming', 'Upcoming', show.upcoming_shows_count);
+    setCount('past', 'Past', show.past_shows_count);
+    // sent again when it was booked while the stream (re)connected
+    if (seen[show.id]) { return; }
+    seen[show.id] = true;
+    document.querySelector('[data-live-shows="' + (show.upcoming ? 'upcoming' : 'past') + '"]')
+      .appendChild(tile(show));
+  });
+})();
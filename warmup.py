@@ -0,0 +1,153 @@
+# ----------------------------------------------------------------------------#
+# Warm-up after a deploy.
+#
+# A fresh release starts with nothing cached: templates are compiled on first
+# render, the autocomplete index is built by the first keystroke, fragment
+# and calendar caches are empty and Postgres has not read the hot pages. The
+# warm-up does all of that before users arrive:
+#
+#   compiles every template (into the bytecode cache when there is one)
+#   builds the autocomplete index
+#   replays the most requested GET routes, WARMUP_CONCURRENCY at a time
+#
+# Routes come from an access log (gunicorn/combined or Heroku router lines,
+# WARMUP_ACCESS_LOG), else from WARMUP_ROUTES plus the pages of the latest
+# venues and artists. Replays stop after WARMUP_MAX_SECONDS.
+#
+# With WARMUP_ON_BOOT, wsgi.py runs it in the gunicorn master: preload_app
+# imports the app before the port is bound, so the release takes no traffic
+# until it is done, and every forked worker inherits the warm caches.
+# `flask warmup` runs it on demand and reports the latency of every route.
+# ----------------------------------------------------------------------------#
+
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROUTES = ['/', '/venues', '/artists', '/shows']
+# "GET /venues/1 HTTP/1.1" 200  or  method=GET path="/venues/1" ... status=200
+ACCESS_LINE = re.compile(r'"GET (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3})')
+ROUTER_LINE = re.compile(r'method=GET path="?(?P<path>[^"\s]+)"?.* status=(?P<status>\d{3})')
+# never replayed: no database or cache behind them, or not for everyone
+SKIPPED = ('/static/', '/media/', '/admin/')
+# event streams, they never end
+STREAM = re.compile(r'/live(\?|$)')
+
+
+def routes_from_log(path, top):
+    """The `top` most requested GET routes that succeeded in `path`."""
+    hits = Counter()
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = ACCESS_LINE.search(line) or ROUTER_LINE.search(line)
+            if match and match.group('status').startswith('2') \
+                    and not match.group('path').startswith(SKIPPED) \
+                    and not STREAM.search(match.group('path')):
+                hits[match.group('path')] += 1
+    return [path for path, count in hits.most_common(top)]
+
+
+def entity_routes(count):
+    """Pages of the latest venues and artists, the ones on the home page."""
+    from models import Venue, Artist
+    routes = []
+    for model, prefix in ((Venue, '/venues/'), (Artist, '/artists/')):
+        routes.extend(prefix + str(id) for id, in
+                      model.query.with_entities(model.id).order_by(model.id.desc()).limit(count))
+    return routes
+
+
+def compile_templates(app):
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def replay(app, routes, concurrency, deadline, base_url=None):
+    """[(route, status, ms)] in `routes` order, status None when the route
+    was skipped for the deadline or the request failed."""
+    def fetch(route):
+        if time.monotonic() > deadline:
+            return route, None, 0.0
+        started = time.perf_counter()
+        try:
+            if base_url:
+                try:
+                    with urllib.request.urlopen(base_url.rstrip('/') + route, timeout=30) as response:
+                        response.read()
+                        status = response.status
+                except urllib.error.HTTPError as e:
+                    status = e.code
+            else:
+                status = app.test_client().get(route, environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code
+        except Exception:
+            app.logger.exception('warming up %s failed', route)
+            status = None
+        return route, status, (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max(concurrency, 1), thread_name_prefix='warmup') as executor:
+        return list(executor.map(fetch, routes))
+
+
+def run(app, routes=None, access_log=None, top=None, entities=None, concurrency=None,
+        base_url=None):
+    """Warm `app` up, returns [(step or route, status, ms)]."""
+    config = app.config
+    access_log = access_log or config['WARMUP_ACCESS_LOG']
+    top = top or config['WARMUP_TOP']
+    entities = config['WARMUP_ENTITIES'] if entities is None else entities
+    concurrency = concurrency or config['WARMUP_CONCURRENCY']
+    started = time.monotonic()
+    results = []
+    # a snapshot server has no database to warm
+    serving = config.get('SNAPSHOT_SERVING')
+    with app.app_context():
+        if not base_url:
+            # the requests below would start the job threads in this process,
+            # the gunicorn master or a CLI: leave those to the workers
+            app.extensions['jobs']['pid'] = os.getpid()
+
+            begin = time.perf_counter()
+            compiled = compile_templates(app)
+            results.append(('%d templates compiled' % compiled, None, (time.perf_counter() - begin) * 1000))
+            if not serving:
+                from autocomplete import get_index
+                begin = time.perf_counter()
+                get_index()
+                results.append(('autocomplete index', None, (time.perf_counter() - begin) * 1000))
+
+        if not routes:
+            if access_log and os.path.exists(access_log):
+                routes = routes_from_log(access_log, top)
+            else:
+                routes = list(config['WARMUP_ROUTES'])
+                if entities and not serving:
+                    routes.extend(entity_routes(entities))
+    results.extend(replay(app, routes, concurrency, started + config['WARMUP_MAX_SECONDS'], base_url))
+    return results
+
+
+def format_result(step, status, ms):
+    return '%8.1f ms  %-4s %s' % (ms, '-' if status is None else status, step)
+
+
+def log(app, results):
+    for step, status, ms in results:
+        app.logger.info('warmup %s', format_result(step, status, ms))
+    app.logger.info('warmup done, %d steps', len(results))
+
+
+def init_warmup(app):
+    app.config.setdefault('WARMUP_ON_BOOT', False)
+    app.config.setdefault('WARMUP_ROUTES', ROUTES)
+    app.config.setdefault('WARMUP_ACCESS_LOG', None)
+    app.config.setdefault('WARMUP_TOP', 50)
+    app.config.setdefault('WARMUP_ENTITIES', 10)
+    app.config.setdefault('WARMUP_CONCURRENCY', 4)
+    app.config.setdefault('WARMUP_MAX_SECONDS', 30)
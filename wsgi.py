@@ -0,0 +1,12 @@
+# WSGI entry point for the production server, see gunicorn.conf.py.
+import os
+
+from app import create_app
+
+# servers run the production config unless told otherwise
+app = create_app(os.environ.get('FYYUR_CONFIG', 'production'), with_migrations=False)
+
+# in the gunicorn master before the port is bound, workers fork warm
+if app.config['WARMUP_ON_BOOT']:
+    import warmup
+    warmup.log(app, warmup.run(app))